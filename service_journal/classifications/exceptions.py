@@ -24,3 +24,7 @@ class InformationMismatch(Exception):
 
 class PreconditionError(Exception):
 	pass
+
+
+class BatchFailed(Exception):
+	pass
@@ -1,24 +1,89 @@
 # DBT_Classes = Day-Block-Trip classes
+import os
+import queue
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import date
-from typing import Iterable, Mapping, Optional, List
+from time import perf_counter
+from typing import Any, Iterable, Iterator, Mapping, Optional, List, Tuple, NamedTuple
 
 from gamlogger import get_default_logger
 
 # Dynamic local imports
 try:
-    from .exceptions import PreconditionError
+    from .exceptions import BatchFailed, PreconditionError
     from .processors import get_deflt_processors
     from ..sql_handler.connection import Connection, DATE_FORMAT
-    from ..utilities.utils import date_range
+    from ..utilities.day_store import DayStore
+    from ..utilities.spill import SpillPool
+    from ..utilities.utils import date_range, TripShapeCache
 except ImportError:
-    from service_journal.classifications.exceptions import PreconditionError
+    from service_journal.classifications.exceptions import BatchFailed, PreconditionError
     from service_journal.classifications.processors import get_deflt_processors
-    from service_journal.sql_handler.connection import Connection
-    from service_journal.utilities.utils import date_range
+    from service_journal.sql_handler.connection import Connection, DATE_FORMAT
+    from service_journal.utilities.day_store import DayStore
+    from service_journal.utilities.spill import SpillPool
+    from service_journal.utilities.utils import date_range, TripShapeCache
 
 
 logger = get_default_logger(__name__)
 
+# Marks the end of the days handed between the threads of a pipelined batch.
+_PIPELINE_DONE = object()
+# How often (in seconds) threads of a pipelined batch waiting on each other check whether the batch was stopped.
+_PIPELINE_POLL_SECONDS = 0.5
+# Rough memory taken by a packaged scheduled stop or report, used to size days against hold_data_memory_mb. See
+# bench_day_memory in tests/benchmarks.py.
+_RECORD_BYTES = 300
+
+
+def _schedule_day_size(day_schedule: Mapping) -> int:
+    return _RECORD_BYTES * sum(len(trip['stops']) for block in day_schedule.values() for trip in block.values())
+
+
+def _actuals_day_size(day_actuals: Mapping) -> int:
+    return _RECORD_BYTES * sum(len(bus_data) for bus_data in day_actuals.values())
+
+
+class DayReport(NamedTuple):
+    """
+    The outcome of processing a single day in a parallel batch (see Journal.process_dates_parallel).
+    """
+    day: date
+    succeeded: bool
+    read_seconds: float = 0.0
+    process_seconds: float = 0.0
+    write_seconds: float = 0.0
+    error: Optional[str] = None
+
+
+def _process_days_worker(config: Optional[Mapping], processors: Mapping[str, List], types_: List[str],
+                         days: List[date], block: Optional[int], refresh: bool = False) -> List[DayReport]:
+    """
+    Runs in a worker process of Journal.process_dates_parallel. Opens its own journal, loads the data independent from
+    date, then reads, processes and writes each of the given days in turn.
+    """
+    reports = []
+    with Journal(config, processors=processors) as journal:
+        journal.read_day_independent()
+        for day in days:
+            start = read_end = process_end = perf_counter()
+            try:
+                journal.clear()
+                journal.read_day(day, block=block, refresh=refresh)
+                read_end = process_end = perf_counter()
+                journal.process_all(types_=types_)
+                process_end = perf_counter()
+                journal.write()
+                reports.append(DayReport(day, True, read_end - start, process_end - read_end,
+                                         perf_counter() - process_end))
+            except Exception:
+                logger.exception('Failed processing %s.', day)
+                reports.append(DayReport(day, False, read_end - start, process_end - read_end, 0.0,
+                                         traceback.format_exc()))
+    return reports
+
 
 class Journal:
     """
@@ -36,10 +101,67 @@ class Journal:
         self.avl_dict = {} if avl_dict is None else avl_dict
         self.stop_locations = {} if stop_locations is None else stop_locations
         self.shapes = {} if shapes is None else shapes
+        # Distance each bus travelled along its trip, by date then bus. Filled in by the processors.
+        self.distance_traveled = {}
+        # Number of reports rejected for being too far from their trip, by date. See the off_route_distance setting.
+        self.off_route_rejections = {}
+        # Columnar copies of avl_dict, by date. Built from the rows as they are read, see day_store.
+        self.day_stores = {}
+        # Shapes of trips by their stop sequence, kept across days. See processors.build_trip_shapes.
+        self.trip_shapes: Optional[TripShapeCache] = None
         self.connection = connection
         self.config = config
         self.processors = get_deflt_processors() if processors is None else processors
 
+    def get_setting(self, key: str, default: Any = None) -> Any:
+        """
+        Gets a value from the settings of the journal's connection, or of its config if it has no connection yet.
+        """
+        if self.connection is not None:
+            settings = self.connection.settings
+        else:
+            settings = self.config['settings'] if self.config is not None else {}
+        return settings.get(key, default)
+
+    def day_store(self, date_key: str) -> DayStore:
+        """
+        Gives the actuals of a day as a DayStore, whose per-bus reports are views on one array. Days read from the
+        database have their store built from the rows as they were fetched, other days (eg. loaded from a snapshot or
+        given to update) have it built from avl_dict the first time it is asked for. The store is kept until that
+        day's actuals change.
+
+        PARAMETERS
+        --------
+        date_key
+            The date as keyed in avl_dict.
+        """
+        day_actuals = self.avl_dict[date_key]
+        store = self.day_stores.get(date_key)
+        if store is None or len(store) != sum(len(bus_data) for bus_data in day_actuals.values()):
+            store = self.day_stores[date_key] = DayStore.from_actuals(day_actuals)
+        return store
+
+    def _use_spill_pool(self) -> Optional[SpillPool]:
+        """
+        If the hold_data_memory_mb setting is set, moves the schedule and avl_dict into stores that spill the least
+        recently used days to disk (in the spill_dir setting) whenever the days in memory go over the budget.
+
+        RETURNS
+        --------
+        Optional[SpillPool]
+            The pool the stores share, or None if the setting is not set.
+        """
+        budget = self.get_setting('hold_data_memory_mb')
+        if not budget:
+            return None
+        pool = SpillPool(int(budget * 2 ** 20), self.get_setting('spill_dir'))
+        schedule, avl_dict = pool.store('schedule', _schedule_day_size), pool.store('actuals', _actuals_day_size)
+        schedule.update(self.schedule)
+        avl_dict.update(self.avl_dict)
+        self.schedule, self.avl_dict = schedule, avl_dict
+        logger.info('Holding data within %s MB, spilling to %s.', budget, pool.directory)
+        return pool
+
     def _raise_if_not_open(self):
         if not self.connection.is_open:
             raise PreconditionError('To use this method, the journal\'s connection must be open.')
@@ -54,6 +176,8 @@ class Journal:
             self.schedule.update(schedule)
         if avl_dict is not None:
             self.avl_dict.update(avl_dict)
+            for date_key in avl_dict:
+                self.day_stores.pop(date_key, None)
         if stop_locations is not None:
             self.stop_locations.update(stop_locations)
         if shapes is not None:
@@ -68,6 +192,9 @@ class Journal:
             self.schedule.clear()
         if avl_dict:
             self.avl_dict.clear()
+            self.distance_traveled.clear()
+            self.off_route_rejections.clear()
+            self.day_stores.clear()
         if stop_locations:
             self.stop_locations.clear()
         if shapes:
@@ -100,6 +227,7 @@ class Journal:
         logger.debug('Reading shapes.')
         self._raise_if_not_open()
         self.update(shapes=self.connection.load_shapes())
+        self.trip_shapes = None
 
     def read_day_independent(self):
         logger.debug('Reading data that is independent from date.')
@@ -107,35 +235,65 @@ class Journal:
         self.read_shapes()
         logger.debug('Done reading data that is independent from date.')
 
-    def read_day(self, day, block=None):
+    def _read_day_data(self, day: date, block: Optional[int] = None, refresh: bool = False,
+                       day_stores: Optional[dict] = None) -> Tuple[Mapping, Mapping]:
+        """
+        Reads the schedule and avl_dict of a single day from the connection without storing them. If day_stores is
+        given, the day's DayStore is put in it when the day is read from the database.
+        """
+        if block is None:
+            return self.connection.read(day, refresh=refresh, day_stores=day_stores)
+        return self.connection.read(day, type_='alternate', params=[block], refresh=refresh, day_stores=day_stores)
+
+    def _update_read(self, data: Tuple[Mapping, Mapping], day_stores: Mapping):
+        """
+        Stores read schedule and avl_dict along with the DayStores built while reading them.
+        """
+        self.update(*data)
+        self.day_stores.update(day_stores)
+
+    def read_day(self, day, block=None, refresh: bool = False):
         logger.debug('Reading [%s] from connection.', day)
         self._raise_if_not_open()
-        if block is None:
-            self.update(*self.connection.read(day))
-        else:
-            self.update(*self.connection.read(day, type_='alternate', params=[block]))
+        day_stores = {}
+        self._update_read(self._read_day_data(day, block, refresh, day_stores), day_stores)
 
-    def read_days(self, date_range_: Iterable[date], block: Optional[int] = None):
+    def read_days(self, date_range_: Iterable[date], block: Optional[int] = None, refresh: bool = False):
         """
         Read date_range from a newly established connection.
 
         PARAMETERS
         --------
         date_range_
-            Iterable of date objects to load from the database.
+            Iterable of date objects to load from the database. If they are consecutive days and the range_reads
+            setting is on, they are read with a single query per view (see Connection.read_range), unless the config
+            has no range queries.
         block
             Block to read. Defaults to all blocks
+        refresh
+            If True, days are read from the database even if they have a current snapshot. See the day_snapshots
+            setting.
         """
-        logger.debug('Initiating read_days for date_range: %s for block: %s', date_range, block)
+        logger.debug('Initiating read_days for date_range: %s for block: %s', date_range_, block)
         self._raise_if_not_open()
-        if block is None:
-            for day in date_range_:
-                logger.info('Reading in data for: %s', day)
-                self.update(*self.connection.read(day))
+        days = sorted(set(date_range_))
+        # With a memory budget, days are read one at a time so each can be spilled before the next is read
+        type_ = 'default' if block is None else 'alternate'
+        if days and self.get_setting('range_reads', True) and not self.get_setting('hold_data_memory_mb') and \
+                (days[-1] - days[0]).days == len(days) - 1 and self.connection.can_read_range(type_):
+            logger.info('Reading in data from %s to %s for block: %s', days[0], days[-1], block)
+            day_stores = {}
+            if block is None:
+                data = self.connection.read_range(days[0], days[-1], refresh=refresh, day_stores=day_stores)
+            else:
+                data = self.connection.read_range(days[0], days[-1], type_='alternate', params=[block],
+                                                  refresh=refresh, day_stores=day_stores)
+            self._update_read(data, day_stores)
         else:
-            for day in date_range_:
+            for day in days:
                 logger.info('Reading in data for: %s for block: %s', day, block)
-                self.update(*self.connection.read(day, type_='alternate', params=[block]))
+                day_stores = {}
+                self._update_read(self._read_day_data(day, block, refresh, day_stores), day_stores)
 
     def add_processor(self, type_, processor):
         logger.debug('Adding %s to the %s layer of processors.', processor, type_)
@@ -180,23 +338,34 @@ class Journal:
         for type_ in types_:
             self.process(type_)
 
-    def write(self):
+    def write(self, schedule: Optional[Mapping] = None):
         """
         Writes the stored schedule and avl_dict to the output database. Requires an open connection.
+
+        Records are collected per stop and sent to the connection in chunks (see Connection.write_many).
+
+        PARAMETERS
+        --------
+        schedule
+            The schedule to write. Defaults to the stored schedule.
         """
         self._raise_if_not_open()
         # TODO: Use "packager" system in this writing
         logger.info('Beginning to write data.')
-        records_written = 0
-        for date_, day_schedule in self.schedule.items():
+        records_written = self.connection.write_many(self._iter_records(self.schedule if schedule is None else schedule))
+        logger.info('Finished writing data. %s records written.', records_written)
+
+    @staticmethod
+    def _iter_records(schedule: Mapping) -> Iterator[Mapping]:
+        """
+        Yields a record to be written for every stop in the given schedule.
+        """
+        for date_, day_schedule in schedule.items():
             for block_number, block in day_schedule.items():
                 for trip_number, trip in block.items():
                     stops = trip['stops']
                     for stop_id, stop in stops.items():
-                        logger.debug('Record being written: %s: [%s]', stop_id, stop)
-                        records_written += 1
-                        logger.info('Writing record: %s', records_written)
-                        self.connection.write({
+                        yield {
                             'date': date_,
                             'bus': stop['bus'],
                             'report_time': stop['trigger_time'],
@@ -213,24 +382,205 @@ class Journal:
                             'sched_time': stop['sched_time'].strftime(DATE_FORMAT),
                             'seen': stop['seen'],
                             'confidence_score': stop['confidence_score']
-                        }, autocommit=False)
-        self.connection.commit()
-        logger.info('Finished writing data.')
+                        }
+
+    def _process_dates_pipelined(self, from_date: date, to_date: date, types_: Iterable[str], block: Optional[int],
+                                 max_in_flight: int, refresh: bool = False):
+        """
+        Processes every day from from_date to to_date one at a time, like process_dates_batch does when not holding
+        data, but reads the next days and writes the previous ones on background threads while a day is processed.
+
+        The reading thread only uses the input connections, and the writing thread only the output connection.
+
+        PARAMETERS
+        --------
+        from_date
+            The first day to process.
+        to_date
+            The day after the last day to process.
+        types_
+            Processors to run on each day.
+        block
+            Block to process. Defaults to all blocks.
+        max_in_flight
+            The most days held in memory at once, counting from when a day starts being read until it is written.
+        """
+        logger.info('Pipelining days with at most %s days in flight.', max_in_flight)
+        in_flight = threading.BoundedSemaphore(max_in_flight)
+        stop = threading.Event()
+        read_queue, write_queue = queue.Queue(), queue.Queue()
+        write_errors = []
+
+        def read_ahead():
+            try:
+                for day in date_range(from_date, to_date):
+                    while not in_flight.acquire(timeout=_PIPELINE_POLL_SECONDS):
+                        if stop.is_set():
+                            return
+                    if stop.is_set():
+                        in_flight.release()
+                        return
+                    logger.info('Prefetching %s.', day)
+                    day_stores = {}
+                    read_queue.put((day, self._read_day_data(day, block, refresh, day_stores), day_stores))
+            except Exception as e:
+                read_queue.put(e)
+            finally:
+                read_queue.put(_PIPELINE_DONE)
+
+        def write_behind():
+            while True:
+                schedule = write_queue.get()
+                if schedule is _PIPELINE_DONE:
+                    return
+                try:
+                    if not write_errors:
+                        self.write(schedule)
+                except Exception as e:
+                    logger.error('Failed writing in the background, no further days will be written.\n%s', e)
+                    write_errors.append(e)
+                    stop.set()
+                finally:
+                    in_flight.release()
+
+        reader = threading.Thread(target=read_ahead, name='journal-read', daemon=True)
+        writer = threading.Thread(target=write_behind, name='journal-write', daemon=True)
+        reader.start()
+        writer.start()
+        try:
+            while not stop.is_set():
+                item = read_queue.get()
+                if item is _PIPELINE_DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                day, data, day_stores = item
+                logger.info('Processing %s.', day)
+                # The previous day's dictionaries now belong to the writer, so start new ones instead of clearing them.
+                self.schedule, self.avl_dict, self.distance_traveled = {}, {}, {}
+                self.off_route_rejections, self.day_stores = {}, {}
+                self._update_read(data, day_stores)
+                self.process_all(types_=types_)
+                write_queue.put(self.schedule)
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            write_queue.put(_PIPELINE_DONE)
+            writer.join()
+            # Let a reader waiting for room see the stop.
+            while reader.is_alive():
+                try:
+                    if not isinstance(read_queue.get(timeout=_PIPELINE_POLL_SECONDS), (tuple, Exception)):
+                        continue
+                except queue.Empty:
+                    continue
+                in_flight.release()
+            reader.join()
+        if write_errors:
+            raise write_errors[0]
+
+    def process_dates_parallel(self, from_date: date, to_date: date, types_: Optional[Iterable[str]] = None,
+                               block: Optional[int] = None, workers: Optional[int] = None,
+                               refresh: bool = False) -> List[DayReport]:
+        """
+        Processes every day from from_date to to_date across a pool of processes. The days are split into one
+        consecutive range per process, and each process opens its own connection, loads the data independent from
+        date, and runs the installed processors on its days. The installed processors must be picklable (eg. defined
+        at module level).
+
+        PARAMETERS
+        --------
+        from_date
+            The first day to process.
+        to_date
+            The day after the last day to process.
+        types_
+            Processors to run on each day. Defaults to all installed processors.
+        block
+            Block to process. Defaults to all blocks.
+        workers
+            Number of processes to use. Defaults to the number of CPUs.
+        refresh
+            If True, days are read from the database even if they have a current snapshot.
+
+        RETURNS
+        --------
+        List[DayReport]
+            The outcome of every day, in order.
+        """
+        types_ = list(self.processors.keys() if types_ is None else types_)
+        days = list(date_range(from_date, to_date))
+        if not days:
+            return []
+        workers = min(workers or os.cpu_count() or 1, len(days))
+        config = self.config if self.config is not None or self.connection is None else self.connection.config
+        # Split into consecutive ranges, the first len(days) % workers ranges taking one extra day.
+        shard_size, extra = divmod(len(days), workers)
+        shards, start = [], 0
+        for i in range(workers):
+            end = start + shard_size + (i < extra)
+            shards.append(days[start:end])
+            start = end
+        logger.info('Processing %s days across %s processes.', len(days), workers)
+        reports = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_process_days_worker, config, self.processors, types_, shard, block,
+                                       refresh): shard
+                       for shard in shards}
+            for future in as_completed(futures):
+                try:
+                    reports.extend(future.result())
+                except Exception:
+                    logger.exception('Worker processing %s to %s failed.', futures[future][0], futures[future][-1])
+                    reports.extend(DayReport(day, False, error=traceback.format_exc()) for day in futures[future])
+        reports.sort(key=lambda report: report.day)
+        failed = [report for report in reports if not report.succeeded]
+        logger.info('Finished processing %s days (%s failed). Total read: %.2fs, process: %.2fs, write: %.2fs.',
+                    len(reports), len(failed), sum(report.read_seconds for report in reports),
+                    sum(report.process_seconds for report in reports),
+                    sum(report.write_seconds for report in reports))
+        for report in failed:
+            logger.error('Failed processing %s:\n%s', report.day, report.error)
+        return reports
 
     def process_dates_batch(self, from_date, to_date, hold_data: bool = False, types_: Optional[Iterable[str]] = None,
-                            block: Optional[int] = None):
+                            block: Optional[int] = None, refresh: bool = False) -> Optional[List[DayReport]]:
+        """
+        Processes every day from from_date to to_date. With the batch_workers setting above 1 (and hold_data False),
+        the days are processed across processes (see process_dates_parallel), otherwise in this process. Either way,
+        a day failing fails the batch: across processes, BatchFailed is raised once every day has been attempted.
+
+        RETURNS
+        --------
+        Optional[List[DayReport]]
+            The outcome of every day when processed across processes, None otherwise.
+        """
         types_ = self.processors.keys() if types_ is None else types_
         logger.info('Processing a batch of days from %s to %s. hold_data=%s types_=%s block=%s', from_date, to_date,
                     hold_data, types_, block)
+        workers = self.get_setting('batch_workers')
+        if not hold_data and workers and workers > 1:
+            reports = self.process_dates_parallel(from_date, to_date, types_, block, workers, refresh)
+            failed = [str(report.day) for report in reports if not report.succeeded]
+            if failed:
+                raise BatchFailed(f'{len(failed)} of {len(reports)} days failed: {", ".join(failed)}.')
+            return reports
         self.read_day_independent()
         logger.debug('Day independent data has been loaded.')
+        max_in_flight = self.get_setting('pipeline_days', 3)
         if hold_data:
-            self.read_days(date_range_=date_range(from_date, to_date), block=block)
+            pool = self._use_spill_pool()
+            self.read_days(date_range_=date_range(from_date, to_date), block=block, refresh=refresh)
             self.process_all(types_=types_)
             self.write()
+            if pool is not None:
+                pool.log_stats()
+        elif max_in_flight:
+            self._process_dates_pipelined(from_date, to_date, types_, block, max_in_flight, refresh)
         else:
             for day in date_range(from_date, to_date):
                 self.clear()
-                self.read_day(day, block=block)
+                self.read_day(day, block=block, refresh=refresh)
                 self.process_all(types_=types_)
                 self.write()
@@ -1,14 +1,27 @@
-from typing import TYPE_CHECKING
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, repeat
+from operator import attrgetter
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, NamedTuple, Optional, Set, Tuple
 
+import numpy as np
 from gamlogger import get_default_logger
+from shapely.errors import EmptyPartError
+from shapely.geometry import Point
 
 # Dynamic local imports
 try:
-    from ..utilities.utils import get_shape_trip, get_distance_on_segment_from_report, \
-        get_trip_progress, replace_if_default, get_segment_length
+    from ..utilities.utils import replace_if_default, TripShapeCache, Projection, shape_path
+    from ..utilities.day_store import DayStore
+    from ..utilities.geodesy import DEFAULT_MODE, PLANAR, distances, feet_to_degrees
+    from ..utilities.planar import get_crs
+    from ..utilities.spatial_index import SpatialIndex, get_spatial_index
 except ImportError:
-    from service_journal.utilities.utils import get_shape_trip, get_distance_on_segment_from_report, \
-        get_trip_progress, replace_if_default, get_segment_length
+    from service_journal.utilities.utils import replace_if_default, TripShapeCache, Projection, shape_path
+    from service_journal.utilities.day_store import DayStore
+    from service_journal.utilities.geodesy import DEFAULT_MODE, PLANAR, distances, feet_to_degrees
+    from service_journal.utilities.planar import get_crs
+    from service_journal.utilities.spatial_index import SpatialIndex, get_spatial_index
 
 
 if TYPE_CHECKING:
@@ -19,9 +32,423 @@ if TYPE_CHECKING:
 
 logger = get_default_logger(__name__)
 
+# Raised by TripShapeCache.get for a trip whose shape cannot be built: a segment is missing from the shapes (KeyError),
+# is a MultiLineString (NotImplementedError, from its coords) or is None (EmptyPartError).
+TRIP_SHAPE_ERRORS = (KeyError, NotImplementedError, EmptyPartError)
+
+
+def _get_trip_shapes(journal: 'Journal') -> TripShapeCache:
+    """
+    Gives the journal's trip shape cache, starting a new one if it has none or its shapes were reloaded.
+    """
+    if journal.trip_shapes is None or journal.trip_shapes.shapes is not journal.shapes:
+        journal.trip_shapes = TripShapeCache(journal.shapes, journal.get_setting('trip_shape_cache_size', 2048),
+                                             journal.get_setting('distance_mode', DEFAULT_MODE),
+                                             get_crs(journal.get_setting('planar_crs')))
+    return journal.trip_shapes
+
 
 def build_trip_shapes(journal: 'Journal'):
-    journal.trip_shapes = {}
+    """
+    Builds the shape of every scheduled trip into the journal's trip shape cache, which is kept across days.
+    """
+    trip_shapes = _get_trip_shapes(journal)
+    for date_, day_schedule in journal.schedule.items():
+        for block_number, block in day_schedule.items():
+            for trip_number, trip in block.items():
+                try:
+                    trip_shapes.get(trip['stops'].keys())
+                except KeyError as e:
+                    logger.debug('Missing shape %s for trip %s of block %s on %s.', e, trip_number, block_number,
+                                 date_)
+                except TRIP_SHAPE_ERRORS as e:
+                    logger.warning('Skipping trip %s of block %s on %s, its shape cannot be built: %r', trip_number,
+                                   block_number, date_, e)
+    logger.info('Trip shapes cached: %s (hits: %s, misses: %s).', len(trip_shapes), trip_shapes.hits,
+                trip_shapes.misses)
+
+
+class StopEvent(NamedTuple):
+    """
+    What a single report contributes to a scheduled stop. Events are computed from a bus's reports without touching the
+    schedule, then applied in order with _apply_stop_event.
+    """
+    block_number: Any
+    trip_number: Any
+    stop_id: Any
+    time_: Any
+    operator: Any
+    boards: int
+    alights: int
+    onboard: int
+    bus: Any
+    # True when Avail reported the stop itself, False when the stop was inferred from the bus's position on the shape
+    observed: bool
+    # Used to score inferred stops, both in feet. See _apply_stop_event
+    segment_length: float = 0.0
+    distance_from_path: float = 0.0
+
+
+class BusResult(NamedTuple):
+    """
+    What _process_bus found for one bus over a day.
+    """
+    events: List[StopEvent]
+    # The distance the bus last travelled along a trip, in feet (None if it never left a stop)
+    distance_traveled: Optional[float]
+    # Reports rejected for being too far from their trip. See the off_route_distance setting
+    rejected: int = 0
+
+
+def _get_scheduled_stops(day_schedule: Mapping, block_number, trip_number) -> Mapping:
+    """
+    Looks up the stops of a trip without creating missing blocks or trips in the schedule.
+    """
+    if block_number not in day_schedule:
+        raise KeyError(block_number)
+    block = day_schedule[block_number]
+    if trip_number not in block:
+        raise KeyError(trip_number)
+    return block[trip_number]['stops']
+
+
+def _dict_runs(bus_data: Mapping, day_schedule: Mapping,
+               trip_shapes: TripShapeCache) -> List[Tuple[Any, List, List, List]]:
+    """
+    Splits a bus's off-stop reports into runs of consecutive reports on the same trip shape, from its packaged reports.
+    """
+    runs = []
+    for time_, report in bus_data.items():
+        if report['stop_id'] != 0:
+            continue
+        try:
+            scheduled_stops = _get_scheduled_stops(day_schedule, report['block_number'], report['trip_number'][0])
+            trip_shape = trip_shapes.get(scheduled_stops.keys())
+        except TRIP_SHAPE_ERRORS + (IndexError,):
+            continue
+        if not runs or runs[-1][0] is not trip_shape:
+            runs.append((trip_shape, [], [], []))
+        _, times, lons, lats = runs[-1]
+        times.append(time_)
+        lons.append(report['lon'])
+        lats.append(report['lat'])
+    return runs
+
+
+def _store_runs(reports: np.ndarray, times: List, day_store: DayStore, day_schedule: Mapping,
+                trip_shapes: TripShapeCache) -> List[Tuple[Any, List, np.ndarray, np.ndarray]]:
+    """
+    Does the same as _dict_runs, from the bus's reports in its DayStore. The trip shape is looked up once per change
+    of trip rather than once per report, and the coordinates are taken straight from the store's columns.
+
+    PARAMETERS
+    --------
+    reports
+        The bus's reports, see DayStore.bus.
+    times
+        The time of each of the bus's reports, in the same order.
+    """
+    off_stop = np.flatnonzero(reports['stop_id'] == day_store.code('stop_id', 0))
+    trips = reports['trip'][off_stop]
+    bounds = [0] + (np.flatnonzero(np.diff(trips)) + 1).tolist() + [len(off_stop)]
+    runs = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if start == end:
+            continue
+        block_number, trip_number = day_store.values['trip'][trips[start]]
+        try:
+            trip_shape = trip_shapes.get(_get_scheduled_stops(day_schedule, block_number, trip_number).keys())
+        except TRIP_SHAPE_ERRORS + (IndexError,):
+            continue
+        if runs and runs[-1][0] is trip_shape:
+            runs[-1][1].append(off_stop[start:end])
+        else:
+            runs.append((trip_shape, [off_stop[start:end]]))
+    runs = [(trip_shape, np.concatenate(parts)) for trip_shape, parts in runs]
+    return [(trip_shape, [times[i] for i in positions.tolist()], reports['lon'][positions], reports['lat'][positions])
+            for trip_shape, positions in runs]
+
+
+def _project_bus_reports(bus_data: Mapping, day_schedule: Mapping, trip_shapes: TripShapeCache,
+                         off_route_distance: Optional[float] = None,
+                         bus_store: Optional[Tuple[DayStore, np.ndarray]] = None) -> Tuple[Dict[Any, Projection],
+                                                                                          Set[Any]]:
+    """
+    Projects all of a bus's off-stop reports onto their trip lines, one NumPy call per run of consecutive reports on
+    the same trip shape. Progress carries over from one run to the next, as it does when projecting one report at a
+    time. Reports whose trip or shape cannot be found are left out, _process_bus reports them. If off_route_distance
+    is given, reports further than it (in feet) from their trip are rejected before being projected. If bus_store
+    (the day's DayStore and the bus's reports in it) is given, the runs are built from it instead of bus_data.
+
+    RETURNS
+    --------
+    Tuple[Dict[Any, Projection], Set[Any]]
+        The projection of each report by its time, and the times of the rejected reports.
+    """
+    if bus_store is not None:
+        day_store, reports = bus_store
+        runs = _store_runs(reports, list(bus_data), day_store, day_schedule, trip_shapes)
+    else:
+        runs = _dict_runs(bus_data, day_schedule, trip_shapes)
+
+    projections = {}
+    rejected = set()
+    current_progress = 0.0
+    for trip_shape, times, lons, lats in runs:
+        lons, lats = trip_shapes.to_shape_coords(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+        if off_route_distance is not None:
+            near = trip_shape.near(lons, lats, off_route_distance)
+            if not near.all():
+                rejected.update(time_ for time_, keep in zip(times, near.tolist()) if not keep)
+                times = [time_ for time_, keep in zip(times, near.tolist()) if keep]
+                lons, lats = lons[near], lats[near]
+                if not times:
+                    continue
+        projected = trip_shape.project_many(lons, lats, current_progress)
+        if projected is None:
+            continue
+        progress, xs, ys = projected
+        current_progress = float(progress[-1])
+        cross_tracks = distances(lats, lons, ys, xs, trip_shape.distance_mode)
+        for time_, progress_, x, y, cross_track in zip(times, progress.tolist(), xs.tolist(), ys.tolist(),
+                                                      cross_tracks.tolist()):
+            projections[time_] = Projection(progress_, Point(x, y), cross_track)
+    return projections, rejected
+
+
+def _get_spatial_index(journal: 'Journal') -> Optional[SpatialIndex]:
+    """
+    Gives the spatial index over the journal's shapes and stop locations, or None if the recover_orphans setting is
+    off.
+    """
+    if not journal.get_setting('recover_orphans', False):
+        return None
+    return get_spatial_index(journal.shapes, journal.stop_locations)
+
+
+def _find_trip(day_schedule: Mapping, block_number, stop_id, time_) -> Optional[Tuple[Any, Any]]:
+    """
+    Finds the trip of a block that goes through a stop, picking the one scheduled to be there closest to time_.
+    """
+    if block_number not in day_schedule:
+        return None
+    candidates = [(abs((trip['stops'][stop_id]['sched_time'] - time_).total_seconds()), trip_number)
+                  for trip_number, trip in day_schedule[block_number].items() if stop_id in trip['stops']]
+    if not candidates:
+        return None
+    return block_number, min(candidates, key=lambda candidate: candidate[0])[1]
+
+
+def _recover_orphans(orphans: List[Tuple[Any, Mapping]], bus, day_schedule: Mapping, trip_shapes: TripShapeCache,
+                     spatial_index: SpatialIndex, off_route_distance: Optional[float] = None) -> List[StopEvent]:
+    """
+    Recovers reports whose trip could not be used, by placing them on the nearest segment (or the nearest stop, if
+    there are no shapes) and picking the trip of their block that goes through it. Reports that did name a stop keep
+    it, and only their trip is looked for. If off_route_distance is given, reports further than it (in feet) from the
+    nearest segment or stop are not recovered.
+    """
+    lons = np.array([report['lon'] for _, report in orphans], dtype=float)
+    lats = np.array([report['lat'] for _, report in orphans], dtype=float)
+    xs, ys = trip_shapes.to_shape_coords(lons, lats)
+    xs, ys = np.asarray(xs, dtype=float).tolist(), np.asarray(ys, dtype=float).tolist()
+    segments = spatial_index.segments.nearest(xs, ys)
+    events = []
+    for (time_, report), x, y, segment in zip(orphans, xs, ys, segments):
+        observed = bool(report['stop_id'])
+        segment_length, distance_from_path = 0.0, 0.0
+        if observed:
+            stop_id = report['stop_id']
+        elif segment is not None:
+            stop_id = segment[0]
+            segment_length, path = trip_shapes.shapes[segment][0], shape_path(trip_shapes.shapes[segment])
+            snapped = path.interpolate(path.project(Point(x, y)))
+            distance_from_path = float(distances(y, x, snapped.y, snapped.x, trip_shapes.mode))
+        else:
+            max_distance = None
+            if off_route_distance is not None:
+                max_distance = off_route_distance if trip_shapes.mode == PLANAR else \
+                    feet_to_degrees(off_route_distance, y)
+            nearest_stop = spatial_index.stops.nearest(x, y, max_distance)
+            if nearest_stop is None:
+                logger.warning('Could not recover [%s].\nThere are no shapes or stop locations near enough to place it '
+                               'with.', report)
+                continue
+            stop_id = nearest_stop[0]
+            stop_y, stop_x = spatial_index.stops.location(stop_id)
+            distance_from_path = float(distances(y, x, stop_y, stop_x, trip_shapes.mode))
+        if off_route_distance is not None and distance_from_path > off_route_distance:
+            logger.warning('Could not recover [%s].\nIt is %.0f feet from the nearest segment or stop.', report,
+                           distance_from_path)
+            continue
+        trip = _find_trip(day_schedule, report['block_number'], stop_id, time_)
+        if trip is None:
+            logger.warning('Could not recover [%s].\nNo trip of block %s goes through stop %s.', report,
+                           report['block_number'], stop_id)
+            continue
+        logger.debug('Recovered report at %s on bus %s as stop %s of trip %s.', time_, bus, stop_id, trip)
+        events.append(StopEvent(*trip, stop_id, time_, report['operator'], report['boards'], report['alights'],
+                                report['onboard'], bus, observed, segment_length, distance_from_path))
+    logger.info('Recovered %s of %s orphaned reports on bus %s.', len(events), len(orphans), bus)
+    return events
+
+
+def _process_bus(date_, bus, bus_data: Mapping, day_schedule: Mapping, trip_shapes: TripShapeCache,
+                 batch: bool = True, spatial_index: Optional[SpatialIndex] = None,
+                 off_route_distance: Optional[float] = None, day_store: Optional[DayStore] = None) -> BusResult:
+    """
+    Computes the stop events of a single bus's reports for a day. Buses are independent of each other, as this does
+    not modify day_schedule.
+
+    PARAMETERS
+    --------
+    batch
+        Whether to project the bus's off-stop reports all at once (see _project_bus_reports) rather than one at a time.
+    spatial_index
+        Used to recover reports whose trip cannot be used (see _recover_orphans). They are dropped if it is None.
+    off_route_distance
+        Off-stop reports further than this (in feet) from their trip are skipped before being projected. None to keep
+        them all.
+    day_store
+        The day's DayStore, which batch projection reads the bus's reports from. Not used if its reports of the bus do
+        not line up with bus_data.
+
+    RETURNS
+    --------
+    BusResult
+        The stop events in the order of the bus's reports, the distance the bus last travelled along a trip, and how
+        many reports were rejected as off route.
+    """
+    events = []
+    orphans = []
+    distance_traveled = None
+    rejected = 0
+    # Is this going to be a problem when changing trips?
+    current_segment_progress = 0.0
+    if batch:
+        bus_store = None
+        if day_store is not None and bus in day_store and len(day_store.bus(bus)) == len(bus_data):
+            bus_store = day_store, day_store.bus(bus)
+        projections, rejected_times = _project_bus_reports(bus_data, day_schedule, trip_shapes, off_route_distance,
+                                                           bus_store)
+    for time_, report in bus_data.items():
+        try:
+            block_number = report['block_number']
+            trip_numbers = report['trip_number']
+            if not trip_numbers:
+                raise ValueError('No trip numbers, not possible!')
+            # FIXME: Handle multiple trips (check last index when adding trip numbers, etc)
+            trip_number = trip_numbers[0]
+            scheduled_stops = _get_scheduled_stops(day_schedule, block_number, trip_number)
+            if report['stop_id'] == 0:
+                # FIXME: Does this case capture last-stops? Probably not.
+                # When stop is departing/past a stop
+                trip_shape = trip_shapes.get(scheduled_stops.keys())
+                if batch:
+                    if time_ in rejected_times:
+                        rejected += 1
+                        continue
+                    projection = projections.get(time_)
+                else:
+                    x, y = trip_shapes.to_shape_coords(np.array([report['lon']], dtype=float),
+                                                       np.array([report['lat']], dtype=float))
+                    if off_route_distance is not None and not trip_shape.near(x, y, off_route_distance)[0]:
+                        rejected += 1
+                        continue
+                    projection = trip_shape.project(Point(x[0], y[0]), current_segment_progress)
+                if projection is None:
+                    logger.warning('Skipping [%s].\nRan into issues when getting distance along shape.', report)
+                    continue
+                current_segment_progress = projection.progress
+                distance_traveled = trip_shape.feet_along(current_segment_progress)
+                position = trip_shape.locate(current_segment_progress)
+                if position is None:
+                    logger.warning('Skipping [%s].\nIt is past the end of its trip.', report)
+                    continue
+                current_segment = position.stop2stop
+                stop_id = current_segment[0]
+                if stop_id not in scheduled_stops:
+                    raise KeyError(stop_id)
+                events.append(StopEvent(block_number, trip_number, stop_id, time_, report['operator'],
+                                        report['boards'], report['alights'], report['onboard'], bus, False,
+                                        trip_shapes.shapes[current_segment][0], projection.cross_track))
+
+            # We saw the stop, and know we got there via Avail
+            elif report['stop_id'] in scheduled_stops:
+                events.append(StopEvent(block_number, trip_number, report['stop_id'], time_, report['operator'],
+                                        report['boards'], report['alights'], report['onboard'], bus, True))
+
+                # TODO: Check to see if going backwards
+                # day_schedule[report['block_number']][report['trip_number']]['seq_tracker'] =
+            elif spatial_index is not None:
+                orphans.append((time_, report))
+            else:
+                logger.warning('Stop not in schedule, what happened?\nStop_ID: %s\nBlock: %s\nTrip: %s\n'
+                               'Day: %s', report['stop_id'], report['block_number'], report['trip_number'],
+                               date_)
+                # logger.debug('Cleaning up autogenerated data for this stop.')
+                # del day_schedule[block_number][trip_number]
+
+        except TRIP_SHAPE_ERRORS + (ValueError,) as e:
+            if spatial_index is not None:
+                orphans.append((time_, report))
+            elif isinstance(e, ValueError):
+                raise
+            elif not isinstance(e, KeyError):
+                logger.warning('Skipping report at %s on bus %s, the shape of trip %s of block %s cannot be built: %r',
+                               time_, bus, report['trip_number'], report['block_number'], e)
+            else:
+                logger.error('Key does not exist in scheduled_stops. These are the keys:\n'
+                             'block_number=%s\ntrip_number=%s\nKeys in report: %s\nError:\n%s',
+                             report['block_number'], report['trip_number'], report.keys(), e)
+    if orphans:
+        events.extend(_recover_orphans(orphans, bus, day_schedule, trip_shapes, spatial_index, off_route_distance))
+        # Reports come in time order, keep the events in it too
+        events.sort(key=attrgetter('time_'))
+    logger.debug('Distance traveled on bus %s: %s', bus, distance_traveled)
+    return BusResult(events, distance_traveled, rejected)
+
+
+def _apply_stop_event(day_schedule: Mapping, event: StopEvent):
+    """
+    Updates the book-keeping values of the scheduled stop an event belongs to.
+    """
+    scheduled_stop = day_schedule[event.block_number][event.trip_number]['stops'][event.stop_id]
+    if event.observed:
+        scheduled_stop['seen'] += 1
+        scheduled_stop['confidence_factors'].append(100)
+        scheduled_stop['trigger_time'] = event.time_
+        scheduled_stop['operator'] = event.operator
+    else:
+        if scheduled_stop['seen'] == 0:
+            scheduled_stop['seen'] += 1
+            scheduled_stop['confidence_factors'].append(
+                int(event.segment_length//event.distance_from_path) if event.distance_from_path else 100)
+        replace_if_default(scheduled_stop, 'trigger_time', event.time_)
+        replace_if_default(scheduled_stop, 'operator', event.operator)
+    scheduled_stop['boards'] += event.boards
+    scheduled_stop['alights'] += event.alights
+    scheduled_stop['onboard'] = max(event.onboard, scheduled_stop['onboard'])
+    scheduled_stop['bus'] = event.bus
+
+
+def _merge_bus_results(journal: 'Journal', date_, day_actual: Mapping, results: Mapping[Any, BusResult]):
+    """
+    Applies the results of every bus to the day's schedule in the order the buses appear in day_actual, so the outcome
+    does not depend on the order the results were computed in.
+    """
+    day_schedule = journal.schedule[date_]
+    day_distances = journal.distance_traveled.setdefault(date_, {})
+    rejected = 0
+    for bus in day_actual.keys():
+        result = results[bus]
+        for event in result.events:
+            _apply_stop_event(day_schedule, event)
+        if result.distance_traveled is not None:
+            day_distances[bus] = result.distance_traveled
+        rejected += result.rejected
+    if rejected:
+        logger.info('Rejected %s off-route reports on %s.', rejected, date_)
+    journal.off_route_rejections[date_] = journal.off_route_rejections.get(date_, 0) + rejected
 
 
 def process_take1(journal: 'Journal'):
@@ -30,74 +457,70 @@ def process_take1(journal: 'Journal'):
     values.
     """
     # logger.debug('Processing.\nSchedule: %s\nActuals: %s', journal.schedule, journal.avl_dict)
+    trip_shapes = _get_trip_shapes(journal)
+    batch = journal.get_setting('batch_projection', True)
+    spatial_index = _get_spatial_index(journal)
+    off_route_distance = journal.get_setting('off_route_distance')
     for date_, day_actual in journal.avl_dict.items():
         logger.info('Running process_take1 on %s.', date_)
         day_schedule = journal.schedule[date_]
+        day_store = journal.day_store(date_) if batch else None
+        results = {bus: _process_bus(date_, bus, bus_data, day_schedule, trip_shapes, batch, spatial_index,
+                                     off_route_distance, day_store)
+                   for bus, bus_data in day_actual.items()}
+        _merge_bus_results(journal, date_, day_actual, results)
 
-        for bus, bus_data in day_actual.items():
-            # Is this going to be a problem when changing trips?
-            current_segment_progress = 0.0
-            for time_, report in bus_data.items():
-                try:
-                    block_number = report['block_number']
-                    trip_numbers = report['trip_number']
-                    if not trip_numbers:
-                        raise ValueError('No trip numbers, not possible!')
-                    # FIXME: Handle multiple trips (check last index when adding trip numbers, etc)
-                    trip_number = trip_numbers[0]
-                    scheduled_stops = day_schedule[block_number][trip_number]['stops']
-                    if report['stop_id'] == 0:
-                        # FIXME: Does this case capture last-stops? Probably not.
-                        # When stop is departing/past a stop
-                        stop2stops, merged_line, trip_line_strings = get_shape_trip(scheduled_stops, journal.shapes)
-                        progress_distance = get_distance_on_segment_from_report(report, merged_line, current_segment_progress)
-                        if progress_distance is None:
-                            logger.warning('Skipping [%s].\nRan into issues when getting distance along shape.', report)
-                            continue
-                        completed_seg, current_segment_progress, distance_from_path = progress_distance
-                        day_schedule[bus]['distance_travelled'] = get_segment_length(completed_seg)
-                        current_segment = get_trip_progress(stop2stops, trip_line_strings, current_segment_progress)
-                        stop_id = current_segment[0]
-                        scheduled_stop = scheduled_stops[stop_id]
-                        if scheduled_stop['seen'] == 0:
-                            scheduled_stop['seen'] += 1
-                            segment_shape = journal.shapes[current_segment]
-                            scheduled_stop['confidence_factors'].append(int(segment_shape.length//distance_from_path))
-                        replace_if_default(scheduled_stop, 'trigger_time', time_)
-                        replace_if_default(scheduled_stop, 'operator', report['operator'])
-                        scheduled_stop['boards'] += report['boards']
-                        scheduled_stop['alights'] += report['alights']
-                        scheduled_stop['onboard'] = max(report['onboard'], scheduled_stop['onboard'])
-                        scheduled_stop['bus'] = bus
-
-                    # We saw the stop, and know we got there via Avail
-                    elif report['stop_id'] in scheduled_stops:
-                        stop_id = report['stop_id']
-                        scheduled_stop = scheduled_stops[stop_id]
-                        scheduled_stop['seen'] += 1
-                        scheduled_stop['confidence_factors'].append(100)
-                        scheduled_stop['trigger_time'] = time_
-                        scheduled_stop['operator'] = report['operator']
-                        scheduled_stop['boards'] += report['boards']
-                        scheduled_stop['alights'] += report['alights']
-                        scheduled_stop['onboard'] = max(report['onboard'], scheduled_stop['onboard'])
-                        scheduled_stop['bus'] = bus
-
-                        # TODO: Check to see if going backwards
-                        # day_schedule[report['block_number']][report['trip_number']]['seq_tracker'] =
-                    else:
-                        logger.warning('Stop not in schedule, what happened?\nStop_ID: %s\nBlock: %s\nTrip: %s\n'
-                                       'Day: %s', report['stop_id'], report['block_number'], report['trip_number'],
-                                       date_)
-                        # logger.debug('Cleaning up autogenerated data for this stop.')
-                        # del day_schedule[block_number][trip_number]
 
-                except KeyError as e:
-                    logger.error('Key does not exist in scheduled_stops. These are the keys:\n'
-                                 'block_number=%s\ntrip_number=%s\nKeys in report: %s\nError:\n%s',
-                                 report['block_number'], report['trip_number'], report.keys(), e)
-                    logger.debug('day_schedule: %s', day_schedule)
-        logger.info('Distance traveled on bus %s: %s', bus, day_schedule[bus]['distance_traveled'])
+# Set in each worker process of process_take1_parallel, so the day's schedule and the shapes are sent once per worker.
+_worker_day_schedule: Optional[Mapping] = None
+_worker_trip_shapes: Optional[TripShapeCache] = None
+_worker_batch = True
+_worker_spatial_index: Optional[SpatialIndex] = None
+_worker_off_route_distance: Optional[float] = None
+_worker_day_store: Optional[DayStore] = None
+
+
+def _init_bus_worker(day_schedule: Mapping, trip_shapes: TripShapeCache, batch: bool = True,
+                     stop_locations: Optional[Mapping] = None, off_route_distance: Optional[float] = None,
+                     day_store: Optional[DayStore] = None):
+    global _worker_day_schedule, _worker_trip_shapes, _worker_batch, _worker_spatial_index, _worker_off_route_distance
+    global _worker_day_store
+    _worker_day_schedule, _worker_trip_shapes, _worker_batch = day_schedule, trip_shapes, batch
+    _worker_off_route_distance, _worker_day_store = off_route_distance, day_store
+    # The index itself is not sent, each worker builds its own (once) from the shapes and stop locations
+    _worker_spatial_index = None if stop_locations is None else get_spatial_index(trip_shapes.shapes, stop_locations)
+
+
+def _process_buses(date_, buses: List[Tuple[Any, Mapping]]) -> List[Tuple[Any, BusResult]]:
+    return [(bus, _process_bus(date_, bus, bus_data, _worker_day_schedule, _worker_trip_shapes, _worker_batch,
+                               _worker_spatial_index, _worker_off_route_distance, _worker_day_store))
+            for bus, bus_data in buses]
+
+
+def process_take1_parallel(journal: 'Journal'):
+    """
+    Does the same as process_take1, but splits each day's buses across a pool of processes. Each worker computes the
+    stop events of its buses, which are then merged back into the schedule in the same order process_take1 would apply
+    them. The number of processes comes from the bus_workers setting (defaults to the number of CPUs).
+    """
+    workers = journal.get_setting('bus_workers') or os.cpu_count() or 1
+    trip_shapes = _get_trip_shapes(journal)
+    batch = journal.get_setting('batch_projection', True)
+    stop_locations = journal.stop_locations if journal.get_setting('recover_orphans', False) else None
+    off_route_distance = journal.get_setting('off_route_distance')
+    for date_, day_actual in journal.avl_dict.items():
+        logger.info('Running process_take1_parallel on %s with %s processes.', date_, workers)
+        buses = list(day_actual.items())
+        # Interleave buses so each worker gets a similar mix of busy and quiet buses.
+        partitions = [buses[i::workers] for i in range(min(workers, len(buses)))]
+        if not partitions:
+            continue
+        day_store = journal.day_store(date_) if batch else None
+        with ProcessPoolExecutor(max_workers=len(partitions), initializer=_init_bus_worker,
+                                 initargs=(journal.schedule[date_], trip_shapes, batch, stop_locations,
+                                           off_route_distance, day_store)) as executor:
+            results = dict(chain.from_iterable(executor.map(_process_buses, repeat(date_), partitions)))
+        _merge_bus_results(journal, date_, day_actual, results)
 
 
 def calculate_confidence(journal: 'Journal'):
@@ -118,7 +541,7 @@ def calculate_confidence(journal: 'Journal'):
 
 
 MAIN_PRESET = {
-    'prep': [],
+    'prep': [build_trip_shapes],
     'main': [process_take1],
     'post': [calculate_confidence]
 }
@@ -25,10 +25,11 @@ def input_int(prompt=''):
         return input_int(prompt)
 
 
-def input_(use_argparse: bool = False) -> Tuple[date, date, int]:
+def input_(use_argparse: bool = False) -> Tuple[date, date, int, bool]:
     """
     Gets the start and end dates either via argparse or command line. Unless argparse is True, it will prompt the user
-    to input a start and end date. It will then return a tuple of these dates interpreted using interpret_date.
+    to input a start and end date. It will then return a tuple of these dates interpreted using interpret_date, along
+    with the block and whether --refresh was passed.
 
     PARAMETERS
     --------
@@ -36,32 +37,34 @@ def input_(use_argparse: bool = False) -> Tuple[date, date, int]:
         If this is true, it will attempt to not have to prompt the user for the dates and use argparse to pull the
         arguments. These would be with the flags -sd (or --start_day) and -ed (or --end_day). Uses interpret_date on
         the acquired string. If it fails to find either of the arguments, it will fall back on default functionality.
+        --refresh reads days from the database even if they have a current snapshot (see the day_snapshots setting).
 
     RETURNS
     --------
-    Tuple[date, date]
-        A tuple containing the start and end dates as date objects.
+    Tuple[date, date, int, bool]
+        A tuple containing the start and end dates as date objects, the block (or None) and whether to refresh.
     """
     if use_argparse:
         parser = argparse.ArgumentParser()
         parser.add_argument('-sd', '--start_day', default=None, type=interpret_date)
         parser.add_argument('-ed', '--end_day', default=None, type=interpret_date)
         parser.add_argument('-b', '--block', default=None, type=int)
+        parser.add_argument('--refresh', action='store_true')
         args, _ = parser.parse_known_args()
         if args.start_day is None or args.end_day is None:
             logger.warning('use_argparse is %s, but the requested arguments cannot be found. Switching to manual.',
                            use_argparse)
         else:
-            return args.start_day, args.end_day, args.block
+            return args.start_day, args.end_day, args.block, args.refresh
     start_date_str = input('Please input the start date in a typical format.\n')
     end_date_str = input('Please input the end date in a typical format.\n')
     block = input('Please enter the block to process, or press enter to process the entire day.\n')
     block = int(block) if block else None
-    return interpret_date(start_date_str), interpret_date(end_date_str), block
+    return interpret_date(start_date_str), interpret_date(end_date_str), block, False
 
 
 def run_days(config: bool = None, hold_data: bool = False, use_argparse: bool = False, preset=MAIN_PRESET,
-             types_=DEFAULT_PROCESSOR_TYPES):
+             types_=DEFAULT_PROCESSOR_TYPES, refresh: bool = False):
     """
     Acquires the date range via input_days, then proceeds to read, process, post_process (if post_process is True), and
     write the results to the output connection in journal.
@@ -80,11 +83,15 @@ def run_days(config: bool = None, hold_data: bool = False, use_argparse: bool =
         Preset to install
     types_
         Processors to use
+    refresh
+        If True, days are read from the database even if they have a current snapshot. With use_argparse, the
+        --refresh flag does the same.
     """
-    from_date, to_date, block = input_(use_argparse=use_argparse)
+    from_date, to_date, block, refresh_requested = input_(use_argparse=use_argparse)
     with Journal(config) as journal:
         journal.install_processor_preset(preset)
-        journal.process_dates_batch(from_date, to_date, hold_data, types_, block=block)
+        journal.process_dates_batch(from_date, to_date, hold_data, types_, block=block,
+                                    refresh=refresh or refresh_requested)
 
 
 def run(use_argparse: bool = False):
@@ -1,6 +1,8 @@
+import copy
 import os
 import json
 import sys
+from typing import Mapping
 
 try:
     from ..utilities.utils import ENVIRONMENT_TRUTHY_VALUES
@@ -26,8 +28,8 @@ except ImportError:
 # JOURNAL_SQL_PORT
 #   Overrides the config's SQL port
 
-# FIXME: Currently if config file exists, it overrides all values of default value, while environment vars only replace
-# one value.
+# Values missing from the config file are taken from DEFAULT_CONFIG (see merge_defaults), and environment variables
+# replace single values.
 # Priority of config values from highest to lowest priority:
 # 1. Environment vars
 # 2. Config file value
@@ -35,6 +37,8 @@ except ImportError:
 
 
 DEFAULT_CONFIG_NAME = 'config.json'
+# Settings holding a directory, see resolve_paths
+PATH_SETTINGS = ('cache_dir', 'spill_dir')
 
 # TODO: Restructure config, turning it into a ChainMap.
 
@@ -47,6 +51,61 @@ DEFAULT_CONFIG = {
         'password': '',
         'port': None,
         '_comment': 'Warning: Stored passwords are unencrypted. For testing purposes only',
+        # Number of rows sent (and committed) per executemany call when writing
+        'write_chunk_size': 1000,
+        # Whether to use pyodbc's fast_executemany (array parameter binding) when writing
+        'fast_executemany': True,
+        # Rows fetched per fetchmany call when reading. Set to null to fetch rows one at a time.
+        'fetch_arraysize': 5000,
+        # Whether Journal.read_days reads a contiguous range of days with a single query per view
+        'range_reads': True,
+        # Whether the actuals and scheduled queries of a read run at the same time on separate threads
+        'concurrent_reads': True,
+        # When not holding data, the most days read, processed and written at once by a batch. The next day is read
+        # and the previous one written while a day is processed. Set to 0 or null to handle one day at a time.
+        'pipeline_days': 3,
+        # When not holding data, the number of processes a batch splits its days across. Set to 0 or null to process
+        # the batch in this process.
+        'batch_workers': None,
+        # When holding data, the most memory (in MB, estimated) the days held may take. The least recently used days
+        # are spilled to spill_dir and read back when needed. Set to null to keep every day in memory.
+        'hold_data_memory_mb': None,
+        # Directory days are spilled to. Set to null to use a temporary directory.
+        'spill_dir': None,
+        # Directory to cache stop locations and shapes in between runs. Set to null to always read them from the
+        # database. Relative paths (here and in spill_dir) are taken from the directory of the config file.
+        'cache_dir': '.journal_cache',
+        # Keep the packaged schedule and actuals of every day (and block) read in cache_dir, and load them from there
+        # on later reads as long as the number of rows of each view for that day is unchanged. Costs a count query per
+        # view on every read.
+        'day_snapshots': False,
+        # The most day snapshots kept, the least recently written are removed beyond it. Set to null to keep them all.
+        'day_snapshot_limit': 366,
+        # The most trip shapes (by stop sequence) kept in memory while processing
+        'trip_shape_cache_size': 2048,
+        # Project all of a bus's off-stop reports onto their trip line at once with NumPy, instead of one at a time
+        'batch_projection': True,
+        # How distances in feet are measured: 'haversine' (spherical, fastest) or 'lambert' (ellipsoidal, within about a
+        # millimeter per kilometer of geopy)
+        'distance_mode': 'lambert',
+        # Projects shapes, stop locations and reports to feet when they are loaded, so distances are Euclidean. Either
+        # null to keep degrees, the name of a projection in utilities.planar.CRS_PRESETS (eg. "ny_central"), or the
+        # parameters of a transverse Mercator projection (lat_0, lon_0, k_0, x_0 and y_0, with x_0 and y_0 in meters)
+        'planar_crs': None,
+        # Place reports whose trip cannot be used on the nearest segment (or stop) and the matching trip of their block,
+        # instead of dropping them. Off by default
+        'recover_orphans': False,
+        # Reports further than this many feet from their trip's shape are skipped (and counted by day) before being
+        # placed on it. Set to null to place every report
+        'off_route_distance': None,
+        # How shapes are read from the database: 'wkb' (binary, decoded in bulk) or 'wkt' (text, limited to 4000
+        # characters per shape)
+        'shape_format': 'wkb',
+        # When loading shapes, simplify them so they stray at most this far from the original, and snap their
+        # coordinates to a grid of this size. Both are in the shapes' units (feet if planar_crs is set, degrees
+        # otherwise, where 0.0001 is about 30 feet). Set to null to leave shapes as they are.
+        'shape_simplify_tolerance': None,
+        'shape_grid_size': None,
         'types_map': {
             'inputs': 'SELECT',
             'outputs': 'INSERT',
@@ -131,6 +190,19 @@ DEFAULT_CONFIG = {
                         'alternate': [
                             'date',
                             'block_number'
+                        ],
+                        'range': [],
+                        'range_alternate': [
+                            'block_number'
+                        ]
+                    },
+                    # Fields filtered by an inclusive range, before the filters above
+                    'between': {
+                        'range': [
+                            'date'
+                        ],
+                        'range_alternate': [
+                            'date'
                         ]
                     },
                     'order_by': [
@@ -177,6 +249,18 @@ DEFAULT_CONFIG = {
                         'alternate': [
                             'date',
                             'block_number'
+                        ],
+                        'range': [],
+                        'range_alternate': [
+                            'block_number'
+                        ]
+                    },
+                    'between': {
+                        'range': [
+                            'date'
+                        ],
+                        'range_alternate': [
+                            'date'
                         ]
                     },
                     'order_by': [
@@ -200,6 +284,9 @@ DEFAULT_CONFIG = {
                             'nullable': False,
                         }
                     },
+                    # Stops record no date they were changed, so the cache of stop locations is rebuilt when the
+                    # row count or the checksum of the rows changes
+                    'checksum_fingerprint': True,
                     'table_name': 'stops',
                     'database': 'Utilities',
                 },
@@ -229,14 +316,27 @@ DEFAULT_CONFIG = {
                             'name': 'seg_path_str',
                             'nullable': False,
                             'do_not_include': True
+                        },
+                        'shape_wkb': {
+                            'name': 'seg_path_wkb',
+                            'nullable': False
                         }
                     },
                     'special_fields': {
-                        'seg_path_str': 'CAST(seg_path AS NVARCHAR(4000)) AS seg_path_str'
+                        'seg_path_str': 'CAST(seg_path AS NVARCHAR(4000)) AS seg_path_str',
+                        'seg_path_wkb': 'seg_path.STAsBinary() AS seg_path_wkb'
+                    },
+                    # Fields left out of each statement. Shapes are read as WKB by default, and as WKT (which truncates
+                    # long shapes) if the shape_format setting asks for it or WKB cannot be read
+                    'exclude': {
+                        'default': ['shape', 'shape_str'],
+                        'wkt': ['shape', 'shape_wkb']
                     },
                     'order_by': [
                         'date_created'
                     ],
+                    # The cache of shapes is rebuilt when the row count or the latest value of this field changes
+                    'fingerprint': 'date_created',
                     'table_name': 'segment_dist',
                     'database': 'TA_ITHACA_SCHEDULE_HISTORY'
                 }
@@ -350,9 +450,55 @@ def init_config(default_config_, config_name_: str = None):
         json.dump(default_config_, f, indent=4)
 
 
+def merge_defaults(config_: Mapping, defaults: Mapping = None) -> dict:
+    """
+    Fills in whatever a config is missing from the defaults, so config files written by earlier versions pick up new
+    settings, fields and statements. Values set in the config are kept as they are.
+
+    PARAMETERS
+    --------
+    config_
+        The config, as read from its file. It is not modified.
+    defaults
+        The config to take missing values from. Defaults to DEFAULT_CONFIG.
+    """
+    if defaults is None:
+        defaults = DEFAULT_CONFIG
+    merged = copy.deepcopy(defaults)
+    for key, value in config_.items():
+        if isinstance(value, Mapping) and isinstance(merged.get(key), Mapping):
+            merged[key] = merge_defaults(value, merged[key])
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def resolve_paths(config_: dict, config_name_: str) -> dict:
+    """
+    Makes the relative directories in a config's settings (see PATH_SETTINGS) relative to the directory of its config
+    file rather than to wherever the journal happens to be run from.
+
+    PARAMETERS
+    --------
+    config_
+        The config, which is updated in place and returned.
+    config_name_
+        The path of the config file.
+    """
+    config_dir = os.path.dirname(os.path.abspath(config_name_))
+    settings_ = config_['settings']
+    for key in PATH_SETTINGS:
+        path = settings_.get(key)
+        if path and not os.path.isabs(path):
+            settings_[key] = os.path.join(config_dir, path)
+    return config_
+
+
 def read_config(config_name_: str = None, use_config: bool = True, f_use_config: bool = True):
     """
     Environment variables take priority. (JOURNAL_USE_CONFIG_FILE/JOURNAL_FORCE_USE_CONFIG_FILE/JOURNAL_CONFIG_NAME)
+    Anything missing from the config file is taken from DEFAULT_CONFIG (see merge_defaults), and relative directories
+    are taken from the config file's directory (see resolve_paths).
     """
     global config_name
     if config_name_ is None:
@@ -366,7 +512,7 @@ def read_config(config_name_: str = None, use_config: bool = True, f_use_config:
     if use_config:
         try:
             with open(config_name_, 'r') as f:
-                return json.load(f)
+                return resolve_paths(merge_defaults(json.load(f)), config_name_)
         except FileNotFoundError:
             init_config(DEFAULT_CONFIG)
             print(f'Config initialized as {config_name_}.')
@@ -374,8 +520,8 @@ def read_config(config_name_: str = None, use_config: bool = True, f_use_config:
                 print(f'Please edit {config_name_} with the appropriate information and restart.')
                 sys.exit(1)
             else:
-                return DEFAULT_CONFIG
-    return DEFAULT_CONFIG
+                return resolve_paths(merge_defaults({}), config_name_)
+    return resolve_paths(merge_defaults({}), config_name_)
 
 
 config_name, config, settings, username, password, driver, host, port, attr_sql_map, is_setup = (DEFAULT_CONFIG_NAME,
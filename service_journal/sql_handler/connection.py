@@ -1,83 +1,105 @@
-from collections import OrderedDict, defaultdict
-from typing import Dict, Optional, Tuple, Mapping, Set, Union, Iterable, List, MutableMapping, Callable, DefaultDict, Any
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple, Mapping, Set, Union, Iterable, List, MutableMapping, Callable, DefaultDict, Any, \
+    Sequence, NamedTuple
 from numbers import Number
+from time import perf_counter
 import pyodbc
-from datetime import date
+from datetime import date, timedelta
 
+from shapely import from_wkb
 from shapely.geometry import LineString
 from shapely.geometry.base import BaseGeometry
 from shapely.wkt import loads as wkt_loads
 from gamlogger import get_default_logger
 
 try:
-    from .query_builder import build_query
-    from ..utilities.utils import pull_out_name, WRITE_ORDERING, unpack, deflt_dict, reorganize_write_fields
+    from .query_builder import build_query, build_fingerprint
+    from ..utilities.cache import read_cache, write_cache
+    from ..utilities.day_store import DayStore, DayStoreBuilder
+    from ..utilities.planar import get_crs, project_shapes, project_stop_locations
+    from ..utilities.records import ScheduledStop, AvlReport, intern, intern_set, intern_tuple
+    from ..utilities.utils import pull_out_name, unpack, deflt_dict, reorganize_write_fields, chunked, reduce_shapes, \
+        date_range
     from . import config as config_module
 except ImportError:
-    from service_journal.sql_handler.query_builder import build_query
-    from service_journal.utilities.utils import pull_out_name, WRITE_ORDERING, unpack, deflt_dict
+    from service_journal.sql_handler.query_builder import build_query, build_fingerprint
+    from service_journal.utilities.cache import read_cache, write_cache
+    from service_journal.utilities.day_store import DayStore, DayStoreBuilder
+    from service_journal.utilities.planar import get_crs, project_shapes, project_stop_locations
+    from service_journal.utilities.records import ScheduledStop, AvlReport, intern, intern_set, intern_tuple
+    from service_journal.utilities.utils import pull_out_name, unpack, deflt_dict, reorganize_write_fields, chunked, \
+        reduce_shapes, date_range
     import config as config_module
 
 DATE_FORMAT = '%Y-%m-%d'
 TIME_FORMAT = '%H:%M:%S'
 DATE_TIME_FORMAT = f'{DATE_FORMAT}_{TIME_FORMAT}'
+# Number of rows sent per executemany call (and per commit) when the config does not specify write_chunk_size.
+DEFAULT_WRITE_CHUNK_SIZE = 1000
+# The views read for each day, in the order Connection._read returns them.
+DAY_VIEWS = ('scheduled', 'actuals')
 logger = get_default_logger(__name__)
 
 
+class _KeyIndex(dict):
+    """
+    Column-index map that maps every attribute to itself. Lets the positional packagers read single record mappings.
+    """
+    def __missing__(self, key):
+        return key
+
+
+_KEY_INDEX = _KeyIndex()
+
+
+def _date_key(date_value, to_date_format: str = DATE_FORMAT) -> str:
+    try:
+        return date_value.strftime(to_date_format)
+    except AttributeError:
+        if isinstance(date_value, str):
+            return date_value
+        raise
+
+
 # TODO: Add a schema file that defines all the keys for each data source.
-def _package_schedule(data: Mapping, acc: DefaultDict, to_date_format: str = DATE_FORMAT):
+def _package_schedule_row(row: Sequence, col: Mapping[str, Any], acc: DefaultDict, to_date_format: str = DATE_FORMAT):
     """
-    Packages single entry of schedule data into date-block-trip data hierarchical format (acc).
+    Packages single row of schedule data into date-block-trip data hierarchical format (acc).
     PARAMETERS
     --------
-    data
-        Single record mapping of data to insert into acc.
+    row
+        Single record of data to insert into acc.
+    col
+        Maps each attribute name to its index in row.
     acc
         The dictionary to insert data into.
     to_date_format
         The string pattern to format the date field to. See date.strftime() for more information. Default value is
         defined above.
     """
-    try:
-        date_key = data['date'].strftime(to_date_format)
-    except AttributeError:
-        if isinstance(data['date'], str):
-            date_key = data['date']
-        else:
-            raise
-    block = acc[date_key][data['block_number']]
-    if data['trip_number'] not in block:
-        block[data['trip_number']] = {
-            'route': data['route'],
+    date_key = _date_key(row[col['date']], to_date_format)
+    block = acc[date_key][row[col['block_number']]]
+    trip_number = row[col['trip_number']]
+    if trip_number not in block:
+        block[trip_number] = {
+            'route': intern(row[col['route']]),
             # TODO: Check with Tom that a trip can only be one route.
             'stops': OrderedDict(),
             'seq_tracker': 0,
         }
-    trip = block[data['trip_number']]
-    if data['stop'] is None or data['stop'] == '0':
+    trip = block[trip_number]
+    stop = row[col['stop']]
+    if stop is None or stop == '0':
         logger.warning('Got a 0 or NULL stop id in the schedule!')
-    if data['stop'] not in trip['stops']:
-        trip['stops'][data['stop']] = {
-            'sched_time': data['sched_time'],
-            'direction': data['direction'],
-            'seen': 0,
-            'bus': None,
-            'confidence_score': 0,
-            'confidence_factors': [],
-            'operator': None,
-            'trigger_time': None,
-            'boards': 0,
-            'alights': 0,
-            'onboard': 0,
-            'name': None
-            # TODO: Remove name from output
-            # 'direction': data['direction'],
-        }
+    if stop not in trip['stops']:
+        trip['stops'][stop] = ScheduledStop(row[col['sched_time']], intern(row[col['direction']]))
 
 
-def _package_actuals(data: Mapping, acc: DefaultDict, to_date_format: str = DATE_FORMAT, to_time_format: str = DATE_TIME_FORMAT):
+def _package_schedule(data: Mapping, acc: DefaultDict, to_date_format: str = DATE_FORMAT):
     """
-    Packages single entry of actual data into date-block-bus data hierarchical format (acc).
+    Packages single entry of schedule data into date-block-trip data hierarchical format (acc).
     PARAMETERS
     --------
     data
@@ -88,42 +110,95 @@ def _package_actuals(data: Mapping, acc: DefaultDict, to_date_format: str = DATE
         The string pattern to format the date field to. See date.strftime() for more information. Default value is
         defined above.
     """
-    try:
-        date_key = data['date'].strftime(to_date_format)
-    except AttributeError:
-        if isinstance(data['date'], str):
-            date_key = data['date']
-        else:
-            raise
-    bus = acc[date_key][data['bus']]
-    if data['trigger_time'] in [times.strftime(to_time_format) for times in  bus.keys()]:
-        logger.debug('Wait this happened? (two reports, same trigger_time) %s in %s', data['trigger_time'], bus.keys())
+    _package_schedule_row(data, _KEY_INDEX, acc, to_date_format)
+
+
+def _package_actuals_row(row: Sequence, col: Mapping[str, Any], acc: DefaultDict, to_date_format: str = DATE_FORMAT,
+                         to_time_format: str = DATE_TIME_FORMAT):
+    """
+    Packages single row of actual data into date-block-bus data hierarchical format (acc).
+    PARAMETERS
+    --------
+    row
+        Single record of data to insert into acc.
+    col
+        Maps each attribute name to its index in row.
+    acc
+        The dictionary to insert data into.
+    to_date_format
+        The string pattern to format the date field to. See date.strftime() for more information. Default value is
+        defined above.
+    to_time_format
+        Unused, reports are keyed by their trigger time as read. Kept so existing callers keep working.
+    """
+    date_key = _date_key(row[col['date']], to_date_format)
+    bus = acc[date_key][row[col['bus']]]
+    trigger_time = row[col['trigger_time']]
+    # Reports are keyed by their trigger time, so a duplicate is found with a single lookup.
+    trigger_time_v = bus.get(trigger_time)
+    if trigger_time_v is not None:
+        logger.debug('Wait this happened? (two reports, same trigger_time) %s on bus %s', trigger_time,
+                     row[col['bus']])
         # Mid-swapping routes
         # TODO: Idk if this is ok or not. Check with Tom later.
-        trigger_time_v = bus[data['trigger_time']]
-        trigger_time_v['route'].add(data['route'])
-        if data['trip_number'] not in trigger_time_v['trip_number']:
-            trigger_time_v['trip_number'].append(data['trip_number'])
-        trigger_time_v['boards'] += data['boards']
-        trigger_time_v['alights'] += data['alights']
-        trigger_time_v['onboard'] = max(trigger_time_v['onboard'], data['onboard'])
+        trigger_time_v.add_route(row[col['route']])
+        trigger_time_v.add_trip_number(row[col['trip_number']])
+        trigger_time_v.boards += row[col['boards']]
+        trigger_time_v.alights += row[col['alights']]
+        trigger_time_v.onboard = max(trigger_time_v.onboard, row[col['onboard']])
     else:
-        # Define a report
-        bus[data['trigger_time']] = {
-            'lat': data['latitude'],
-            'lon': data['longitude'],
-            'dir': data['direction'],
-            'operator': data['operator'],
-            'depart': data['actual_time'],
-            'boards': data['boards'],
-            'alights': data['alights'],
-            'onboard': data['onboard'],
-            'stop_id': data['stop'],
-            'name': data['name'],
-            'block_number': data['block_number'],
-            'route': {data['route']},
-            'trip_number': [data['trip_number']],
-        }
+        # Define a report. Strings repeated across the day are interned, and reports on the same route and trip share
+        # their route and trip_number.
+        bus[trigger_time] = AvlReport(
+            lat=row[col['latitude']],
+            lon=row[col['longitude']],
+            dir=intern(row[col['direction']]),
+            operator=intern(row[col['operator']]),
+            depart=row[col['actual_time']],
+            boards=row[col['boards']],
+            alights=row[col['alights']],
+            onboard=row[col['onboard']],
+            stop_id=intern(row[col['stop']]),
+            name=intern(row[col['name']]),
+            block_number=row[col['block_number']],
+            route=intern_set(row[col['route']]),
+            trip_number=intern_tuple(row[col['trip_number']]),
+        )
+
+
+def _package_actuals(data: Mapping, acc: DefaultDict, to_date_format: str = DATE_FORMAT, to_time_format: str = DATE_TIME_FORMAT):
+    """
+    Packages single entry of actual data into date-block-bus data hierarchical format (acc).
+    PARAMETERS
+    --------
+    data
+        Single record mapping of data to insert into acc.
+    acc
+        The dictionary to insert data into.
+    to_date_format
+        The string pattern to format the date field to. See date.strftime() for more information. Default value is
+        defined above.
+    """
+    _package_actuals_row(data, _KEY_INDEX, acc, to_date_format, to_time_format)
+
+
+def _package_stop_locations_row(row: Sequence, col: Mapping[str, Any], acc: MutableMapping):
+    """
+    Packages single row of stop_location data into a hierarchical format (acc).
+    PARAMETERS
+    --------
+    row
+        Single record of data to insert into acc.
+    col
+        Maps each attribute name to its index in row.
+    acc
+        The dictionary to insert data into.
+    """
+    stop = row[col['stop']]
+    location = row[col['latitude']], row[col['longitude']]
+    if stop in acc:
+        logger.warning('Overriding stop_num %s, why is there a duplicate?\nOld: %s New: %s', stop, acc[stop], location)
+    acc[stop] = location
 
 
 def _package_stop_locations(data: Mapping, acc: MutableMapping):
@@ -136,10 +211,42 @@ def _package_stop_locations(data: Mapping, acc: MutableMapping):
     acc
         The dictionary to insert data into.
     """
-    if data['stop'] in acc:
-        logger.warning('Overriding stop_num %s, why is there a duplicate?\nOld: %s New: %s', data['stop_num'],
-                       acc[data['stop_num']], (data['latitude'], data['longitude']))
-    acc[data['stop']] = (data['latitude'], data['longitude'])
+    _package_stop_locations_row(data, _KEY_INDEX, acc)
+
+
+def _package_shapes_row(row: Sequence, col: Mapping[str, Any],
+                        acc: MutableMapping[Tuple[int, int], Tuple[float, BaseGeometry]], shape_str: bool = True):
+    """
+    Packages single row of shape data into a hierarchical format (acc).
+    PARAMETERS
+    --------
+    row
+        Single record of data to insert into acc.
+    col
+        Maps each attribute name to its index in row.
+    acc
+        The dictionary to insert data into.
+    shape_str
+        Whether the shape is stored in shape_str or shape. See _package_shapes.
+    """
+    from_stop, to_stop = row[col['from_stop']], row[col['to_stop']]
+    key = from_stop, to_stop
+    if key in acc:
+        logger.warning('Overriding (%s, %s)\'s shape file.', from_stop, to_stop)
+    distance = row[col['distance_feet']]
+    if shape_str:
+        try:
+            path = wkt_loads(row[col['shape_str']])
+        except TypeError:
+            logger.error('Could not load shape_str for stopid (%s to %s). Got (%s). Distance: %s', from_stop, to_stop,
+                         row[col['shape_str']], distance)
+            path = None
+    else:
+        try:
+            path = row[col['shape']]
+        except KeyError:
+            path = LineString()
+    acc[key] = distance, path
 
 
 def _package_shapes(data: Mapping, acc: MutableMapping[Tuple[int, int], Tuple[float, BaseGeometry]],
@@ -158,22 +265,94 @@ def _package_shapes(data: Mapping, acc: MutableMapping[Tuple[int, int], Tuple[fl
         whether there was a shape or not; hence the default parameter in the case when shape_str is false and the
         interpret_linestring for when shape_str is true.
     """
-    key = data['from_stop'], data['to_stop']
+    _package_shapes_row(data, _KEY_INDEX, acc, shape_str)
+
+
+def _package_shapes_wkb_row(row: Sequence, col: Mapping[str, Any], acc: MutableMapping[Tuple[int, int], Tuple]):
+    """
+    Packages single row of shape data read as WKB into a hierarchical format (acc). The WKB is kept as is, so every
+    shape can be decoded at once with _decode_shapes once all rows are read.
+    PARAMETERS
+    --------
+    row
+        Single record of data to insert into acc.
+    col
+        Maps each attribute name to its index in row.
+    acc
+        The dictionary to insert data into.
+    """
+    from_stop, to_stop = row[col['from_stop']], row[col['to_stop']]
+    key = from_stop, to_stop
     if key in acc:
-        logger.warning('Overriding (%s, %s)\'s shape file.')
-    distance = data['distance_feet']
-    if shape_str:
-        try:
-            path = wkt_loads(data['shape_str'])
-        except TypeError:
-            logger.error('Could not load shape_str for stopid (%s to %s). Got (%s). Distance: %s', data['from_stop'], data['to_stop'], data['shape_str'], distance)
-            path = None
-    else:
-        path = data.get('shape', LineString())
-    acc[key] = distance, path
+        logger.warning('Overriding (%s, %s)\'s shape file.', from_stop, to_stop)
+    path = row[col['shape_wkb']]
+    if path is None:
+        logger.error('Could not load shape_wkb for stopid (%s to %s). Distance: %s', from_stop, to_stop,
+                     row[col['distance_feet']])
+    acc[key] = row[col['distance_feet']], bytes(path) if path is not None else None
 
 
-def process_cursor(cursor: pyodbc.Cursor, sql_attr_map: Mapping, packager: Callable, name=None, **kwargs) -> DefaultDict[str, Any]:
+def _package_shapes_wkb(data: Mapping, acc: MutableMapping[Tuple[int, int], Tuple]):
+    """
+    Packages single entry of shape data read as WKB into a hierarchical format (acc).
+    PARAMETERS
+    --------
+    data
+        Single record mapping of data to insert into acc.
+    acc
+        The dictionary to insert data into.
+    """
+    _package_shapes_wkb_row(data, _KEY_INDEX, acc)
+
+
+ROW_PACKAGERS: Mapping[Callable, Callable] = {
+    _package_schedule: _package_schedule_row,
+    _package_actuals: _package_actuals_row,
+    _package_stop_locations: _package_stop_locations_row,
+    _package_shapes: _package_shapes_row,
+    _package_shapes_wkb: _package_shapes_wkb_row,
+}
+"""
+Maps each packager to its positional counterpart, which reads rows straight from the cursor through a column-index map
+instead of a per-row dictionary. Used by process_cursor when streaming.
+"""
+
+
+def _encode_shapes(shapes: Mapping[Tuple[int, int], Tuple[float, BaseGeometry]]) -> Dict[Tuple[int, int], Tuple]:
+    """
+    Swaps every shape for its WKB so it can be cached compactly, and decoded without parsing text.
+    """
+    return {key: (distance, path.wkb if isinstance(path, BaseGeometry) else path)
+            for key, (distance, path) in shapes.items()}
+
+
+def _decode_shapes(shapes: Mapping[Tuple[int, int], Tuple]) -> Dict[Tuple[int, int], Tuple[float, BaseGeometry]]:
+    """
+    Reverses _encode_shapes. Every WKB is decoded in a single call. Shapes that cannot be decoded become None.
+    """
+    keys = [key for key, (_, path) in shapes.items() if isinstance(path, bytes)]
+    paths = from_wkb([shapes[key][1] for key in keys], on_invalid='ignore').tolist()
+    decoded = dict(zip(keys, paths))
+    invalid = sum(path is None for path in paths)
+    if invalid:
+        logger.error('Could not decode %s of %s shapes.', invalid, len(keys))
+    return {key: (distance, decoded.get(key, path)) for key, (distance, path) in shapes.items()}
+
+
+class QueryPlan(NamedTuple):
+    """
+    A statement compiled from the config, along with the maps needed to bind its results or parameters.
+    """
+    attr_sql_map: Mapping[str, str]
+    sql_attr_map: Mapping[str, str]
+    attrs: List[str]
+    query: str
+
+
+def process_cursor(cursor: pyodbc.Cursor, sql_attr_map: Mapping, packager: Callable, name=None,
+                   arraysize: Optional[int] = None,
+                   on_rows: Optional[Callable[[Sequence[Sequence], Mapping[str, int]], None]] = None,
+                   **kwargs) -> DefaultDict[str, Any]:
     """
     Uses the cursor and packager to load the data and returns it.
     PARAMETERS
@@ -187,18 +366,42 @@ def process_cursor(cursor: pyodbc.Cursor, sql_attr_map: Mapping, packager: Calla
         One of the packagers which takes a single record from the SQL table, and inserts it into a dictionary.
     name
         Used for the logger, just the option to have a name associated to this packaging process.
+    arraysize
+        If given, streams the rows arraysize at a time with fetchmany, handing them to the packager's positional
+        counterpart (see ROW_PACKAGERS) when it has one. Otherwise rows are fetched one at a time.
+    on_rows
+        If given, also called with every batch of fetched rows, and the index of each attribute in them.
     """
     if name:
         logger.info('Processing cursor for %s.', name)
     acc = deflt_dict()
-    row = cursor.fetchone()
     attr_col_names = [sql_attr_map[col[0]] for col in cursor.description]
+    col = {attr: idx for idx, attr in enumerate(attr_col_names)}
     record_count = 0
-    while row:
-        data = dict(zip(attr_col_names, row))
-        packager(data, acc, **kwargs)
+    if arraysize:
+        cursor.arraysize = arraysize
+        row_packager = ROW_PACKAGERS.get(packager)
+        rows = cursor.fetchmany(arraysize)
+        while rows:
+            if row_packager is not None:
+                for row in rows:
+                    row_packager(row, col, acc, **kwargs)
+            else:
+                for row in rows:
+                    packager(dict(zip(attr_col_names, row)), acc, **kwargs)
+            if on_rows is not None:
+                on_rows(rows, col)
+            record_count += len(rows)
+            rows = cursor.fetchmany(arraysize)
+    else:
         row = cursor.fetchone()
-        record_count += 1
+        while row:
+            data = dict(zip(attr_col_names, row))
+            packager(data, acc, **kwargs)
+            if on_rows is not None:
+                on_rows((row,), col)
+            row = cursor.fetchone()
+            record_count += 1
     if name:
         logger.info('Finished processing cursor for %s. Processed %s records.', name, record_count)
     return acc
@@ -211,9 +414,12 @@ class Connection:
     username: str
     password: str
     host: str
+    fetch_arraysize: Optional[int]
     attr_sql_map: Mapping
     sql_attr_map: Mapping
-    connections: Dict[str, Optional[pyodbc.Connection]]
+    connections: Dict[str, Dict[str, Optional[pyodbc.Connection]]]
+    plans: Dict[Tuple[str, str, str], 'QueryPlan']
+    cursors: Dict[Tuple[str, str], pyodbc.Cursor]
 
     def __init__(self, config: Mapping = None, open_: bool = False):
         if config is not None:
@@ -228,6 +434,10 @@ class Connection:
             self.password = settings['password']
             self.host = settings['host']
             self.port = settings['port']
+            self.fetch_arraysize = settings.get('fetch_arraysize')
+            self.crs = get_crs(settings.get('planar_crs'))
+            # How much load_shapes last reduced the shapes, if it did
+            self.shape_reduction = None
             self.is_open = False
         except KeyError as e:
             print(f'Error: Key ({e.args[0]}) not found in config.json. If this is your first time '
@@ -238,7 +448,7 @@ class Connection:
         attr_sql_map = {
             type_: {
                 view_name: view_data['fields'] for view_name, view_data in type_settings.items()
-            } for type_, type_settings in self.config['attr_sql_map'].items()
+            } for type_, type_settings in settings['attr_sql_map'].items()
         }
 
         # Invert attr_sql_map
@@ -262,6 +472,10 @@ class Connection:
         self.attr_sql_map = attr_sql_map
         self.sql_attr_map = sql_attr_map
 
+        # Compile every statement the config defines once, rather than on every execute.
+        self.plans = self._compile_plans()
+        self.cursors = {}
+
         if open_:
             self.open()
 
@@ -286,30 +500,35 @@ class Connection:
                              'Connection?\n%s', conn_name_, e)
                 errors.add(e)
 
-        for conn_name, conn in self.connections.items():
-            if conn is not None:
-                attempt_close(conn_name, conn)
+        self.cursors.clear()
+        for type_, type_connections in self.connections.items():
+            for view_name, conn in type_connections.items():
+                if conn is not None:
+                    attempt_close(f'{type_}:{view_name}', conn)
+                    type_connections[view_name] = None
 
         if errors:
-            logger.error('Ran into errors while closing connections. Errors:\n%s', '\n'.join(errors))
+            logger.error('Ran into errors while closing connections. Errors:\n%s', '\n'.join(map(str, errors)))
         logger.info('Connections closed.')
         self.is_open = False
         return errors
 
-    def _connect(self, view_config: str) -> pyodbc.Connection:
+    def _connect(self, type_: str, view_name: str) -> pyodbc.Connection:
         """
         Opens a connection to the specified config path.
 
         PARAMETERS
         --------
-        view_config
+        type_
+            The type of the view as defined in the config. (eg. inputs or outputs)
+        view_name
             String representation of the table to read (from the config)
         RETURNS
         --------
         pyodbc.Connection
             A connection to the given table.
         """
-        conn_config = self.config['settings']['attr_sql_map'][view_config]
+        conn_config = self.settings['attr_sql_map'][type_][view_name]
         database = conn_config['database']
 
         # Get and remove Nones from additional args. @see pyodbc.connect for additional parameters
@@ -320,7 +539,7 @@ class Connection:
                 additional_args[key] = value
 
         logger.debug(f'Connecting to {database} on {self.host}:{self.port} using {self.driver} and the credentials user'
-                     f':{self.username} pass:****, and the table_config: {view_config}')
+                     f':{self.username} pass:****, and the table_config: {type_}:{view_name}')
 
         try:
         # noinspection PyArgumentList
@@ -332,92 +551,326 @@ class Connection:
                          f'{", ".join(map(str, additional_args.items()))}')
             raise
 
-    def _exc_query(self, query_name, params=None, type_: str = 'inputs', which_query='default'):
+    def _build_statement(self, query_name: str, type_: str = 'inputs', which_query: str = 'default') -> 'QueryPlan':
         """
-        Executes a single query defined in the config.
+        Builds the SQL statement for a single query defined in the config. Prefer Connection._get_plan, which reuses
+        the statements compiled when the config was loaded.
 
         PARAMETERS
         --------
-        conn_name
-            The name of the connection as defined in Connection.
         query_name
             The name of the query in the config.
-        params
-            The parameters to be passed to the SQL statement.
+        type_
+            The type of the query as defined in the config. (eg. inputs or outputs)
         which_query
             The type of query as defined in the config.
+
+        RETURNS
+        --------
+        QueryPlan
+            The attr_sql_map and sql_attr_map of the query, the attribute names in the order the statement expects
+            them, and the statement itself.
         """
-        logger.debug('Executing query (%s:%s) on connection (%s).', query_name, which_query)
-        params = [] if params is None else params
-        query_type = self.settings['types_map'][type_]
-        query_config = self.config['settings']['attr_sql_map'][type_][query_name]
-        cursor = self.connections[type_][query_name].cursor()
-        attr_sql_map = pull_out_name(self.attr_sql_map[query_name])
-        sql_attr_map = pull_out_name(self.sql_attr_map[query_name])
+        query_config = self.settings['attr_sql_map'][type_][query_name]
+        attr_sql_map = pull_out_name(self.attr_sql_map[type_][query_name])
+        sql_attr_map = pull_out_name(self.sql_attr_map[type_][query_name])
         # attr_sql_map and queries are from config, and therefore trusted
         try:
-            query_type = query_config['type'].upper()
+            query_type = query_config.get('type', self.settings['types_map'][type_]).upper()
         except KeyError:
-            logger.error('While executing query %s, could not identify the query type in query config (%s)', query_name,
+            logger.error('While building query %s, could not identify the query type in query config (%s)', query_name,
                          query_config)
             raise
         table_name = query_config['table_name']
-        # Remove any fields to not be included in query
-        not_included = filter(lambda x: query_config['fields'][x].get('do_not_include'), set(attr_sql_map.keys()))
         # Get SQL name for each attr in filters and order_by. Cast to list (order matters)
         filters = list(map(lambda x: attr_sql_map[x], query_config['filters'][which_query])) if 'filters' in \
                                                                                                 query_config else None
         ordering = list(map(lambda x: attr_sql_map[x], query_config['order_by'])) if 'order_by' in \
                                                                                      query_config else None
-        special_fields = query_config.get('special_fields')
-        # Cast as set to remove duplicates, and for difference function
-        fields = attr_sql_map.keys()
-        logger.debug('Intermediary fields: %s', fields)
-        fields = list(unpack(list(fields), attr_sql_map))
+        between = list(map(lambda x: attr_sql_map[x], query_config.get('between', {}).get(which_query, [])))
+        excluded = set(query_config.get('exclude', {}).get(which_query, []))
+        attrs = [attr for attr in attr_sql_map.keys() if attr not in excluded]
+        included = {attr_sql_map[attr] for attr in attrs}
+        special_fields = {field: replacement for field, replacement in query_config.get('special_fields', {}).items()
+                          if field in included}
+        if query_type == 'INSERT':
+            # Columns are written in the order reorganize_write_fields gives, anything it leaves out follows in config
+            # order.
+            ordered_attrs = reorganize_write_fields(set(attr_sql_map.values()), attr_sql_map)
+            attrs = ordered_attrs + [attr for attr in attrs if attr not in ordered_attrs]
+        logger.debug('Intermediary fields: %s', attrs)
+        fields = list(unpack(attrs, attr_sql_map))
         logger.debug('Unpacked fields: %s', fields)
-        query = build_query(query_type, fields, table_name, filters, ordering, special_fields)
+        query = build_query(query_type, fields, table_name, filters, ordering, special_fields, between)
+        return QueryPlan(attr_sql_map, sql_attr_map, attrs, query)
+
+    def _compile_plans(self) -> Dict[Tuple[str, str, str], 'QueryPlan']:
+        """
+        Builds the statement of every query defined in the config. A query has one statement per entry in its filters
+        and exclude, or a single 'default' statement if it has neither.
+
+        RETURNS
+        --------
+        Dict[Tuple[str, str, str], QueryPlan]
+            The compiled statements keyed by (type_, query_name, which_query).
+        """
+        plans = {}
+        for type_, type_settings in self.settings['attr_sql_map'].items():
+            for query_name, query_config in type_settings.items():
+                which_queries = {**query_config.get('filters', {}), **query_config.get('exclude', {})} or {'default': None}
+                for which_query in which_queries.keys():
+                    plans[type_, query_name, which_query] = self._build_statement(query_name, type_, which_query)
+        logger.debug('Compiled %s query plans.', len(plans))
+        return plans
+
+    def _get_plan(self, query_name: str, type_: str = 'inputs', which_query: str = 'default') -> 'QueryPlan':
+        """
+        Gets the compiled statement for a single query defined in the config, compiling it if it was not compiled
+        when the config was loaded.
+        """
+        key = type_, query_name, which_query
+        try:
+            return self.plans[key]
+        except KeyError:
+            plan = self.plans[key] = self._build_statement(query_name, type_, which_query)
+            return plan
+
+    def _get_cursor(self, query_name: str, type_: str = 'inputs') -> pyodbc.Cursor:
+        """
+        Gets the cursor of the connection to the given view, creating it on first use. Each view has its own
+        connection, and statements on it run one after another, so the cursor is reused between executes.
+        """
+        key = type_, query_name
+        cursor = self.cursors.get(key)
+        if cursor is None:
+            cursor = self.cursors[key] = self.connections[type_][query_name].cursor()
+            if type_ == 'outputs':
+                # Binds every chunk's parameters in one array instead of a round trip per row. @see pyodbc's
+                # fast_executemany
+                cursor.fast_executemany = self.settings.get('fast_executemany', True)
+        return cursor
+
+    def _exc_query(self, query_name, params=None, type_: str = 'inputs', which_query='default'):
+        """
+        Executes a single query defined in the config.
+
+        PARAMETERS
+        --------
+        query_name
+            The name of the query in the config.
+        params
+            The parameters to be passed to the SQL statement.
+        type_
+            The type of the query as defined in the config. (eg. inputs or outputs)
+        which_query
+            The type of query as defined in the config.
+        """
+        logger.debug('Executing query (%s:%s) on connection (%s).', query_name, which_query, type_)
+        params = [] if params is None else params
+        cursor = self._get_cursor(query_name, type_)
+        attr_sql_map, sql_attr_map, _, query = self._get_plan(query_name, type_, which_query)
         logger.debug('Executing query:\n%s', query)
         try:
             cursor.execute(query, *params)
         except pyodbc.Error:
-            cursor.execute(f'SELECT TOP 1 FROM {table_name}')
+            table_name = self.settings['attr_sql_map'][type_][query_name]['table_name']
+            cursor.execute(f'SELECT TOP 1 * FROM {table_name}')
             column_names = [column[0] for column in cursor.description]
             logger.error('Pyodbc error, see raised exception. Query being run:\n%s\nParams: %s, columns: %s', query, list(params), column_names)
             raise
-        logger.debug('Finished executing query (%s) on connection (%s).', query_name)
+        logger.debug('Finished executing query (%s) on connection (%s).', query_name, type_)
         return (attr_sql_map, sql_attr_map), cursor
 
+    def _exc_many(self, query_name: str, rows: Iterable[Sequence], type_: str = 'outputs',
+                  which_query: str = 'default', chunk_size: Optional[int] = None, autocommit: bool = True) -> int:
+        """
+        Executes a single query defined in the config once per row, sending the rows in chunks through executemany.
+
+        PARAMETERS
+        --------
+        query_name
+            The name of the query in the config.
+        rows
+            Parameter tuples, ordered the way the statement expects them (see Connection._build_statement).
+        type_
+            The type of the query as defined in the config. (eg. inputs or outputs)
+        which_query
+            The type of query as defined in the config.
+        chunk_size
+            Number of rows to send per executemany call. Defaults to the config's write_chunk_size.
+        autocommit
+            If true, commits after every chunk.
+
+        RETURNS
+        --------
+        int
+            The number of rows executed.
+        """
+        chunk_size = self.settings.get('write_chunk_size', DEFAULT_WRITE_CHUNK_SIZE) if chunk_size is None \
+            else chunk_size
+        connection = self.connections[type_][query_name]
+        cursor = self._get_cursor(query_name, type_)
+        query = self._get_plan(query_name, type_, which_query).query
+        logger.debug('Executing many:\n%s', query)
+        row_count = 0
+        start = perf_counter()
+        for chunk in chunked(rows, chunk_size):
+            try:
+                cursor.executemany(query, chunk)
+            except pyodbc.Error:
+                logger.error('Pyodbc error, see raised exception. Query being run:\n%s\nFirst row of chunk: %s', query,
+                             chunk[0])
+                raise
+            if autocommit:
+                connection.commit()
+            row_count += len(chunk)
+        elapsed = perf_counter() - start
+        logger.info('Executed %s rows of (%s:%s) in %.2fs (%.0f rows/sec).', row_count, type_, query_name, elapsed,
+                    row_count / elapsed if elapsed else 0)
+        return row_count
+
     def open(self):
         """
         Open all the connections to the tables for the config.
         """
-        # views_tables = self.attr_sql_map['views_tables']
         logger.info('Opening connections.')
+        self.cursors.clear()
         self.connections = {
-            'actuals_conn': self._connect('actuals'),
-            'scheduled_conn': self._connect('scheduled'),
-            'output_conn': self._connect('output'),
-            'stop_locations_conn': self._connect('stop_locations'),
-            'shapes_conn': self._connect('shapes')
+            type_: {
+                view_name: self._connect(type_, view_name) for view_name in type_settings.keys()
+            } for type_, type_settings in self.attr_sql_map.items()
         }
         self.is_open = True
         logger.info('Connections opened.')
 
+    def fingerprint(self, query_name: str, type_: str = 'inputs') -> Tuple:
+        """
+        Runs a cheap probe of a view whose result changes when the view's data does. Probes the row count, the
+        latest value of the query's fingerprint field if the config defines one, and a checksum of every row if the
+        config sets checksum_fingerprint.
+
+        PARAMETERS
+        --------
+        query_name
+            The name of the query in the config.
+        type_
+            The type of the query as defined in the config. (eg. inputs or outputs)
+        """
+        query_config = self.settings['attr_sql_map'][type_][query_name]
+        max_field = query_config.get('fingerprint')
+        if max_field is not None:
+            max_field = self.attr_sql_map[type_][query_name][max_field]['name']
+        query = build_fingerprint(query_config['table_name'], max_field,
+                                  checksum=query_config.get('checksum_fingerprint', False))
+        logger.debug('Fingerprinting (%s:%s):\n%s', type_, query_name, query)
+        return tuple(self._get_cursor(query_name, type_).execute(query).fetchone())
+
+    def fingerprint_days(self, query_name: str, which_query: str, params: List) -> Dict[str, Tuple]:
+        """
+        Probes a view the way fingerprint does, but for every date a query reads at once, with a single query grouped
+        by date.
+
+        PARAMETERS
+        --------
+        query_name
+            The name of the input query in the config.
+        which_query
+            The type of query as defined in the config, whose filters (and between) are applied.
+        params
+            The parameters the query would be executed with.
+
+        RETURNS
+        --------
+        Dict[str, Tuple]
+            The probe of every date that has rows, keyed like the packaged data.
+        """
+        query_config = self.settings['attr_sql_map']['inputs'][query_name]
+        attr_sql_map = pull_out_name(self.attr_sql_map['inputs'][query_name])
+        max_field = query_config.get('fingerprint')
+        filters = [attr_sql_map[attr] for attr in query_config.get('filters', {}).get(which_query, [])]
+        between = [attr_sql_map[attr] for attr in query_config.get('between', {}).get(which_query, [])]
+        query = build_fingerprint(query_config['table_name'], attr_sql_map[max_field] if max_field else None, filters,
+                                  between, group_by=attr_sql_map['date'])
+        logger.debug('Fingerprinting days (inputs:%s):\n%s', query_name, query)
+        rows = self._get_cursor(query_name).execute(query, *params).fetchall()
+        return {_date_key(row[0]): tuple(row[1:]) for row in rows}
+
+    def _load_cached(self, query_name: str, load: Callable[[], Mapping], encode: Callable[[Mapping], Any],
+                     decode: Callable[[Any], Mapping]) -> Mapping:
+        """
+        Loads data independent from date through the on-disk cache in the cache_dir setting. The cache is rebuilt with
+        load whenever the view's fingerprint changes. Loads straight from the database if cache_dir is not set.
+        """
+        cache_dir = self.settings.get('cache_dir')
+        if not cache_dir:
+            return load()
+        path = os.path.join(cache_dir, f'{query_name}.cache')
+        fingerprint = self.fingerprint(query_name)
+        cached = read_cache(path, fingerprint)
+        if cached is not None:
+            logger.info('Loaded %s from the cache at %s.', query_name, path)
+            return decode(cached)
+        data = load()
+        write_cache(path, fingerprint, encode(data))
+        logger.info('Cached %s at %s.', query_name, path)
+        return data
+
+    def _read_stop_loc(self) -> Mapping[str, Tuple[Number, Number]]:
+        (stop_attr_sql_map, stop_sql_attr_map), cursor = self._exc_query('stop_locations')
+        return process_cursor(cursor, stop_sql_attr_map, _package_stop_locations, arraysize=self.fetch_arraysize)
+
     def load_stop_loc(self) -> Mapping[str, Tuple[Number, Number]]:
         """
-        Load stop locations from database. These are the geo-cords.
+        Load stop locations from database. These are the geo-cords, projected to feet if the planar_crs setting is set.
         """
-        (stop_attr_sql_map, stop_sql_attr_map), cursor = self._exc_query('stop_locations_conn', 'stop_locations')
-        return process_cursor(cursor, stop_sql_attr_map, _package_stop_locations)
+        stop_locations = self._load_cached('stop_locations', self._read_stop_loc, dict, dict)
+        if self.crs is not None:
+            stop_locations = project_stop_locations(stop_locations, self.crs)
+        return stop_locations
 
-    def load_shapes(self) -> Mapping[Tuple[int, int], Tuple]:
+    def _read_shapes(self) -> Mapping[Tuple[int, int], Tuple]:
         """
-        Load shapes from database. These are the coordinated of every vertices on the path between every stop.
+        Reads shapes as WKB and decodes them all at once, unless the shape_format setting is 'wkt'. Falls back to WKT
+        if the shapes query does not select shape_wkb (eg. a config written before it existed), or if the WKB query
+        fails (eg. a view that cannot call STAsBinary).
         """
-        # Execute query
-        (attr_sql_map, sql_attr_map), cursor = self._exc_query('shapes_conn', 'shapes')
+        if self.settings.get('shape_format', 'wkb') == 'wkb' and 'shape_wkb' not in self._get_plan('shapes').attrs:
+            logger.warning('The shapes query does not select shape_wkb, reading shapes as WKT instead.')
+        elif self.settings.get('shape_format', 'wkb') == 'wkb':
+            try:
+                (attr_sql_map, sql_attr_map), cursor = self._exc_query('shapes')
+                start = perf_counter()
+                shapes = process_cursor(cursor, sql_attr_map, _package_shapes_wkb, arraysize=self.fetch_arraysize)
+                read = perf_counter()
+                shapes = _decode_shapes(shapes)
+                logger.info('Read %s shapes as WKB in %.2fs (decoding: %.2fs).', len(shapes), perf_counter() - start,
+                            perf_counter() - read)
+                return shapes
+            except pyodbc.Error as e:
+                logger.warning('Could not read shapes as WKB, reading them as WKT instead.\n%s', e)
+        (attr_sql_map, sql_attr_map), cursor = self._exc_query('shapes', which_query='wkt')
+        return process_cursor(cursor, sql_attr_map, _package_shapes, arraysize=self.fetch_arraysize)
 
-        return process_cursor(cursor, sql_attr_map, _package_shapes)
+    def load_shapes(self) -> Mapping[Tuple[int, int], Tuple]:
+        """
+        Load shapes from database. These are the coordinated of every vertices on the path between every stop, projected
+        to feet if the planar_crs setting is set. They are then simplified and snapped to a grid if the
+        shape_simplify_tolerance or shape_grid_size settings are set. The cache always holds them in degrees, as read.
+        """
+        shapes = self._load_cached('shapes', self._read_shapes, _encode_shapes, _decode_shapes)
+        if self.crs is not None:
+            start = perf_counter()
+            shapes = project_shapes(shapes, self.crs)
+            logger.info('Projected %s shapes in %.2fs.', len(shapes), perf_counter() - start)
+        tolerance, grid_size = self.settings.get('shape_simplify_tolerance'), self.settings.get('shape_grid_size')
+        if tolerance or grid_size:
+            start = perf_counter()
+            shapes, self.shape_reduction = reduce_shapes(shapes, tolerance, grid_size)
+            logger.info('Reduced %s shapes from %s to %s vertices (%.1f%% fewer) in %.2fs.',
+                        self.shape_reduction.shapes, self.shape_reduction.vertices_before,
+                        self.shape_reduction.vertices_after, 100 * self.shape_reduction.reduction,
+                        perf_counter() - start)
+        return shapes
 
     def __enter__(self):
         self.open()
@@ -426,10 +879,128 @@ class Connection:
     def __exit__(self, exception_type, exception_value, traceback):
         self.close()
 
-    def read(self, date_: date, type_: str = 'default',
-             params: Optional[List] = None) -> Tuple[Mapping, Mapping]:
+    def _read_view(self, query_name: str, params: List, which_query: str, packager: Callable,
+                   on_rows: Optional[Callable] = None) -> DefaultDict[str, Any]:
+        """
+        Runs a single input query with the given parameters and packages its results, logging how long each took.
+        on_rows is passed on to process_cursor.
+        """
+        start = perf_counter()
+        (attr_sql_map, sql_attr_map), cursor = self._exc_query(query_name, params=params, which_query=which_query)
+        executed = perf_counter()
+        acc = process_cursor(cursor, sql_attr_map, packager, query_name, self.fetch_arraysize, on_rows)
+        packaged = perf_counter()
+        logger.info('Read %s in %.2fs (query: %.2fs, packaging: %.2fs).', query_name, packaged - start,
+                    executed - start, packaged - executed)
+        return acc
+
+    def _read(self, params: List, which_query: str,
+              day_stores: Optional[MutableMapping[str, DayStore]] = None) -> Tuple[Mapping, Mapping]:
+        """
+        Runs the scheduled and actuals queries with the given parameters and packages their results. If the
+        concurrent_reads setting is on, both run at the same time on their own threads.
+
+        PARAMETERS
+        --------
+        params
+            Parameters to pass to both executed queries.
+        which_query
+            The type of query as defined in the config.
+        day_stores
+            If given, the DayStore of every day read is built from the actuals rows as they are fetched, and put in
+            it by date key.
+        """
+        builder = None if day_stores is None else DayStoreBuilder(_date_key)
+        views = (('scheduled', _package_schedule, None),
+                 ('actuals', _package_actuals, None if builder is None else builder.add_rows))
+        if self.settings.get('concurrent_reads', True):
+            # Each view has its own connection, and pyodbc releases the GIL while waiting on the database.
+            with ThreadPoolExecutor(max_workers=len(views), thread_name_prefix='read') as executor:
+                futures = [executor.submit(self._read_view, query_name, params, which_query, packager, on_rows)
+                           for query_name, packager, on_rows in views]
+                schedule, actuals = (future.result() for future in futures)
+        else:
+            schedule, actuals = (self._read_view(query_name, params, which_query, packager, on_rows)
+                                 for query_name, packager, on_rows in views)
+        if builder is not None:
+            day_stores.update(builder.build())
+        return schedule, actuals
+
+    def _snapshot_path(self, date_key: str, type_: str, params: List) -> str:
+        name = '_'.join(str(param) for param in [type_, date_key] + list(params))
+        return os.path.join(self.settings['cache_dir'], 'days', f'{name}.cache')
+
+    def _read_with_snapshots(self, from_date: date, to_date: date, type_: str, params: List,
+                             read: Callable[[], Tuple[Mapping, Mapping]],
+                             refresh: bool = False) -> Tuple[Mapping, Mapping]:
+        """
+        Reads every date from from_date to to_date (inclusive) through their snapshots, if the day_snapshots setting
+        is on and there is a cache_dir. The snapshot of each day is keyed by the number of rows (see
+        fingerprint_days) each view has for it, probed with a single query per view. If every day has a current
+        snapshot they are loaded, otherwise read is called and the snapshot of every day is rewritten.
+
+        PARAMETERS
+        --------
+        from_date, to_date
+            The dates read.
+        type_
+            The type of query being done (eg. default or alternate).
+        params
+            The parameters of the read that follow the dates.
+        read
+            Reads the dates from the database.
+        refresh
+            If True, reads from the database even if every day has a current snapshot.
+        """
+        if not self.settings.get('cache_dir') or not self.settings.get('day_snapshots', False):
+            return read()
+        if not self.can_read_range(type_):
+            logger.warning('Not using day snapshots, the config has no range version of the %s query to probe days '
+                           'with.', type_)
+            return read()
+        which_query = 'range' if type_ == 'default' else f'range_{type_}'
+        range_params = [from_date.strftime(DATE_FORMAT), to_date.strftime(DATE_FORMAT)] + params
+        probes = [self.fingerprint_days(query_name, which_query, range_params) for query_name in DAY_VIEWS]
+        fingerprints = {date_key: tuple(probe.get(date_key) for probe in probes)
+                        for date_key in map(_date_key, date_range(from_date, to_date + timedelta(days=1)))}
+        if not refresh:
+            snapshots = {date_key: read_cache(self._snapshot_path(date_key, type_, params), fingerprint)
+                         for date_key, fingerprint in fingerprints.items()}
+            if all(snapshot is not None for snapshot in snapshots.values()):
+                logger.info('Loaded %s to %s from snapshots.', from_date, to_date)
+                schedule, actuals = deflt_dict(), deflt_dict()
+                for date_key, (day_schedule, day_actuals) in snapshots.items():
+                    if day_schedule is not None:
+                        schedule[date_key] = day_schedule
+                    if day_actuals is not None:
+                        actuals[date_key] = day_actuals
+                return schedule, actuals
+        schedule, actuals = read()
+        for date_key, fingerprint in fingerprints.items():
+            write_cache(self._snapshot_path(date_key, type_, params), fingerprint,
+                        (schedule.get(date_key), actuals.get(date_key)))
+        self._evict_snapshots()
+        return schedule, actuals
+
+    def _evict_snapshots(self):
+        """
+        Removes the least recently written snapshots beyond the day_snapshot_limit setting.
+        """
+        limit = self.settings.get('day_snapshot_limit')
+        directory = os.path.join(self.settings['cache_dir'], 'days')
+        if not limit or not os.path.isdir(directory):
+            return
+        paths = sorted((entry.path for entry in os.scandir(directory) if entry.name.endswith('.cache')),
+                       key=os.path.getmtime)
+        for path in paths[:max(len(paths) - limit, 0)]:
+            os.remove(path)
+            logger.debug('Evicted the snapshot at %s.', path)
+
+    def read(self, date_: date, type_: str = 'default', params: Optional[List] = None, refresh: bool = False,
+             day_stores: Optional[MutableMapping[str, DayStore]] = None) -> Tuple[Mapping, Mapping]:
         """
-        Read from the Connection the given date_ and store in the given format_.
+        Read from the Connection the given date_ and store in the given format_. Goes through the day's snapshot if
+        the day_snapshots setting is on (see Connection._read_with_snapshots).
 
         PARAMETERS
         --------
@@ -439,25 +1010,60 @@ class Connection:
             The type of query being done
         params
             Parameters to pass to executed query.
+        refresh
+            If True, reads from the database even if the day has a current snapshot.
+        day_stores
+            If given and the day is read from the database, its DayStore is built from the rows as they are fetched
+            and put in it by date key.
         """
-        # a_xxx refers to "actuals xxx" and s_xxx refers to "scheduled xxx"
         logger.info('Reading from connections.')
         # Init params
         if params is None:
             params = []
-        params.insert(0, date_.strftime(DATE_FORMAT))
+        return self._read_with_snapshots(date_, date_, type_, params, lambda: self._read(
+            [date_.strftime(DATE_FORMAT)] + params, type_, day_stores), refresh)
 
-        # Execute queries
-        (a_attr_sql_map, a_sql_attr_map), a_cursor = self._exc_query('actuals_conn', 'actuals', params=params,
-                                                                     which_query=type_)
-        (s_attr_sql_map, s_sql_attr_map), s_cursor = self._exc_query('scheduled_conn', 'scheduled', params=params,
-                                                                     which_query=type_)
+    def can_read_range(self, type_: str = 'default') -> bool:
+        """
+        Whether every day view defines the range version of a type of query (see read_range). Configs written before
+        range reads existed do not.
+        """
+        which_query = 'range' if type_ == 'default' else f'range_{type_}'
+        return all(which_query in self.settings['attr_sql_map']['inputs'][query_name].get('between', {})
+                   for query_name in DAY_VIEWS)
 
-        # Format dictates dictionary structure to generate
-        return process_cursor(s_cursor, s_sql_attr_map, _package_schedule, 'scheduled'), process_cursor(
-                a_cursor, a_sql_attr_map, _package_actuals, 'actuals')
+    def read_range(self, from_date: date, to_date: date, type_: str = 'default', params: Optional[List] = None,
+                   refresh: bool = False,
+                   day_stores: Optional[MutableMapping[str, DayStore]] = None) -> Tuple[Mapping, Mapping]:
+        """
+        Read from the Connection every date from from_date to to_date (inclusive) with a single query per view. The
+        results are keyed by date just like Connection.read, and keep the order_by of each query. Goes through the
+        snapshots of the days if the day_snapshots setting is on (see Connection._read_with_snapshots).
 
-    def write(self, data_map: Mapping, autocommit: bool = False, check_exists: bool = False):
+        PARAMETERS
+        --------
+        from_date
+            The first date to pull the schedule and avl_data from.
+        to_date
+            The last date to pull the schedule and avl_data from.
+        type_
+            The type of query being done. Reads use the range version of it as defined in the config. (eg. range for
+            default and range_alternate for alternate)
+        params
+            Parameters to pass to executed query, following the date range.
+        refresh
+            If True, reads from the database even if every day has a current snapshot.
+        day_stores
+            See read.
+        """
+        logger.info('Reading range from %s to %s from connections.', from_date, to_date)
+        params = [] if params is None else params
+        range_params = [from_date.strftime(DATE_FORMAT), to_date.strftime(DATE_FORMAT)] + params
+        return self._read_with_snapshots(from_date, to_date, type_, params, lambda: self._read(
+            range_params, 'range' if type_ == 'default' else f'range_{type_}', day_stores), refresh)
+
+    def write(self, data_map: Mapping, autocommit: bool = False, check_exists: bool = False,
+              query_name: str = 'segments'):
         """
         Writes the data from data_map to the table.
 
@@ -467,36 +1073,49 @@ class Connection:
             A mapping of attribute names to the values to be written to the table.
         autocommit
             Tells the function whether to commit changes after completing execution.
+        query_name
+            The name of the output in the config to write to.
         """
-        
-        final_params = list(unpack(data_map.keys(), data_map))
-        logger.debug('Writing to connections. Params: %s.\nExpected Ordering: %s', list(final_params), data_map.keys())
-        self._exc_query('output_conn', 'output', params=final_params)
-        if autocommit:
-            self.commit()
+        logger.debug('Writing to connections. Params: %s.', data_map)
+        self.write_many((data_map,), autocommit=autocommit, check_exists=check_exists, query_name=query_name)
 
-    def write_many(self, data_maps: Iterable[Mapping], autocommit: bool = True, check_exists: bool = False):
+    def write_many(self, data_maps: Iterable[Mapping], autocommit: bool = True, check_exists: bool = False,
+                   query_name: str = 'segments', chunk_size: Optional[int] = None) -> int:
         """
-        Writes a list of record mappings to the table.
+        Writes a list of record mappings to the table. Records are sent in chunks through executemany.
 
         PARAMETERS
         --------
         data_maps
-            The mappings to write to the table.
+            The mappings to write to the table. Missing attributes are written as NULL.
         autocommit
-            If true, commits after writing all the changes. True by default.
+            If true, commits after writing every chunk. True by default.
+        query_name
+            The name of the output in the config to write to.
+        chunk_size
+            Number of records to send (and commit) at a time. Defaults to the config's write_chunk_size.
+
+        RETURNS
+        --------
+        int
+            The number of records written.
         """
         logger.info('Writing many changes to output database.')
-        for data_map in data_maps:
-            self.write(data_map)
-        if autocommit:
-            self.commit()
+        attrs = self._get_plan(query_name, 'outputs').attrs
+        rows = (tuple(data_map.get(attr) for attr in attrs) for data_map in data_maps)
+        row_count = self._exc_many(query_name, rows, chunk_size=chunk_size, autocommit=autocommit)
         logger.info('Finished writing many changes to output database.')
+        return row_count
 
-    def commit(self):
+    def commit(self, query_name: str = 'segments'):
         """
         Commits changes to the output database.
+
+        PARAMETERS
+        --------
+        query_name
+            The name of the output in the config whose connection to commit.
         """
         logger.debug('Committing written changes.')
-        self.connections['output_conn'].commit()
+        self.connections['outputs'][query_name].commit()
         logger.debug('Changes committed.')
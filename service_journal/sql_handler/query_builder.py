@@ -11,8 +11,9 @@ def _append_fields(query: str, fields: Sequence[str]):
     return f'{query}{", ".join(fields)}'
 
 
-def _append_filters(query: str, filters: Sequence[str]) -> str:
-    return f'{query} WHERE {" AND ".join(map(lambda k: f"{k}=?", filters))}'
+def _append_filters(query: str, filters: Sequence[str], between: Sequence[str] = ()) -> str:
+    conditions = [f'{k} BETWEEN ? AND ?' for k in between] + [f'{k}=?' for k in filters]
+    return f'{query} WHERE {" AND ".join(conditions)}'
 
 
 def _append_order_by(query: str, order_by: Sequence[str]):
@@ -20,10 +21,14 @@ def _append_order_by(query: str, order_by: Sequence[str]):
 
 
 def build_select(fields: Sequence[str], table: str = None, filters: Optional[Mapping[str, str]] = None,
-                 order_by: Optional[Sequence[str]] = None, special_fields: Optional[Mapping[str, str]] = None) -> str:
+                 order_by: Optional[Sequence[str]] = None, special_fields: Optional[Mapping[str, str]] = None,
+                 between: Optional[Sequence[str]] = None) -> str:
     """
     build_select is to ONLY be used with trusted values. Either hardcoded values or trusted configuration values should
     be used for any of the parameters.
+
+    Fields in between are filtered by an inclusive range, and take two parameters each. Their parameters come before
+    those of filters.
     """
     fields = list(fields)
     if not fields:
@@ -39,13 +44,39 @@ def build_select(fields: Sequence[str], table: str = None, filters: Optional[Map
                 raise
     query = _append_fields('SELECT ', fields)
     query = f'{query} FROM {table}'
-    if filters:
-        query = _append_filters(query, filters)
+    if filters or between:
+        query = _append_filters(query, filters or (), between or ())
     if order_by:
         query = _append_order_by(query, order_by)
     return query
 
 
+def build_fingerprint(table: str, max_field: Optional[str] = None, filters: Optional[Sequence[str]] = None,
+                      between: Optional[Sequence[str]] = None, group_by: Optional[str] = None,
+                      checksum: bool = False) -> str:
+    """
+    build_fingerprint is to ONLY be used with trusted values. Either hardcoded values or trusted configuration values
+    should be used for any of the parameters.
+
+    Builds a cheap query whose result changes whenever rows are added to or removed from the table (or, if max_field is
+    given, whenever a newer value of max_field is added). filters and between narrow it down to the rows a query with
+    the same filters reads, and take the same parameters (see build_select). With group_by, there is a result row per
+    value of that field, starting with the value. With checksum, it also changes whenever any value of any row does,
+    for tables without a field recording when rows change.
+    """
+    query = 'SELECT COUNT(*)' if group_by is None else f'SELECT {group_by}, COUNT(*)'
+    if max_field:
+        query = f'{query}, MAX({max_field})'
+    if checksum:
+        query = f'{query}, CHECKSUM_AGG(BINARY_CHECKSUM(*))'
+    query = f'{query} FROM {table}'
+    if filters or between:
+        query = _append_filters(query, filters or (), between or ())
+    if group_by is not None:
+        query = f'{query} GROUP BY {group_by}'
+    return query
+
+
 def _append_value_fill_ins(query, count):
     return f'{query}VALUES({", ".join(["?"]*count)})'
 
@@ -64,7 +95,7 @@ def build_insert(fields: Sequence[str], table: str) -> str:
 
 def build_query(query_type: Union[str, QueryTypes], fields: Sequence[str], table: str,
                 filters: Optional[Sequence[str]] = None, order_by: Optional[Sequence[str]] = None,
-                special_fields: Optional[Mapping[str, str]] = None) -> str:
+                special_fields: Optional[Mapping[str, str]] = None, between: Optional[Sequence[str]] = None) -> str:
     """
     build_query is to ONLY be used with trusted values. Either hardcoded values or trusted configuration values should
     be used for any of the parameters.
@@ -77,6 +108,6 @@ def build_query(query_type: Union[str, QueryTypes], fields: Sequence[str], table
 
     # run the appropriate build function
     if query_type is QueryTypes.SELECT:
-        return build_select(fields, table, filters, order_by, special_fields)
+        return build_select(fields, table, filters, order_by, special_fields, between)
     elif query_type is QueryTypes.INSERT:
         return build_insert(fields, table)
@@ -1,4 +1,4 @@
-__all__ = ['debug', 'utils']
+__all__ = ['debug', 'utils', 'cache', 'geodesy', 'planar', 'spatial_index', 'records', 'day_index', 'day_store', 'spill']
 
 try:
     from .utils import *
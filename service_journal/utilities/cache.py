@@ -0,0 +1,69 @@
+import os
+import pickle
+import zlib
+from typing import Any, Hashable, Optional
+
+from gamlogger import get_default_logger
+
+logger = get_default_logger(__name__)
+
+# Bumped whenever the layout of cache files changes, so files written by older versions are ignored.
+CACHE_VERSION = 2
+
+
+def read_cache(path: str, fingerprint: Hashable) -> Optional[Any]:
+    """
+    Reads the payload of a cache file if it exists and was written with the same fingerprint.
+
+    PARAMETERS
+    --------
+    path
+        The path of the cache file.
+    fingerprint
+        Identifies the version of the data the payload must have been built from. (eg. row count and last modified date)
+
+    RETURNS
+    --------
+    Optional[Any]
+        The cached payload, or None if the file is missing, unreadable or stale.
+    """
+    try:
+        with open(path, 'rb') as f:
+            version, cached_fingerprint, payload = pickle.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        logger.debug('No cache at %s.', path)
+        return None
+    except (OSError, ValueError, zlib.error, pickle.UnpicklingError, EOFError) as e:
+        logger.warning('Ignoring unreadable cache at %s.\n%s', path, e)
+        return None
+    if version != CACHE_VERSION or cached_fingerprint != fingerprint:
+        logger.info('Cache at %s is stale. Cached: %s Current: %s', path, cached_fingerprint, fingerprint)
+        return None
+    logger.debug('Cache hit at %s.', path)
+    return payload
+
+
+def write_cache(path: str, fingerprint: Hashable, payload: Any, level: int = 6):
+    """
+    Writes a payload to a compressed cache file along with the fingerprint of the data it was built from. The file is
+    written to a temporary path first, so readers never see a partially written cache.
+
+    PARAMETERS
+    --------
+    path
+        The path of the cache file. Missing directories are created.
+    fingerprint
+        Identifies the version of the data the payload was built from.
+    payload
+        Any picklable object.
+    level
+        The zlib compression level.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(zlib.compress(pickle.dumps((CACHE_VERSION, fingerprint, payload), pickle.HIGHEST_PROTOCOL), level))
+    os.replace(tmp_path, path)
+    logger.debug('Wrote cache to %s.', path)
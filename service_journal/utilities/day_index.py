@@ -0,0 +1,122 @@
+from datetime import datetime
+from typing import Any, Dict, Hashable, Iterator, List, Mapping, NamedTuple, Sequence, Union
+
+import numpy as np
+
+
+class ReportRef(NamedTuple):
+    """
+    A report along with the bus and trigger time it is keyed by in the DATE_BUS_TIME layout. The report itself is the
+    one in that layout, not a copy.
+    """
+    bus: Hashable
+    time: datetime
+    report: Mapping
+
+
+class ReportGroup(Sequence):
+    """
+    The reports of one trip of a block, sorted by time. A view on a DayIndex: it holds nothing but where the group
+    starts and ends in the index's order.
+    """
+    __slots__ = ('index', 'start', 'stop')
+
+    def __init__(self, index: 'DayIndex', start: int, stop: int):
+        self.index = index
+        self.start = start
+        self.stop = stop
+
+    @property
+    def positions(self) -> np.ndarray:
+        """
+        The positions of the group's reports in the index, as a view on its order.
+        """
+        return self.index.order[self.start:self.stop]
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, i: Union[int, slice]):
+        if isinstance(i, slice):
+            return [self.index.ref(int(position)) for position in self.positions[i]]
+        return self.index.ref(int(self.positions[i]))
+
+    def __iter__(self) -> Iterator[ReportRef]:
+        for position in self.positions.tolist():
+            yield self.index.ref(position)
+
+    def __repr__(self):
+        return f'ReportGroup({list(self)!r})'
+
+
+class BlockTripView(dict):
+    """
+    The reports of a day by block, then trip, as ReportGroups. Remembers the index it is a view of.
+    """
+    def __init__(self, index: 'DayIndex', groups: Dict[Hashable, Dict[Hashable, ReportGroup]]):
+        super().__init__(groups)
+        self.index = index
+
+
+class DayIndex:
+    """
+    Indexes the reports of one day so they can be presented both by bus and time (the layout they are packaged in)
+    and by block, trip and time, without copying any of them. Reports are grouped by their first trip number, as the
+    processors do.
+    """
+    def __init__(self, day_actuals: Mapping[Hashable, Mapping[datetime, Mapping]]):
+        self.day_actuals = day_actuals
+        self.buses: List[Hashable] = []
+        self.times: List[datetime] = []
+        self.reports: List[Mapping] = []
+        # Codes in order of first appearance, so groups keep the order the query returned them in
+        block_codes: Dict[Hashable, int] = {}
+        trip_codes: Dict[Any, int] = {}
+        report_blocks, report_trips = [], []
+        for bus, bus_data in day_actuals.items():
+            for time_, report in bus_data.items():
+                self.buses.append(bus)
+                self.times.append(time_)
+                self.reports.append(report)
+                block = report['block_number']
+                trip_numbers = report['trip_number']
+                report_blocks.append(block_codes.setdefault(block, len(block_codes)))
+                report_trips.append(trip_codes.setdefault((block, trip_numbers[0] if trip_numbers else None),
+                                                          len(trip_codes)))
+        report_blocks = np.asarray(report_blocks, dtype=np.int64)
+        report_trips = np.asarray(report_trips, dtype=np.int64)
+        times = np.array(self.times, dtype='datetime64[us]') if self.times else np.zeros(0, dtype='datetime64[us]')
+        # Positions of the reports sorted by block, trip then time
+        self.order = np.lexsort((times, report_trips, report_blocks))
+        sorted_trips = report_trips[self.order]
+        starts = np.flatnonzero(np.diff(sorted_trips)) + 1
+        # Where each trip's group starts and ends in order (group i is offsets[i]:offsets[i+1]). An empty day has none
+        self.offsets = np.concatenate(([0], starts, [len(self.order)]) if len(self.order) else ([0],)).astype(np.int64)
+        keys = list(trip_codes)
+        groups: Dict[Hashable, Dict[Hashable, ReportGroup]] = {}
+        for i in range(len(self.offsets) - 1):
+            start, stop = int(self.offsets[i]), int(self.offsets[i + 1])
+            block, trip = keys[int(sorted_trips[start])]
+            groups.setdefault(block, {})[trip] = ReportGroup(self, start, stop)
+        self._by_block = BlockTripView(self, groups)
+
+    def __len__(self):
+        return len(self.reports)
+
+    def ref(self, position: int) -> ReportRef:
+        """
+        Gives the report at a position of the index (in DATE_BUS_TIME order).
+        """
+        return ReportRef(self.buses[position], self.times[position], self.reports[position])
+
+    def by_bus(self) -> Mapping[Hashable, Mapping[datetime, Mapping]]:
+        """
+        Gives the reports by bus then trigger time, which is the mapping the index was built from.
+        """
+        return self.day_actuals
+
+    def by_block(self) -> BlockTripView:
+        """
+        Gives the reports by block, then trip, as groups sorted by time. See ReportGroup.
+        """
+        return self._by_block
@@ -0,0 +1,200 @@
+from datetime import datetime
+from itertools import groupby
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Mapping, Sequence, Tuple
+
+import numpy as np
+
+# A report of the day's actuals. Buses, stops, blocks and trips are codes into the store's tables of values (see
+# DayStore.values), so whatever the database returns for them can be stored and compared as it would be in the
+# packaged reports. A trip is coded along with its block, as (block, trip). Missing coordinates are NaN and missing
+# passenger counts 0.
+REPORT_DTYPE = np.dtype([
+    ('bus', np.int32),
+    ('time', 'datetime64[us]'),
+    ('lat', np.float64),
+    ('lon', np.float64),
+    ('stop_id', np.int32),
+    ('block', np.int32),
+    ('trip', np.int32),
+    ('boards', np.int32),
+    ('alights', np.int32),
+    ('onboard', np.int32),
+])
+MISSING = -1
+# The attributes of an actuals row kept by a DayStore, in the order DayStore.from_columns takes them.
+ROW_ATTRS = ('bus', 'trigger_time', 'latitude', 'longitude', 'stop', 'block_number', 'trip_number', 'boards',
+             'alights', 'onboard')
+
+
+def _encode(values: Sequence[Hashable]) -> Tuple[np.ndarray, List[Hashable]]:
+    """
+    Codes each value by the order it first appears in, so equal values (as the packaged reports compare them) share a
+    code.
+    """
+    codes: Dict[Hashable, int] = {}
+    encoded = np.fromiter((codes.setdefault(value, len(codes)) for value in values), dtype=np.int32,
+                          count=len(values))
+    return encoded, list(codes)
+
+
+def _counts(values: Sequence[Any]) -> np.ndarray:
+    return np.fromiter((value or 0 for value in values), dtype=np.int32, count=len(values))
+
+
+class DayStore:
+    """
+    The actuals of a single day as one structured array (see REPORT_DTYPE), grouped by bus. The reports of a bus are
+    a contiguous slice in the order they were read, which is the order of the bus's reports in the packaged actuals, so
+    position i of DayStore.bus(bus) is the i-th report of avl_dict[date][bus]. Slices are handed out as views rather
+    than copies, and whole-day operations can run on the columns directly (eg. store.reports['boards'].sum()).
+    """
+    def __init__(self, reports: np.ndarray, values: Mapping[str, List[Hashable]]):
+        """
+        PARAMETERS
+        --------
+        reports
+            The reports, grouped by bus in the order of the bus codes.
+        values
+            The value of each code, by column (bus, stop_id, block and trip).
+        """
+        if reports.dtype != REPORT_DTYPE:
+            raise ValueError(f'Expected reports of dtype {REPORT_DTYPE}, got {reports.dtype}.')
+        self.reports = reports
+        self.values = values
+        self._codes = {column: {value: code for code, value in enumerate(column_values)}
+                       for column, column_values in values.items()}
+        starts = np.flatnonzero(np.diff(reports['bus'])) + 1
+        # Where each bus's reports start and end in reports (bus i is offsets[i]:offsets[i+1])
+        self.offsets = np.concatenate(([0], starts, [len(reports)]) if len(reports) else ([0],)).astype(np.int64)
+        self._positions = {values['bus'][code]: i for i, code in enumerate(reports['bus'][self.offsets[:-1]].tolist())}
+
+    @classmethod
+    def from_columns(cls, buses: Sequence, times: Sequence[datetime], lats: Sequence, lons: Sequence,
+                     stops: Sequence, blocks: Sequence, trips: Sequence, boards: Sequence, alights: Sequence,
+                     onboard: Sequence) -> 'DayStore':
+        """
+        Builds the store of a day from the values of its rows, one sequence per attribute (see ROW_ATTRS). Rows with
+        the same bus and trigger time are merged into one report the way Connection._package_actuals_row merges them:
+        the first row's values are kept, boards and alights are summed and the highest onboard is kept.
+        """
+        bus_codes, bus_values = _encode(buses)
+        times = np.array(times, dtype='datetime64[us]')
+        boards, alights, onboard = _counts(boards), _counts(alights), _counts(onboard)
+        stop_codes, stop_values = _encode(stops)
+        block_codes, block_values = _encode(blocks)
+        trip_codes, trip_values = _encode(list(zip(blocks, trips)))
+        values = {'bus': bus_values, 'stop_id': stop_values, 'block': block_values, 'trip': trip_values}
+        if not len(bus_codes):
+            return cls(np.empty(0, dtype=REPORT_DTYPE), values)
+        # Sort by bus, time then row, so each report's rows are together with its first row leading
+        order = np.lexsort((np.arange(len(bus_codes)), times, bus_codes))
+        sorted_buses, sorted_times = bus_codes[order], times[order]
+        leads = np.ones(len(order), dtype=bool)
+        leads[1:] = (sorted_buses[1:] != sorted_buses[:-1]) | (sorted_times[1:] != sorted_times[:-1])
+        starts = np.flatnonzero(leads)
+        first = order[starts]
+        reports = np.empty(len(first), dtype=REPORT_DTYPE)
+        reports['bus'], reports['time'] = bus_codes[first], times[first]
+        reports['lat'] = np.array(lats, dtype=np.float64)[first]
+        reports['lon'] = np.array(lons, dtype=np.float64)[first]
+        reports['stop_id'], reports['block'], reports['trip'] = stop_codes[first], block_codes[first], trip_codes[first]
+        reports['boards'] = np.add.reduceat(boards[order], starts)
+        reports['alights'] = np.add.reduceat(alights[order], starts)
+        reports['onboard'] = np.maximum.reduceat(onboard[order], starts)
+        # Back to the order the reports were first read in, grouped by bus (bus codes are in order of first appearance)
+        return cls(reports[np.lexsort((first, reports['bus']))], values)
+
+    @classmethod
+    def from_actuals(cls, day_actuals: Mapping[Hashable, Mapping[datetime, Mapping]]) -> 'DayStore':
+        """
+        Builds the store of a day from its packaged actuals, for days that were not read from the database (eg.
+        loaded from a snapshot).
+
+        PARAMETERS
+        --------
+        day_actuals
+            The actuals of one day, by bus then trigger time, as in Journal.avl_dict[date].
+
+        RETURNS
+        --------
+        DayStore
+            The day's reports, in the order they were packaged in.
+        """
+        items = [(bus, time_, report) for bus, bus_data in day_actuals.items() for time_, report in bus_data.items()]
+        reports = [report for _, _, report in items]
+        return cls.from_columns(
+            [bus for bus, _, _ in items], [time_ for _, time_, _ in items], [report['lat'] for report in reports],
+            [report['lon'] for report in reports], [report['stop_id'] for report in reports],
+            [report['block_number'] for report in reports],
+            [report['trip_number'][0] if report['trip_number'] else None for report in reports],
+            [report['boards'] for report in reports], [report['alights'] for report in reports],
+            [report['onboard'] for report in reports])
+
+    def __len__(self):
+        return len(self.reports)
+
+    def __contains__(self, bus: Hashable) -> bool:
+        return bus in self._positions
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self._positions)
+
+    def code(self, column: str, value: Hashable) -> int:
+        """
+        Gives the code of a value in one of the coded columns (bus, stop_id, block or trip), or MISSING if no report
+        of the day has it.
+        """
+        return self._codes[column].get(value, MISSING)
+
+    def bus(self, bus: Hashable) -> np.ndarray:
+        """
+        Gives the reports of a bus, in the order they were read. The result is a view on the store, so writing to it
+        writes to the store.
+        """
+        i = self._positions[bus]
+        return self.reports[self.offsets[i]:self.offsets[i + 1]]
+
+    def items(self) -> Iterator[Tuple[Hashable, np.ndarray]]:
+        """
+        Iterates over every bus and its reports. See bus.
+        """
+        for i, bus in enumerate(self._positions):
+            yield bus, self.reports[self.offsets[i]:self.offsets[i + 1]]
+
+
+class DayStoreBuilder:
+    """
+    Builds the DayStore of every day of a read from the actuals rows as they are fetched, so the store does not wait
+    for (or go through) the packaged reports. See process_cursor's on_rows.
+    """
+    def __init__(self, date_key: Callable[[Any], str]):
+        """
+        PARAMETERS
+        --------
+        date_key
+            Gives the key of a row's date, as the packaged actuals are keyed by.
+        """
+        self.date_key = date_key
+        self._days: Dict[str, Tuple[List, ...]] = {}
+
+    def add_rows(self, rows: Sequence[Sequence], col: Mapping[str, int]):
+        """
+        Adds fetched rows, whose attributes are found through col (see process_cursor).
+        """
+        indexes = [col[attr] for attr in ROW_ATTRS]
+        date_index = col['date']
+        # Rows come ordered by date, so a chunk holds few runs of the same date
+        for date_, day_rows in groupby(rows, key=lambda row: row[date_index]):
+            date_key = self.date_key(date_)
+            columns = self._days.get(date_key)
+            if columns is None:
+                columns = self._days[date_key] = tuple([] for _ in ROW_ATTRS)
+            day_rows = list(day_rows)
+            for column, index in zip(columns, indexes):
+                column.extend(row[index] for row in day_rows)
+
+    def build(self) -> Dict[str, DayStore]:
+        """
+        Builds the store of every day whose rows were added, by date key.
+        """
+        return {date_key: DayStore.from_columns(*columns) for date_key, columns in self._days.items()}
@@ -0,0 +1,128 @@
+import numpy as np
+
+# WGS-84
+EQUATORIAL_RADIUS = 6378137.0
+FLATTENING = 1 / 298.257223563
+# Mean radius of the WGS-84 ellipsoid, used by the spherical (haversine) mode
+MEAN_RADIUS = 6371008.8
+FEET_PER_METER = 1 / 0.3048
+# Length of a degree of latitude (or of longitude on the equator) on the mean sphere
+FEET_PER_DEGREE = MEAN_RADIUS * np.pi / 180 * FEET_PER_METER
+
+HAVERSINE = 'haversine'
+LAMBERT = 'lambert'
+# Coordinates were already projected to feet (see planar.py), so distances are Euclidean
+PLANAR = 'planar'
+MODES = (HAVERSINE, LAMBERT, PLANAR)
+DEFAULT_MODE = LAMBERT
+
+
+def _central_angle(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """
+    Gives the angle between two points on a unit sphere with the haversine formula. All values are in radians.
+    """
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def _lambert(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """
+    Gives the distance in meters between points on the WGS-84 ellipsoid with Lambert's formula, which corrects the
+    spherical distance between the reduced latitudes for flattening. It approximates Vincenty's formula to within about
+    a millimeter per kilometer, without iterating.
+    """
+    beta1 = np.arctan((1 - FLATTENING) * np.tan(lat1))
+    beta2 = np.arctan((1 - FLATTENING) * np.tan(lat2))
+    sigma = _central_angle(beta1, lon1, beta2, lon2)
+    p = (beta1 + beta2) / 2
+    q = (beta2 - beta1) / 2
+    sin_sigma = np.sin(sigma)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (sigma - sin_sigma) * (np.sin(p) * np.cos(q)) ** 2 / np.cos(sigma / 2) ** 2
+        y = (sigma + sin_sigma) * (np.cos(p) * np.sin(q)) ** 2 / np.sin(sigma / 2) ** 2
+    correction = np.where(sigma > 0, FLATTENING / 2 * (x + y), 0.0)
+    return EQUATORIAL_RADIUS * (sigma - correction)
+
+
+def distances(lats1, lons1, lats2, lons2, mode: str = DEFAULT_MODE) -> np.ndarray:
+    """
+    Gives the distance in feet between each pair of points.
+
+    PARAMETERS
+    --------
+    lats1, lons1
+        The coordinates of the first point of each pair, in degrees.
+    lats2, lons2
+        The coordinates of the second point of each pair, in degrees.
+    mode
+        'haversine' to treat the earth as a sphere (fastest, within about 0.5%), or 'lambert' to account for the
+        earth's flattening (within about a millimeter per kilometer of geopy's geodesic distance). 'planar' if the
+        coordinates are (northing, easting) in feet rather than degrees.
+
+    RETURNS
+    --------
+    np.ndarray
+        The distance between each pair of points, in feet.
+    """
+    if mode == PLANAR:
+        return np.hypot(np.asarray(lats2, dtype=float) - lats1, np.asarray(lons2, dtype=float) - lons1)
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float)) for a in (lats1, lons1, lats2, lons2))
+    if mode == HAVERSINE:
+        meters = MEAN_RADIUS * _central_angle(lat1, lon1, lat2, lon2)
+    elif mode == LAMBERT:
+        meters = _lambert(lat1, lon1, lat2, lon2)
+    else:
+        raise ValueError(f'Unknown distance mode {mode}. Expected one of {MODES}.')
+    return meters * FEET_PER_METER
+
+
+def path_distances(coords, mode: str = DEFAULT_MODE) -> np.ndarray:
+    """
+    Gives the distance in feet between each pair of consecutive points of a path.
+
+    PARAMETERS
+    --------
+    coords
+        The (n, 2) coordinates of the path in (lon, lat), as in shapely geometries.
+    mode
+        See distances.
+
+    RETURNS
+    --------
+    np.ndarray
+        The n - 1 distances between consecutive points, in feet.
+    """
+    coords = np.asarray(coords, dtype=float)
+    if len(coords) < 2:
+        return np.zeros(0)
+    return distances(coords[:-1, 1], coords[:-1, 0], coords[1:, 1], coords[1:, 0], mode)
+
+
+def cumulative_distances(coords, mode: str = DEFAULT_MODE) -> np.ndarray:
+    """
+    Gives the distance in feet along a path at each of its points, starting at 0.
+
+    PARAMETERS
+    --------
+    coords
+        The (n, 2) coordinates of the path in (lon, lat), as in shapely geometries.
+    mode
+        See distances.
+    """
+    return np.concatenate(([0.0], np.cumsum(path_distances(coords, mode)))) if len(coords) else np.zeros(0)
+
+
+def path_length(coords, mode: str = DEFAULT_MODE) -> float:
+    """
+    Gives the length of a path in feet.
+    """
+    return float(path_distances(coords, mode).sum())
+
+
+
+def feet_to_degrees(feet: float, lat: float) -> float:
+    """
+    Converts a distance in feet to degrees at the given latitude. Uses the length of a degree of longitude there, which
+    is the shorter of the two, so the result covers at least the given distance in any direction.
+    """
+    return feet / (FEET_PER_DEGREE * max(np.cos(np.radians(lat)), 1e-6))
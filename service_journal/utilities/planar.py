@@ -0,0 +1,143 @@
+from typing import Any, Dict, Mapping, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import transform as shapely_transform
+from gamlogger import get_default_logger
+
+logger = get_default_logger(__name__)
+
+# GRS-80, which NAD83 state planes are defined on
+EQUATORIAL_RADIUS = 6378137.0
+FLATTENING = 1 / 298.257222101
+US_SURVEY_FOOT = 1200 / 3937
+
+_N = FLATTENING / (2 - FLATTENING)
+_ECCENTRICITY = np.sqrt(FLATTENING * (2 - FLATTENING))
+# Rectifying radius and the coefficients of Krüger's series (to n^4), which are accurate to well under a millimeter
+# within a state plane zone
+_RECTIFYING_RADIUS = EQUATORIAL_RADIUS / (1 + _N) * (1 + _N ** 2 / 4 + _N ** 4 / 64)
+_ALPHA = (
+    _N / 2 - 2 * _N ** 2 / 3 + 5 * _N ** 3 / 16 + 41 * _N ** 4 / 180,
+    13 * _N ** 2 / 48 - 3 * _N ** 3 / 5 + 557 * _N ** 4 / 1440,
+    61 * _N ** 3 / 240 - 103 * _N ** 4 / 140,
+    49561 * _N ** 4 / 161280,
+)
+
+
+def _krueger(lats: np.ndarray, dlons: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Gives the (easting, northing) of points on a unit transverse Mercator projection, in multiples of the rectifying
+    radius, with Krüger's series. Latitudes and longitudes (relative to the central meridian) are in radians.
+    """
+    sin_lat = np.sin(lats)
+    t = np.sinh(np.arctanh(sin_lat) - _ECCENTRICITY * np.arctanh(_ECCENTRICITY * sin_lat))
+    xi_ = np.arctan2(t, np.cos(dlons))
+    eta_ = np.arctanh(np.sin(dlons) / np.sqrt(1 + t ** 2))
+    xi, eta = xi_.copy(), eta_.copy()
+    for j, alpha in enumerate(_ALPHA, 1):
+        xi += alpha * np.sin(2 * j * xi_) * np.cosh(2 * j * eta_)
+        eta += alpha * np.cos(2 * j * xi_) * np.sinh(2 * j * eta_)
+    return eta, xi
+
+
+class TransverseMercator(NamedTuple):
+    """
+    A transverse Mercator projection on GRS-80, as used by state plane coordinate systems. Projected coordinates are in
+    US survey feet, so distances between them can be used as is. Only the forward projection is needed, since nothing
+    is converted back to degrees.
+    """
+    # Latitude and longitude of the origin, in degrees
+    lat_0: float
+    lon_0: float
+    # Scale factor on the central meridian
+    k_0: float
+    # False easting and northing, in meters
+    x_0: float = 0.0
+    y_0: float = 0.0
+
+    def forward(self, lons, lats) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Projects coordinates.
+
+        PARAMETERS
+        --------
+        lons, lats
+            The coordinates to project, in degrees. Either scalars or arrays.
+
+        RETURNS
+        --------
+        Tuple[np.ndarray, np.ndarray]
+            The easting and northing of each point, in US survey feet.
+        """
+        lats = np.radians(np.asarray(lats, dtype=float))
+        dlons = np.radians(np.asarray(lons, dtype=float) - self.lon_0)
+        eta, xi = _krueger(lats, dlons)
+        _, xi_0 = _krueger(np.radians(self.lat_0), 0.0)
+        scale = self.k_0 * _RECTIFYING_RADIUS
+        return (self.x_0 + scale * eta) / US_SURVEY_FOOT, (self.y_0 + scale * (xi - xi_0)) / US_SURVEY_FOOT
+
+    def transform(self, geometry: BaseGeometry) -> BaseGeometry:
+        """
+        Projects every vertex of a geometry in (lon, lat).
+        """
+        return shapely_transform(lambda xs, ys, zs=None: self.forward(xs, ys), geometry)
+
+
+# Named projections the planar_crs setting can refer to
+CRS_PRESETS: Dict[str, TransverseMercator] = {
+    # NAD83 / New York Central (ftUS), EPSG:2261
+    'ny_central': TransverseMercator(40.0, -76.58333333333333, 0.9999375, 250000.0, 0.0),
+    # NAD83 / New York East (ftUS), EPSG:2260
+    'ny_east': TransverseMercator(38.83333333333334, -74.5, 0.9999, 150000.0, 0.0),
+    # NAD83 / New York West (ftUS), EPSG:2262
+    'ny_west': TransverseMercator(40.0, -78.58333333333333, 0.9999375, 350000.0, 0.0),
+}
+
+
+def get_crs(setting: Union[None, str, Mapping[str, Any]]) -> Optional[TransverseMercator]:
+    """
+    Interprets the planar_crs setting.
+
+    PARAMETERS
+    --------
+    setting
+        None to keep coordinates in degrees, the name of one of CRS_PRESETS, or the parameters of a
+        TransverseMercator. (eg. {"lat_0": 40, "lon_0": -76.58333, "k_0": 0.9999375, "x_0": 250000})
+
+    RETURNS
+    --------
+    Optional[TransverseMercator]
+        The projection, or None if coordinates stay in degrees.
+    """
+    if not setting:
+        return None
+    if isinstance(setting, str):
+        try:
+            return CRS_PRESETS[setting]
+        except KeyError:
+            raise ValueError(f'Unknown planar_crs {setting}. Expected a mapping or one of {list(CRS_PRESETS)}.')
+    return TransverseMercator(**setting)
+
+
+def project_shapes(shapes: Mapping[Tuple[int, int], Tuple[float, BaseGeometry]], crs: TransverseMercator) -> \
+        Dict[Tuple[int, int], Tuple[float, BaseGeometry]]:
+    """
+    Projects every shape (as loaded by Connection.load_shapes) with the given projection.
+    """
+    return {key: (distance, crs.transform(path) if isinstance(path, BaseGeometry) else path)
+            for key, (distance, path) in shapes.items()}
+
+
+def project_stop_locations(stop_locations: Mapping[Any, Tuple[float, float]], crs: TransverseMercator) -> \
+        Dict[Any, Tuple[float, float]]:
+    """
+    Projects every stop location (as loaded by Connection.load_stop_loc). Locations keep their (lat, lon) order, so
+    they become (northing, easting).
+    """
+    if not stop_locations:
+        return {}
+    stops = list(stop_locations.keys())
+    lats, lons = np.array([stop_locations[stop] for stop in stops], dtype=float).T
+    xs, ys = crs.forward(lons, lats)
+    return dict(zip(stops, zip(ys.tolist(), xs.tolist())))
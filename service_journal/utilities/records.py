@@ -0,0 +1,143 @@
+import sys
+from collections.abc import MutableMapping
+from typing import Any, Dict, FrozenSet, Hashable, Iterator, Tuple
+
+
+class Record(MutableMapping):
+    """
+    A record with a fixed set of fields stored in slots rather than a per-record dictionary. Fields can be read and
+    written as attributes or, so code written for the dictionaries records used to be keeps working, as keys. Fields
+    cannot be added or removed. Only fields are keys, so methods and other attributes cannot be read as keys.
+    """
+    __slots__ = ()
+    # The fields of the record's class, for checking keys. Set on every subclass.
+    _fields: FrozenSet[str] = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = frozenset(cls.__slots__)
+
+    def __getitem__(self, key):
+        try:
+            if key in self._fields:
+                return getattr(self, key)
+        except TypeError:
+            pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError(f'Cannot remove {key}, {type(self).__name__} has a fixed set of fields.')
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__slots__)
+
+    def __len__(self) -> int:
+        return len(self.__slots__)
+
+    def __contains__(self, key) -> bool:
+        return key in self.__slots__
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)})'
+
+    def __getstate__(self) -> Tuple:
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __setstate__(self, state: Tuple):
+        for field, value in zip(self.__slots__, state):
+            object.__setattr__(self, field, value)
+
+
+class ScheduledStop(Record):
+    """
+    A stop of a scheduled trip, along with what was seen of it. See Connection._package_schedule.
+    """
+    __slots__ = ('sched_time', 'direction', 'seen', 'bus', 'confidence_score', 'confidence_factors', 'operator',
+                 'trigger_time', 'boards', 'alights', 'onboard', 'name')
+
+    def __init__(self, sched_time, direction, seen=0, bus=None, confidence_score=0, confidence_factors=None,
+                 operator=None, trigger_time=None, boards=0, alights=0, onboard=0, name=None):
+        self.sched_time = sched_time
+        self.direction = direction
+        self.seen = seen
+        self.bus = bus
+        self.confidence_score = confidence_score
+        self.confidence_factors = [] if confidence_factors is None else confidence_factors
+        self.operator = operator
+        self.trigger_time = trigger_time
+        self.boards = boards
+        self.alights = alights
+        self.onboard = onboard
+        self.name = name
+
+
+class AvlReport(Record):
+    """
+    A single report of a bus. See Connection._package_actuals. route and trip_number are immutable (see intern_set
+    and intern_tuple), so reports can share them. Use add_route and add_trip_number to grow them.
+    """
+    __slots__ = ('lat', 'lon', 'dir', 'operator', 'depart', 'boards', 'alights', 'onboard', 'stop_id', 'name',
+                 'block_number', 'route', 'trip_number')
+
+    def __init__(self, lat, lon, dir, operator, depart, boards, alights, onboard, stop_id, name, block_number, route,
+                 trip_number):
+        self.lat = lat
+        self.lon = lon
+        self.dir = dir
+        self.operator = operator
+        self.depart = depart
+        self.boards = boards
+        self.alights = alights
+        self.onboard = onboard
+        self.stop_id = stop_id
+        self.name = name
+        self.block_number = block_number
+        self.route = route
+        self.trip_number = trip_number
+
+    def add_route(self, route: Hashable):
+        if route not in self.route:
+            self.route = self.route | intern_set(route)
+
+    def add_trip_number(self, trip_number: Hashable):
+        if trip_number not in self.trip_number:
+            self.trip_number = self.trip_number + intern_tuple(trip_number)
+
+
+_SETS: Dict[Hashable, FrozenSet] = {}
+_TUPLES: Dict[Hashable, Tuple] = {}
+
+
+def intern(value: Any) -> Any:
+    """
+    Interns strings, so the many records holding the same route, operator or stop name share a single string. Other
+    values are returned as they are.
+    """
+    return sys.intern(value) if type(value) is str else value
+
+
+def intern_set(value: Hashable) -> FrozenSet:
+    """
+    Gives a frozenset of a single value, shared by every caller asking for the same value.
+    """
+    try:
+        return _SETS[value]
+    except KeyError:
+        single = _SETS[value] = frozenset((intern(value),))
+        return single
+
+
+def intern_tuple(value: Hashable) -> Tuple:
+    """
+    Gives a tuple of a single value, shared by every caller asking for the same value.
+    """
+    try:
+        return _TUPLES[value]
+    except KeyError:
+        single = _TUPLES[value] = (intern(value),)
+        return single
@@ -0,0 +1,186 @@
+from collections import defaultdict
+from math import floor, hypot, inf, sqrt
+from typing import Any, Dict, Hashable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry.base import BaseGeometry
+from shapely.strtree import STRtree
+from gamlogger import get_default_logger
+
+# Dynamic local imports
+try:
+    from .utils import shape_path
+except ImportError:
+    from service_journal.utilities.utils import shape_path
+
+logger = get_default_logger(__name__)
+
+
+class SegmentIndex:
+    """
+    An STRtree over the shape of every segment (stop to stop), for finding the segment nearest to any point.
+    Coordinates are in whatever units the shapes are in (degrees, or feet if they were projected).
+    """
+    def __init__(self, shapes: Mapping[Tuple[int, int], Any]):
+        # Number of shapes the index was built from, including ones without a usable geometry
+        self.source_size = len(shapes)
+        self.keys: List[Tuple[int, int]] = []
+        self.geometries: List[BaseGeometry] = []
+        for key, shape in shapes.items():
+            path = shape_path(shape)
+            if isinstance(path, BaseGeometry) and not path.is_empty:
+                self.keys.append(key)
+                self.geometries.append(path)
+        self.tree = STRtree(self.geometries) if self.geometries else None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def nearest(self, xs: Sequence[float], ys: Sequence[float]) -> List[Optional[Tuple[int, int]]]:
+        """
+        Finds the segment nearest to each point.
+
+        PARAMETERS
+        --------
+        xs, ys
+            The coordinates of the points, in the shapes' units.
+
+        RETURNS
+        --------
+        List[Optional[Tuple[int, int]]]
+            The (from_stop, to_stop) key of the nearest segment to each point, or None if there are no shapes.
+        """
+        if self.tree is None:
+            return [None] * len(xs)
+        points = shapely.points(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float))
+        point_indices, segment_indices = self.tree.query_nearest(points, all_matches=False)
+        nearest = [None] * len(xs)
+        for point_index, segment_index in zip(point_indices.tolist(), segment_indices.tolist()):
+            nearest[point_index] = self.keys[segment_index]
+        return nearest
+
+
+class StopGrid:
+    """
+    A uniform grid over the stop locations, for finding the stop nearest to any point. Locations are (y, x) pairs, as
+    loaded by Connection.load_stop_loc. By default cells are sized so there is about one stop per cell.
+    """
+    def __init__(self, stop_locations: Mapping[Hashable, Tuple[float, float]], cell_size: Optional[float] = None):
+        self.stops = list(stop_locations.keys())
+        locations = np.array([stop_locations[stop] for stop in self.stops], dtype=float).reshape(-1, 2)
+        self.ys, self.xs = locations[:, 0], locations[:, 1]
+        self._positions = {stop: i for i, stop in enumerate(self.stops)}
+        if cell_size is None:
+            span = max(np.ptp(self.xs), np.ptp(self.ys)) if self.stops else 0.0
+            cell_size = span / sqrt(len(self.stops)) if span else 1.0
+        self.cell_size = cell_size
+        self.cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for i, (x, y) in enumerate(zip(self.xs.tolist(), self.ys.tolist())):
+            self.cells[self._cell(x, y)].append(i)
+        self._bounds = (min(i for i, _ in self.cells), max(i for i, _ in self.cells),
+                        min(j for _, j in self.cells), max(j for _, j in self.cells)) if self.cells else None
+
+    def __len__(self):
+        return len(self.stops)
+
+    def location(self, stop: Hashable) -> Tuple[float, float]:
+        """
+        Gives the (y, x) location of a stop.
+        """
+        i = self._positions[stop]
+        return float(self.ys[i]), float(self.xs[i])
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return floor(x / self.cell_size), floor(y / self.cell_size)
+
+    def _ring(self, ci: int, cj: int, r: int):
+        if r == 0:
+            yield ci, cj
+            return
+        for i in range(ci - r, ci + r + 1):
+            yield i, cj - r
+            yield i, cj + r
+        for j in range(cj - r + 1, cj + r):
+            yield ci - r, j
+            yield ci + r, j
+
+    def nearest(self, x: float, y: float, max_distance: Optional[float] = None) -> Optional[Tuple[Hashable, float]]:
+        """
+        Finds the stop nearest to a point by searching rings of cells outwards from the point's cell, until no closer
+        stop can be found.
+
+        PARAMETERS
+        --------
+        x, y
+            The point, in the locations' units.
+        max_distance
+            Only stops within this distance of the point (in the locations' units) are looked for, so a point far
+            from every stop only searches the cells around it. None to look at every stop.
+
+        RETURNS
+        --------
+        Optional[Tuple[Hashable, float]]
+            The nearest stop and its distance from the point (in the locations' units), or None if there are no stops
+            (within max_distance).
+        """
+        if self._bounds is None:
+            return None
+        ci, cj = self._cell(x, y)
+        min_i, max_i, min_j, max_j = self._bounds
+        last_ring = max(abs(ci - min_i), abs(ci - max_i), abs(cj - min_j), abs(cj - max_j))
+        if max_distance is not None:
+            # A stop within max_distance is at most this many cells away
+            last_ring = min(last_ring, floor(max_distance / self.cell_size) + 1)
+        best, best_distance = None, inf
+        for r in range(last_ring + 1):
+            for cell in self._ring(ci, cj, r):
+                for i in self.cells.get(cell, ()):
+                    distance = hypot(self.xs[i] - x, self.ys[i] - y)
+                    if distance < best_distance:
+                        best, best_distance = i, distance
+            # Anything in the next ring is at least r cells away
+            if best is not None and r * self.cell_size >= best_distance:
+                break
+        if best is None or (max_distance is not None and best_distance > max_distance):
+            return None
+        return self.stops[best], best_distance
+
+    def nearest_many(self, xs: Sequence[float], ys: Sequence[float], max_distance: Optional[float] = None) \
+            -> List[Optional[Tuple[Hashable, float]]]:
+        """
+        Finds the stop nearest to each point. See nearest.
+        """
+        return [self.nearest(x, y, max_distance) for x, y in zip(xs, ys)]
+
+
+class SpatialIndex(NamedTuple):
+    """
+    The segment and stop indexes over one set of shapes and stop locations. See get_spatial_index.
+    """
+    segments: SegmentIndex
+    stops: StopGrid
+
+
+# The index last built in this process, along with the mappings it was built from, so it is only reused for them.
+_cached_index: Optional[Tuple[Mapping, Mapping, SpatialIndex]] = None
+
+
+def get_spatial_index(shapes: Mapping[Tuple[int, int], Any], stop_locations: Mapping[Hashable, Tuple[float, float]]) \
+        -> SpatialIndex:
+    """
+    Gives the spatial index over the given shapes and stop locations, building it only the first time it is asked for
+    in this process (or when the shapes or stop locations are swapped for others).
+    """
+    global _cached_index
+    if _cached_index is not None:
+        cached_shapes, cached_stop_locations, index = _cached_index
+        # Journal.update adds to the mappings in place, so check they have not grown
+        if cached_shapes is shapes and cached_stop_locations is stop_locations and \
+                index.segments.source_size == len(shapes) and len(index.stops) == len(stop_locations):
+            return index
+    index = SpatialIndex(SegmentIndex(shapes), StopGrid(stop_locations))
+    logger.info('Built spatial index over %s segments and %s stops.', len(index.segments), len(index.stops))
+    _cached_index = shapes, stop_locations, index
+    return index
+
@@ -0,0 +1,185 @@
+import os
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+from gamlogger import get_default_logger
+
+# Dynamic local imports
+try:
+    from .cache import read_cache, write_cache
+except ImportError:
+    from service_journal.utilities.cache import read_cache, write_cache
+
+logger = get_default_logger(__name__)
+
+# Spilled days are read back far more often than they are kept, so favor speed over size.
+SPILL_COMPRESSION_LEVEL = 1
+
+
+class SpillPool:
+    """
+    A memory budget shared by SpillStores. When the values resident in its stores are estimated to take more than the
+    budget, the least recently used ones are spilled to files in directory, and read back in when they are next used.
+    The most recently used value of each store is never spilled, so a value a caller is working on stays in memory.
+    """
+    def __init__(self, budget: int, directory: Optional[str] = None):
+        """
+        PARAMETERS
+        --------
+        budget
+            The memory budget, in bytes.
+        directory
+            Where to spill values to. Defaults to a temporary directory, removed once the pool is garbage collected.
+        """
+        self.budget = budget
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='service_journal_spill_')
+            weakref.finalize(self, shutil.rmtree, directory, True)
+        else:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.stores: Dict[str, 'SpillStore'] = {}
+        # Estimated size of every resident value by (store name, key), least recently used first
+        self.resident: 'OrderedDict[Tuple[str, Hashable], int]' = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.spills = 0
+
+    def store(self, name: str, sizer: Callable[[Any], int]) -> 'SpillStore':
+        """
+        Makes a store drawing on this pool's budget.
+
+        PARAMETERS
+        --------
+        name
+            Unique among the pool's stores, used to name its files.
+        sizer
+            Estimates the memory taken by a value of the store, in bytes.
+        """
+        if name in self.stores:
+            raise ValueError(f'The pool already has a store named {name}.')
+        store = self.stores[name] = SpillStore(self, name, sizer)
+        return store
+
+    def _touch(self, name: str, key: Hashable, size: Optional[int] = None):
+        entry = name, key
+        if size is None:
+            self.resident.move_to_end(entry)
+        else:
+            self.size += size - self.resident.pop(entry, 0)
+            self.resident[entry] = size
+        self._evict()
+
+    def _forget(self, name: str, key: Hashable):
+        self.size -= self.resident.pop((name, key), 0)
+
+    def _evict(self):
+        if self.size <= self.budget:
+            return
+        pinned = {(store.name, store.last_used) for store in self.stores.values()}
+        for name, key in list(self.resident):
+            if self.size <= self.budget:
+                break
+            if (name, key) not in pinned:
+                self.stores[name].spill(key)
+
+    def log_stats(self):
+        logger.info('Spill pool: %s hits, %s misses, %s spills. %.1f of %.1f MB resident.', self.hits, self.misses,
+                    self.spills, self.size / 2 ** 20, self.budget / 2 ** 20)
+
+
+class SpillStore(MutableMapping):
+    """
+    A mapping whose values may be spilled to disk by its SpillPool (see SpillPool.store). Values are written as
+    compressed cache files (see utilities.cache). Iteration follows insertion order, whether values are resident or
+    not. Values are written back whenever they are spilled, so changes made to them in memory are kept.
+    """
+    def __init__(self, pool: SpillPool, name: str, sizer: Callable[[Any], int]):
+        self.pool = pool
+        self.name = name
+        self.sizer = sizer
+        self.last_used: Optional[Hashable] = None
+        # Every key in insertion order, with the number its file is named after
+        self._keys: Dict[Hashable, int] = {}
+        self._next_number = 0
+        self._resident: Dict[Hashable, Any] = {}
+        self._spilled = set()
+
+    def _path(self, key: Hashable) -> str:
+        return os.path.join(self.pool.directory, f'{self.name}-{self._keys[key]}.spill')
+
+    def __getitem__(self, key: Hashable) -> Any:
+        try:
+            value = self._resident[key]
+        except KeyError:
+            if key not in self._spilled:
+                raise
+            value = read_cache(self._path(key), (self.name, key))
+            if value is None:
+                raise KeyError(key) from None
+            self.pool.misses += 1
+            # The value is written again if it is spilled again
+            self._discard_file(key)
+            self._resident[key] = value
+            self.last_used = key
+            self.pool._touch(self.name, key, self.sizer(value))
+            return value
+        self.pool.hits += 1
+        self.last_used = key
+        self.pool._touch(self.name, key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        if key not in self._keys:
+            self._keys[key] = self._next_number
+            self._next_number += 1
+        self._discard_file(key)
+        self._resident[key] = value
+        self.last_used = key
+        self.pool._touch(self.name, key, self.sizer(value))
+
+    def __delitem__(self, key: Hashable):
+        self._discard_file(key)
+        if key in self._resident:
+            del self._resident[key]
+            self.pool._forget(self.name, key)
+        del self._keys[key]
+        if self.last_used == key:
+            self.last_used = None
+
+    def _discard_file(self, key: Hashable):
+        if key in self._spilled:
+            self._spilled.discard(key)
+            os.remove(self._path(key))
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._keys))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key) -> bool:
+        return key in self._keys
+
+    def clear(self):
+        for key in list(self._keys):
+            del self[key]
+
+    def spill(self, key: Hashable):
+        """
+        Writes a resident value to disk and drops it from memory.
+        """
+        path = self._path(key)
+        write_cache(path, (self.name, key), self._resident.pop(key), SPILL_COMPRESSION_LEVEL)
+        self._spilled.add(key)
+        self.pool._forget(self.name, key)
+        self.pool.spills += 1
+        logger.debug('Spilled %s %s to %s.', self.name, key, path)
+
+    def is_resident(self, key: Hashable) -> bool:
+        return key in self._resident
@@ -1,15 +1,31 @@
 from datetime import datetime, date, timedelta
 from enum import Enum
-from collections import defaultdict
-from typing import Mapping, Iterable, Any, Callable, Tuple, List, Set, Sequence, MutableMapping, Optional, Sequence
-
+from collections import defaultdict, OrderedDict
+from bisect import bisect_right
+from itertools import islice, accumulate
+from typing import Mapping, Iterable, Any, Callable, Tuple, List, Set, Sequence, MutableMapping, Optional, Sequence, \
+    NamedTuple, Union, Dict
+
+import numpy as np
+import shapely
 from shapely.geometry import Point, LineString
 from shapely.geometry.base import BaseGeometry
-from shapely.ops import split as shapely_split, nearest_points, linemerge
+from shapely.ops import split as shapely_split, nearest_points, linemerge, substring
 import geopy.distance
 from geopy.distance import distance as geo_distance
 from gamlogger import get_default_logger
 
+# Dynamic local imports
+try:
+    from .geodesy import DEFAULT_MODE, PLANAR, distances, cumulative_distances, path_length, feet_to_degrees
+    from .planar import TransverseMercator
+    from .day_index import BlockTripView, DayIndex, ReportRef
+except ImportError:
+    from service_journal.utilities.geodesy import DEFAULT_MODE, PLANAR, distances, cumulative_distances, path_length, \
+        feet_to_degrees
+    from service_journal.utilities.planar import TransverseMercator
+    from service_journal.utilities.day_index import BlockTripView, DayIndex, ReportRef
+
 logger = get_default_logger(__name__)
 
 
@@ -162,67 +178,37 @@ DATE_BUS_TIME = OrganizeOrder.DATE_BUS_TIME
 
 
 def _block_2_bus(mapping: Mapping) -> Mapping:
+    """
+    Gives the reports of each date by bus then trigger time. Views made by _bus_2_block give back the mapping they
+    were made from. Otherwise every report of a trip must be a ReportRef or a mapping with its 'bus' and 'time', and is
+    referenced rather than copied.
+    """
     result = {}
     for date_key, date_value in mapping.items():
+        if isinstance(date_value, BlockTripView):
+            result[date_key] = date_value.index.by_bus()
+            continue
+        day = result[date_key] = {}
         for block, block_value in date_value.items():
             for trip, trip_value in block_value.items():
                 for stop in trip_value:
-                    bus = stop['bus']
-                    trigger_time = stop['time']
+                    if isinstance(stop, ReportRef):
+                        bus, trigger_time, stop = stop
+                    else:
+                        bus, trigger_time = stop['bus'], stop['time']
                     if bus is None or trigger_time is None:
                         logger.warning('Bus or trigger time is None, this should not happen.\nBus:%s\nTrigger Time:%s',
                                        bus, trigger_time)
-                    if date_key not in result:
-                        result[date_key] = {}
-                    if bus not in result[date_key]:
-                        result[date_key][bus] = {}
-                    result[date_key][bus][trigger_time] = {
-                        'lat': stop.get('lat', None),
-                        'lon': stop.get('lon', None),
-                        'dir': stop.get('dir', None),
-                        'operator': stop.get('operator', None),
-                        'depart': stop.get('depart', None),
-                        'boards': stop.get('boards', 0),
-                        'alights': stop.get('alights', 0),
-                        'onboard': stop.get('onboard', 0),
-                        'stop_id': stop.get('stop_id', None),
-                        'name': stop.get('name', None),
-                        'block_number': block,
-                        'route': stop.get('route', set()),
-                        'trip_number': trip,
-                    }
+                    day.setdefault(bus, {})[trigger_time] = stop
     return result
 
 
 def _bus_2_block(mapping: Mapping) -> Mapping:
-    result = {}
-    for date_key, date_value in mapping.items():
-        for bus, bus_value in date_value.items():
-            for trigger, trigger_value in bus_value.items():
-                block = trigger_value['block_number']
-                trip = trigger_value['trip_number']
-                if date_key not in result:
-                    result[date_key] = {}
-                if block not in result[date_key]:
-                    result[date_key][block] = {}
-                if trip not in result[date_key][block]:
-                    result[date_key][block][trip] = []
-                result[date_key][block][trip].append({
-                    'alights': trigger_value.get('alights', 0),
-                    'boards': trigger_value.get('boards', 0),
-                    'onboard': trigger_value.get('onboard', 0),
-                    'bus': bus,
-                    'date_time': trigger,
-                    'day': trigger_value.get('day', None),
-                    'depart': trigger_value.get('depart', None),
-                    'dir': trigger_value.get('dir', None),
-                    'lat': trigger_value.get('lat', None),
-                    'lon': trigger_value.get('lon', None),
-                    'operator': trigger_value.get('operator', None),
-                    'stop_id': trigger_value.get('stop_id', None),
-                    'time': trigger,
-                })
-    return result
+    """
+    Gives the reports of each date by block, then trip, as views over the reports (see DayIndex.by_block). The index
+    is built once per call, keep a DayIndex of the day to reuse it across calls.
+    """
+    return {date_key: DayIndex(date_value).by_block() for date_key, date_value in mapping.items()}
 
 
 reorganize_map: Mapping[OrganizeOrder, Mapping[OrganizeOrder, Callable[[Mapping], Mapping]]] = {
@@ -247,6 +233,87 @@ def reorganize_write_fields(fields: Iterable[str], mapping: Mapping[str, str], w
     """
     return [field for field in write_ordering if mapping.get(field) in fields]
 
+
+def shape_path(shape: Union[Tuple[float, BaseGeometry], BaseGeometry]) -> BaseGeometry:
+    """
+    Gives the geometry of a shape. Shapes are loaded as (distance, path) pairs (see Connection.load_shapes), but may
+    also be given as bare geometries.
+    """
+    return shape[1] if isinstance(shape, tuple) else shape
+
+
+class ShapeReduction(NamedTuple):
+    """
+    How much reduce_shapes shrank a set of shapes.
+    """
+    shapes: int
+    vertices_before: int
+    vertices_after: int
+
+    @property
+    def reduction(self) -> float:
+        """
+        The fraction of vertices removed.
+        """
+        return 1 - self.vertices_after / self.vertices_before if self.vertices_before else 0.0
+
+
+def _vertex_count(geometry: BaseGeometry) -> int:
+    if geometry.is_empty:
+        return 0
+    if hasattr(geometry, 'geoms'):
+        return sum(_vertex_count(part) for part in geometry.geoms)
+    return len(geometry.coords)
+
+
+def _snap_to_grid(geometry: BaseGeometry, grid_size: float) -> BaseGeometry:
+    """
+    Rounds every coordinate of a geometry to a multiple of grid_size.
+    """
+    return shapely.set_precision(geometry, grid_size)
+
+
+def reduce_shapes(shapes: Mapping[Tuple[int, int], Tuple[float, BaseGeometry]], tolerance: Optional[float] = None,
+                  grid_size: Optional[float] = None) -> Tuple[Dict[Tuple[int, int], Tuple[float, BaseGeometry]],
+                                                              ShapeReduction]:
+    """
+    Drops the vertices of every shape that snapping does not need. Shapes are simplified (keeping their topology) and
+    their coordinates are then snapped to a grid. The ends of every shape are kept, so consecutive shapes still meet.
+    A shape that would collapse is kept as it was.
+
+    PARAMETERS
+    --------
+    shapes
+        The shapes, as loaded by Connection.load_shapes.
+    tolerance
+        How far (in the shapes' units) a simplified shape may stray from the original. Not simplified if None.
+    grid_size
+        The size of the grid (in the shapes' units) coordinates are snapped to. Not snapped if None.
+
+    RETURNS
+    --------
+    Tuple[Dict[Tuple[int, int], Tuple[float, BaseGeometry]], ShapeReduction]
+        The reduced shapes, and how many vertices they had before and after.
+    """
+    reduced = {}
+    before = after = 0
+    for key, (distance, path) in shapes.items():
+        if not isinstance(path, BaseGeometry) or path.is_empty:
+            reduced[key] = distance, path
+            continue
+        new_path = path
+        if tolerance:
+            new_path = new_path.simplify(tolerance, preserve_topology=True)
+        if grid_size:
+            new_path = _snap_to_grid(new_path, grid_size)
+        if new_path.is_empty or new_path.length == 0:
+            new_path = path
+        before += _vertex_count(path)
+        after += _vertex_count(new_path)
+        reduced[key] = distance, new_path
+    return reduced, ShapeReduction(len(shapes), before, after)
+
+
 def get_shape_trip(stops: Sequence[int], shapes: Mapping[Tuple[int, int], BaseGeometry]) -> \
         Tuple[Sequence[Tuple[int, int]], LineString, Sequence[BaseGeometry]]:
     """
@@ -259,14 +326,14 @@ def get_shape_trip(stops: Sequence[int], shapes: Mapping[Tuple[int, int], BaseGe
     shapes
         Mapping of from stop to stop that gives an iterable of coordinates that define a shape.
     """
-    logger.info('get_shape_trip on stops: %s', stops)
+    logger.debug('get_shape_trip on stops: %s', stops)
     trip_line_strings = []
     stop2stops = []
     for i in range(len(stops)-1):
         try:
             stop2stop_key = stops[i], stops[i+1]
             stop2stops.append(stop2stop_key)
-            trip_line_strings.append(shapes[stop2stop_key])
+            trip_line_strings.append(shape_path(shapes[stop2stop_key]))
         except IndexError:
             continue
     if(len(trip_line_strings) == 0):
@@ -279,6 +346,253 @@ def get_shape_trip(stops: Sequence[int], shapes: Mapping[Tuple[int, int], BaseGe
     return stop2stops, merged_line, trip_line_strings
 
 
+class Projection(NamedTuple):
+    """
+    A point snapped onto a line: how far along the line it landed, where, and how far the point was from the line (in
+    feet).
+    """
+    progress: float
+    point: Point
+    cross_track: float
+
+
+def project_on_line(point: Point, line: BaseGeometry, current_progress: float = 0.0,
+                    mode: str = DEFAULT_MODE) -> Optional[Projection]:
+    """
+    Snaps a point to the nearest point of a line using linear referencing, without going backwards past
+    current_progress.
+
+    PARAMETERS
+    --------
+    point
+        The point to snap, in (lon, lat).
+    line
+        The line to snap onto, in (lon, lat).
+    current_progress
+        The distance along the line the point cannot be snapped behind.
+    mode
+        How to measure the cross-track distance. See geodesy.distances.
+
+    RETURNS
+    --------
+    Optional[Projection]
+        Where the point snapped to, or None if the line is empty.
+    """
+    if line.is_empty:
+        logger.warning('Line is empty, cannot get distance along line.')
+        return None
+    progress = line.project(point)
+    if progress < current_progress and current_progress >= line.length:
+        # Already at the end of the line, where substring would give a point rather than a line
+        progress = line.length
+    elif progress < current_progress:
+        # The nearest point is behind, so only look at what is left of the line. Rare enough to afford the substring.
+        progress = current_progress + substring(line, current_progress, line.length).project(point)
+    snapped = line.interpolate(progress)
+    return Projection(progress, snapped, float(distances(point.y, point.x, snapped.y, snapped.x, mode)))
+
+
+def project_points(xs: np.ndarray, ys: np.ndarray, vertices: np.ndarray, vertex_progress: np.ndarray,
+                   current_progress: float = 0.0) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Snaps many points onto a line at once, the vectorized counterpart of project_on_line. Each point is projected onto
+    every segment of the line and the closest projection is kept. Progress is then kept from going backwards with a
+    cumulative max, starting at current_progress, so a point behind the previous one is held where the previous one
+    was rather than searched for further along the line.
+
+    PARAMETERS
+    --------
+    xs, ys
+        The coordinates of the points, in order, in the line's units.
+    vertices
+        The (n, 2) coordinates of the line's vertices.
+    vertex_progress
+        The distance along the line at each vertex. See _vertex_distances.
+    current_progress
+        The distance along the line the first point cannot be snapped behind.
+
+    RETURNS
+    --------
+    Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]
+        The progress of each point along the line and the coordinates of the snapped points, or None if the line has
+        fewer than two vertices.
+    """
+    if len(vertices) < 2:
+        logger.warning('Line is empty, cannot get distance along line.')
+        return None
+    starts = vertices[:-1]
+    deltas = vertices[1:] - starts
+    lengths2 = np.einsum('ij,ij->i', deltas, deltas)
+    # Offsets of every point from the start of every segment, shape (points, segments)
+    px = xs[:, None] - starts[:, 0]
+    py = ys[:, None] - starts[:, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(lengths2 > 0, (px * deltas[:, 0] + py * deltas[:, 1]) / lengths2, 0.0)
+    np.clip(t, 0.0, 1.0, out=t)
+    dx = px - t * deltas[:, 0]
+    dy = py - t * deltas[:, 1]
+    nearest = np.argmin(dx * dx + dy * dy, axis=1)
+    fraction = t[np.arange(len(nearest)), nearest]
+    progress = vertex_progress[nearest] + fraction * (vertex_progress[nearest + 1] - vertex_progress[nearest])
+    progress = np.maximum.accumulate(np.maximum(progress, current_progress))
+    return progress, np.interp(progress, vertex_progress, vertices[:, 0]), np.interp(progress, vertex_progress,
+                                                                                      vertices[:, 1])
+
+
+def _vertex_distances(line: BaseGeometry, mode: str = DEFAULT_MODE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Gives the distance along a line (in its own units, and in feet) at each of its vertices.
+    """
+    if line.is_empty:
+        return np.zeros(0), np.zeros(0)
+    coords = np.asarray(line.coords)[:, :2]
+    progress = np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(coords, axis=0).T))))
+    return progress, cumulative_distances(coords, mode)
+
+
+class TripShape(NamedTuple):
+    """
+    The shape of a trip, as given by get_shape_trip, along with the length of each of its segments and the distance
+    along the trip at which each segment ends. Also holds the distance along the merged line at each of its vertices,
+    both in the line's units and in feet.
+    """
+    stop2stops: Sequence[Tuple[int, int]]
+    merged_line: LineString
+    trip_line_strings: Sequence[BaseGeometry]
+    segment_lengths: Sequence[float]
+    cumulative_lengths: Sequence[float]
+    vertex_progress: Sequence[float]
+    vertex_feet: Sequence[float]
+    # How distances in feet are measured. See geodesy.distances
+    distance_mode: str = DEFAULT_MODE
+
+    def locate(self, progress: float) -> Optional['TripPosition']:
+        """
+        Finds the segment that a distance along the trip falls on. See get_trip_position.
+        """
+        return get_trip_position(self.stop2stops, self.cumulative_lengths, progress)
+
+    def project(self, point: Point, current_progress: float = 0.0) -> Optional[Projection]:
+        """
+        Snaps a point onto the trip without going backwards past current_progress. See project_on_line.
+        """
+        return project_on_line(point, self.merged_line, current_progress, self.distance_mode)
+
+    def project_many(self, xs: np.ndarray, ys: np.ndarray, current_progress: float = 0.0) -> \
+            Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Snaps many points onto the trip at once, never going backwards. See project_points.
+        """
+        if self.merged_line.is_empty:
+            return None
+        return project_points(xs, ys, np.asarray(self.merged_line.coords)[:, :2], np.asarray(self.vertex_progress),
+                              current_progress)
+
+    def near(self, xs: np.ndarray, ys: np.ndarray, feet: float) -> np.ndarray:
+        """
+        Checks which points are within a distance of the trip. Points outside the trip's bounding box grown by that
+        distance are rejected first, and only the rest are checked against the (prepared) line.
+
+        PARAMETERS
+        --------
+        xs, ys
+            The coordinates of the points, in the trip's units.
+        feet
+            The distance from the trip, in feet. Where the trip is in degrees it is converted at the trip's latitude,
+            rounding towards keeping points.
+
+        RETURNS
+        --------
+        np.ndarray
+            Whether each point is within the distance.
+        """
+        if self.merged_line.is_empty:
+            return np.zeros(len(xs), dtype=bool)
+        min_x, min_y, max_x, max_y = self.merged_line.bounds
+        distance = feet if self.distance_mode == PLANAR else feet_to_degrees(feet, (min_y + max_y) / 2)
+        near = (xs >= min_x - distance) & (xs <= max_x + distance) & (ys >= min_y - distance) & \
+               (ys <= max_y + distance)
+        candidates = np.flatnonzero(near)
+        if len(candidates):
+            near[candidates] = shapely.dwithin(self.merged_line, shapely.points(xs[candidates], ys[candidates]),
+                                               distance)
+        return near
+
+    def feet_along(self, progress: float) -> float:
+        """
+        Converts a distance along the trip (in the line's units) to feet travelled along it.
+        """
+        if len(self.vertex_progress) < 2:
+            return 0.0
+        i = min(max(bisect_right(self.vertex_progress, progress) - 1, 0), len(self.vertex_progress) - 2)
+        start, end = self.vertex_progress[i], self.vertex_progress[i+1]
+        fraction = (progress - start) / (end - start) if end > start else 0.0
+        return float(self.vertex_feet[i] + fraction * (self.vertex_feet[i+1] - self.vertex_feet[i]))
+
+
+def build_trip_shape(stops: Sequence[int], shapes: Mapping[Tuple[int, int], BaseGeometry],
+                     mode: str = DEFAULT_MODE) -> TripShape:
+    """
+    Builds the TripShape of the trip going through the given stops, measuring feet with the given distance mode. See
+    get_shape_trip.
+    """
+    stop2stops, merged_line, trip_line_strings = get_shape_trip(stops, shapes)
+    # Speeds up TripShape.near
+    shapely.prepare(merged_line)
+    segment_lengths = [segment.length for segment in trip_line_strings]
+    return TripShape(stop2stops, merged_line, trip_line_strings, segment_lengths, cumulative_lengths(segment_lengths),
+                     *_vertex_distances(merged_line, mode), mode)
+
+
+class TripShapeCache:
+    """
+    Memoizes the TripShape of every trip by the sequence of stops it goes through, so trips (on any day) sharing a
+    stop sequence share a shape. Holds at most maxsize shapes, evicting the least recently used. Distances in feet are
+    measured with the given distance mode (see geodesy.distances). If the shapes were projected with crs (see
+    Connection.load_shapes), distances are Euclidean and reports must go through to_shape_coords first.
+    """
+    def __init__(self, shapes: Mapping[Tuple[int, int], BaseGeometry], maxsize: int = 2048, mode: str = DEFAULT_MODE,
+                 crs: Optional[TransverseMercator] = None):
+        self.shapes = shapes
+        self.maxsize = maxsize
+        self.crs = crs
+        self.mode = PLANAR if crs is not None else mode
+        self._trip_shapes: 'OrderedDict[Tuple[int, ...], TripShape]' = OrderedDict()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._trip_shapes)
+
+    def to_shape_coords(self, lons, lats) -> Tuple[Any, Any]:
+        """
+        Converts report coordinates (in degrees) to the coordinates the shapes are in.
+        """
+        if self.crs is None:
+            return lons, lats
+        return self.crs.forward(lons, lats)
+
+    def get(self, stops: Iterable[int]) -> TripShape:
+        """
+        Gives the TripShape of the trip going through the given stops, building it if it is not cached.
+
+        PARAMETERS
+        --------
+        stops
+            The stops of the trip, in order. (eg. the keys of a trip's scheduled stops)
+        """
+        key = tuple(stops)
+        trip_shape = self._trip_shapes.get(key)
+        if trip_shape is not None:
+            self.hits += 1
+            self._trip_shapes.move_to_end(key)
+            return trip_shape
+        self.misses += 1
+        trip_shape = self._trip_shapes[key] = build_trip_shape(key, self.shapes, self.mode)
+        if len(self._trip_shapes) > self.maxsize:
+            self._trip_shapes.popitem(last=False)
+        return trip_shape
+
+
 def get_current_distance_on_trip(point: Point, line: LineString, current_shape_progress: float) -> \
         Optional[Tuple[LineString, float, geopy.distance.distance]]:
     """
@@ -287,28 +601,69 @@ def get_current_distance_on_trip(point: Point, line: LineString, current_shape_p
     if(line.is_empty):
         logger.warning('Line is empty, cannot get distance along line.')
         return None
-    _, remaining_line = shapely_split(line, line.interpolate(current_shape_progress)) # Need to confirm this is correct
+    remaining_line = shapely_split(line, line.interpolate(current_shape_progress)).geoms[-1] # Need to confirm this is correct
     _, point_on_line = nearest_points(point, remaining_line)
-    completed, _ = shapely_split(line, point_on_line)
-    return completed, completed.length, geo_distance(point.coords, point_on_line.coords)
+    completed = shapely_split(line, point_on_line).geoms[0]
+    return completed, completed.length, geo_distance(feet=float(distances(point.y, point.x, point_on_line.y,
+                                                                         point_on_line.x)))
 
 
 def get_segment_length(line: LineString) -> geopy.distance.distance:
-    points = line.coords
-    sum_distance = geo_distance((0, 0), (0, 0))
-    if len(points) < 2:
-        return sum_distance
-    for i in range(len(points)-1):
-        sum_distance += geo_distance(points[i].coords, points[i+1].coords)
-    return sum_distance
+    return geo_distance(feet=path_length(line.coords) if not line.is_empty else 0.0)
+
+
+class TripPosition(NamedTuple):
+    """
+    Where a distance along a trip falls: the segment it is on, and how far along that segment it is (0 to 1).
+    """
+    stop2stop: Tuple[int, int]
+    index: int
+    fraction: float
+
+
+def cumulative_lengths(lengths: Iterable[float]) -> List[float]:
+    """
+    Gives the distance along a trip at which each of its segments ends.
+    """
+    return list(accumulate(lengths))
+
+
+def get_trip_position(stop2stops: Sequence[Tuple[int, int]], cumulative: Sequence[float], progress: float) -> \
+        Optional[TripPosition]:
+    """
+    Finds the segment of a trip that a distance along it falls on with a binary search.
+
+    PARAMETERS
+    --------
+    stop2stops
+        The (from_stop, to_stop) key of each segment of the trip, in order.
+    cumulative
+        The distance along the trip at which each segment ends. See cumulative_lengths.
+    progress
+        The distance along the trip.
+
+    RETURNS
+    --------
+    Optional[TripPosition]
+        The segment progress falls on and the fraction of it covered, or None if progress is past the end of the trip.
+        The end of each segment belongs to the next one, except for the end of the trip.
+    """
+    index = bisect_right(cumulative, progress)
+    if index == len(cumulative) and cumulative and progress == cumulative[-1]:
+        # Exactly at the end of the trip
+        index -= 1
+    elif index >= len(cumulative):
+        logger.warning('get_progress got a distance that was longer than all of the shapes put together.')
+        return None
+    start = cumulative[index-1] if index else 0.0
+    length = cumulative[index] - start
+    return TripPosition(stop2stops[index], index, (progress - start) / length if length else 0.0)
 
 
 def get_trip_progress(stop2stops: Sequence[Tuple[int, int]], trip_line_strings, progress):
-    for i, segment in enumerate(trip_line_strings):
-        if progress-segment.length < 0:
-            return stop2stops[i]
-        progress -= segment.length
-    logger.warning('get_progress got a distance that was longer than all of the shapes put together.')
+    position = get_trip_position(stop2stops, cumulative_lengths(segment.length for segment in trip_line_strings),
+                                 progress)
+    return None if position is None else position.stop2stop
 
 
 def get_distance_on_segment_from_report(report: Mapping[str, Any], trip_shape: LineString,
@@ -328,5 +683,30 @@ def get_distance_on_segment_from_report(report: Mapping[str, Any], trip_shape: L
     return get_current_distance_on_trip(Point(report['lon'], report['lat']), trip_shape, prev_shape_progress)
 
 
+def chunked(iterable: Iterable[Any], size: int) -> Iterable[List[Any]]:
+    """
+    Yields lists of up to size consecutive items from iterable.
+
+    PARAMETERS
+    --------
+    iterable
+        The items to split into chunks.
+    size
+        The maximum number of items per chunk. Must be positive.
+
+    RETURNS
+    --------
+    Iterable[List[Any]]
+        A generator of lists, all of length size except possibly the last.
+    """
+    if size < 1:
+        raise ValueError(f'Chunk size must be positive, got {size}.')
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
 def deflt_dict():
     return defaultdict(deflt_dict)
\ No newline at end of file
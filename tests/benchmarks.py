@@ -0,0 +1,182 @@
+"""
+Benchmarks for the ingestion of data read from the database. These are not tests, run them directly:
+
+    python tests/benchmarks.py
+"""
+import tracemalloc
+from collections import OrderedDict, defaultdict
+from datetime import date, datetime, timedelta
+from time import perf_counter
+
+from service_journal.sql_handler.connection import _package_actuals_row, _package_schedule_row, DATE_TIME_FORMAT, \
+    _date_key, DATE_FORMAT
+
+ACTUALS_COLUMNS = ['date', 'block_number', 'trip_number', 'bus', 'trigger_time', 'operator', 'actual_time', 'route',
+                   'direction', 'stop', 'name', 'boards', 'alights', 'onboard', 'type', 'latitude', 'longitude']
+ACTUALS_COL = {attr: i for i, attr in enumerate(ACTUALS_COLUMNS)}
+SCHEDULE_COLUMNS = ['date', 'block_number', 'trip_number', 'route', 'direction', 'stop', 'sched_time']
+SCHEDULE_COL = {attr: i for i, attr in enumerate(SCHEDULE_COLUMNS)}
+
+
+def actuals_rows(reports_per_bus: int, buses: int = 4, duplicate_every: int = 20):
+    """
+    Makes a day of actuals rows, with every duplicate_every-th report repeated (as happens when a bus changes route).
+    """
+    day = date(2020, 1, 1)
+    start = datetime(2020, 1, 1, 5)
+    rows = []
+    for bus in range(buses):
+        for i in range(reports_per_bus):
+            time_ = start + timedelta(seconds=15 * i)
+            row = (day, 7, 1000 + i // 50, 100 + bus, time_, 5, time_, 10, 'N', 0 if i % 4 else 200 + i % 50,
+                   'Stop', 1, 0, 3, 1, 42.44 + i * 1e-5, -76.5 + i * 1e-5)
+            rows.append(row)
+            if i % duplicate_every == 0:
+                rows.append(row[:7] + (11,) + row[8:])
+    return rows
+
+
+def _legacy_package_actuals_row(row, col, acc, to_date_format=DATE_FORMAT, to_time_format=DATE_TIME_FORMAT):
+    """
+    _package_actuals_row before duplicates were looked up by trigger time, kept for comparison.
+    """
+    date_key = _date_key(row[col['date']], to_date_format)
+    bus = acc[date_key][row[col['bus']]]
+    trigger_time = row[col['trigger_time']]
+    if trigger_time in [times.strftime(to_time_format) for times in bus.keys()]:
+        trigger_time_v = bus[trigger_time]
+        trigger_time_v['route'].add(row[col['route']])
+    else:
+        bus[trigger_time] = {
+            'lat': row[col['latitude']], 'lon': row[col['longitude']], 'dir': row[col['direction']],
+            'operator': row[col['operator']], 'depart': row[col['actual_time']], 'boards': row[col['boards']],
+            'alights': row[col['alights']], 'onboard': row[col['onboard']], 'stop_id': row[col['stop']],
+            'name': row[col['name']], 'block_number': row[col['block_number']], 'route': {row[col['route']]},
+            'trip_number': [row[col['trip_number']]],
+        }
+
+
+def _fresh(value) -> str:
+    """
+    Makes a new string object, as the database driver does for every string of every row.
+    """
+    return ''.join(str(value))
+
+
+def day_rows(blocks: int = 100, trips: int = 20, stops: int = 40):
+    """
+    Makes a day of schedule rows and actuals rows, with a bus on every block reporting at every stop. Rows are
+    generated lazily, so only what the packagers keep stays in memory.
+    """
+    day = date(2020, 1, 1)
+    start = datetime(2020, 1, 1, 5)
+
+    def schedule():
+        for block in range(blocks):
+            for trip in range(trips):
+                for stop in range(stops):
+                    yield (day, block, block * trips + trip, _fresh(10 + block % 8), _fresh('NSEW'[trip % 4]),
+                           200 + stop, start + timedelta(minutes=trip * 60 + stop))
+
+    def actuals():
+        for block in range(blocks):
+            for trip in range(trips):
+                for stop in range(stops):
+                    time_ = start + timedelta(minutes=trip * 60 + stop, seconds=block)
+                    yield (day, block, block * trips + trip, 100 + block, time_, _fresh(f'op {block % 50}'), time_,
+                           _fresh(10 + block % 8), _fresh('NSEW'[trip % 4]), 200 + stop, _fresh(f'Stop {stop}'), 1, 0,
+                           3, 1, 42.44 + stop * 1e-4, -76.5 + stop * 1e-4)
+
+    return schedule, actuals
+
+
+def _dict_package_schedule_row(row, col, acc, to_date_format=DATE_FORMAT):
+    """
+    _package_schedule_row before stops were ScheduledStop records, kept for comparison.
+    """
+    block = acc[_date_key(row[col['date']], to_date_format)][row[col['block_number']]]
+    trip_number = row[col['trip_number']]
+    if trip_number not in block:
+        block[trip_number] = {'route': row[col['route']], 'stops': OrderedDict(), 'seq_tracker': 0}
+    stops = block[trip_number]['stops']
+    if row[col['stop']] not in stops:
+        stops[row[col['stop']]] = {
+            'sched_time': row[col['sched_time']], 'direction': row[col['direction']], 'seen': 0, 'bus': None,
+            'confidence_score': 0, 'confidence_factors': [], 'operator': None, 'trigger_time': None, 'boards': 0,
+            'alights': 0, 'onboard': 0, 'name': None,
+        }
+
+
+def _dict_package_actuals_row(row, col, acc, to_date_format=DATE_FORMAT):
+    """
+    _package_actuals_row before reports were AvlReport records, kept for comparison.
+    """
+    bus = acc[_date_key(row[col['date']], to_date_format)][row[col['bus']]]
+    report = bus.get(row[col['trigger_time']])
+    if report is not None:
+        report['route'].add(row[col['route']])
+        if row[col['trip_number']] not in report['trip_number']:
+            report['trip_number'].append(row[col['trip_number']])
+    else:
+        bus[row[col['trigger_time']]] = {
+            'lat': row[col['latitude']], 'lon': row[col['longitude']], 'dir': row[col['direction']],
+            'operator': row[col['operator']], 'depart': row[col['actual_time']], 'boards': row[col['boards']],
+            'alights': row[col['alights']], 'onboard': row[col['onboard']], 'stop_id': row[col['stop']],
+            'name': row[col['name']], 'block_number': row[col['block_number']], 'route': {row[col['route']]},
+            'trip_number': [row[col['trip_number']]],
+        }
+
+
+def _day_memory(schedule_packager, actuals_packager, schedule_rows, report_rows) -> int:
+    tracemalloc.start()
+    schedule = defaultdict(lambda: defaultdict(dict))
+    actuals = defaultdict(lambda: defaultdict(dict))
+    for row in schedule_rows():
+        schedule_packager(row, SCHEDULE_COL, schedule)
+    for row in report_rows():
+        actuals_packager(row, ACTUALS_COL, actuals)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+
+def bench_day_memory(blocks: int = 100, trips: int = 20, stops: int = 40):
+    """
+    Measures the memory held by a day of schedule and actuals once packaged, before and after stops and reports were
+    slotted records with interned strings.
+    """
+    schedule_rows, report_rows = day_rows(blocks, trips, stops)
+    before = _day_memory(_dict_package_schedule_row, _dict_package_actuals_row, schedule_rows,
+                         report_rows)
+    after = _day_memory(_package_schedule_row, _package_actuals_row, schedule_rows, report_rows)
+    count = blocks * trips * stops
+    print(f'Memory per service day ({count} scheduled stops, {count} reports)')
+    print(f'{"before (MB)":>12} {"after (MB)":>12} {"reduction":>10}')
+    print(f'{before / 2 ** 20:>12.1f} {after / 2 ** 20:>12.1f} {1 - after / before:>9.0%}')
+
+
+def _time_ingest(packager, rows) -> float:
+    acc = defaultdict(lambda: defaultdict(dict))
+    start = perf_counter()
+    for row in rows:
+        packager(row, ACTUALS_COL, acc)
+    return perf_counter() - start
+
+
+def bench_actuals_ingest(sizes=(100, 500, 1000, 2000)):
+    """
+    Times the packaging of actuals against the number of reports per bus, before and after duplicate reports were
+    looked up by trigger time.
+    """
+    print('Actuals ingest (4 buses)')
+    print(f'{"reports/bus":>12} {"before (s)":>12} {"after (s)":>12} {"speedup":>9}')
+    for size in sizes:
+        rows = actuals_rows(size)
+        before = _time_ingest(_legacy_package_actuals_row, rows)
+        after = _time_ingest(_package_actuals_row, rows)
+        print(f'{size:>12} {before:>12.4f} {after:>12.4f} {before / after:>8.1f}x')
+
+
+if __name__ == '__main__':
+    bench_actuals_ingest()
+    bench_day_memory()
@@ -1,8 +1,37 @@
+import copy
 import os
+import shutil
+import tempfile
+import threading
+from functools import partial
+import numpy as np
 from unittest import TestCase, mock, main
 from datetime import date
+from typing import List, Tuple
 from service_journal.sql_handler import config
-from service_journal import build_query, QueryTypes
+from service_journal.sql_handler.query_builder import build_query, build_fingerprint, QueryTypes
+from service_journal.sql_handler.connection import Connection, _package_actuals_row, _date_key, process_cursor, \
+    _package_actuals, _package_schedule, ROW_PACKAGERS
+from service_journal.classifications.exceptions import BatchFailed
+from service_journal.classifications.journal import DayReport, Journal
+from service_journal.classifications.processors import _project_bus_reports, build_trip_shapes, process_take1, \
+    MAIN_PRESET
+from geopy.distance import distance as geo_distance
+from service_journal.utilities.utils import project_points, project_on_line, reduce_shapes, build_trip_shape, \
+    TripShapeCache
+from service_journal.utilities import geodesy
+from service_journal.utilities.planar import CRS_PRESETS
+from service_journal.utilities.spatial_index import SegmentIndex, StopGrid
+from service_journal.utilities.records import AvlReport, intern_set, intern_tuple
+from service_journal.utilities.day_index import DayIndex
+from service_journal.utilities.day_store import DayStore, DayStoreBuilder
+from service_journal.utilities.utils import reorganize_map, deflt_dict, DATE_BUS_TIME, DATE_BLOCK_TRIP
+from service_journal.utilities.spill import SpillPool
+from service_journal.utilities.cache import read_cache, write_cache, CACHE_VERSION
+from datetime import datetime
+from shapely.geometry import LineString, MultiLineString, Point
+from benchmarks import ACTUALS_COL, ACTUALS_COLUMNS, SCHEDULE_COLUMNS, actuals_rows, day_rows, \
+    _legacy_package_actuals_row
 
 ENV_EDITS = {
     'JOURNAL_USE_CONFIG_FILE': 'true',
@@ -18,6 +47,67 @@ with mock.patch.dict(os.environ, ENV_EDITS):
     config.setup()
 
 
+class FakeCursor:
+    """
+    Stands in for a pyodbc cursor. Records what is executed, and every execute returns the rows of fetch_rows, with
+    columns named as in columns.
+    """
+    def __init__(self, fetch_rows=(), columns=()):
+        self.fetch_rows = list(fetch_rows)
+        self.description = [(column,) for column in columns]
+        self.executed = []
+        self.executed_many = []
+        self.fast_executemany = False
+        self.fetched = []
+        self._pending = []
+
+    def execute(self, query, *params):
+        self.executed.append((query, params))
+        self._pending = list(self.fetch_rows)
+        return self
+
+    def executemany(self, query, rows):
+        self.executed_many.append((query, list(rows), self.fast_executemany))
+
+    def fetchall(self):
+        rows, self._pending = self._pending, []
+        return rows
+
+    def fetchone(self):
+        return self._pending.pop(0) if self._pending else None
+
+    def fetchmany(self, size):
+        rows, self._pending = self._pending[:size], self._pending[size:]
+        self.fetched.append(len(rows))
+        return rows
+
+
+def fake_connection(**settings) -> Connection:
+    """
+    Makes a Connection on the default config with the given settings, without connecting it.
+    """
+    config_ = copy.deepcopy(config.DEFAULT_CONFIG)
+    config_['settings'].update(settings)
+    return Connection(config_)
+
+
+def old_layout_config() -> dict:
+    """
+    Makes a config laid out as config files were written before range reads and WKB shapes.
+    """
+    config_ = copy.deepcopy(config.DEFAULT_CONFIG)
+    for view in ('actuals', 'scheduled'):
+        view_config = config_['settings']['attr_sql_map']['inputs'][view]
+        del view_config['between']
+        for which_query in ('range', 'range_alternate'):
+            del view_config['filters'][which_query]
+    shapes = config_['settings']['attr_sql_map']['inputs']['shapes']
+    del shapes['fields']['shape_wkb'], shapes['special_fields']['seg_path_wkb'], shapes['exclude'], shapes['fingerprint']
+    for setting in ('range_reads', 'shape_format', 'cache_dir'):
+        del config_['settings'][setting]
+    return config_
+
+
 def normalize_time(datetime_obj):
     try:
         return datetime_obj.strftime('%Y-%m-%d %H:%M:%S.%f')[:-4]
@@ -70,6 +160,55 @@ def check_actuals_equivalence(actuals, expected, print_inequality=True):
     return True
 
 
+class ConfigTests(TestCase):
+
+    def test_old_layout_is_merged_with_defaults(self):
+        old_config = old_layout_config()
+        old_config['settings']['host'] = 'db.example'
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'config.json')
+            config.init_config(old_config, path)
+            read = config.read_config(path)
+        actuals = read['settings']['attr_sql_map']['inputs']['actuals']
+        self.assertEqual((actuals['between']['range'], actuals['filters']['range']), (['date'], []))
+        self.assertEqual((read['settings']['host'], read['settings']['range_reads']), ('db.example', True))
+        self.assertIn('shape_wkb', read['settings']['attr_sql_map']['inputs']['shapes']['fields'])
+        self.assertNotEqual(config.DEFAULT_CONFIG['settings']['host'], 'db.example')
+
+    def test_old_layout_reads_days_one_at_a_time(self):
+        journal = Journal(processors={}, connection=Connection(old_layout_config()))
+        journal.connection.is_open = True
+        self.assertFalse(journal.connection.can_read_range())
+        with mock.patch.object(Connection, 'read', return_value=({}, {})) as read, \
+                mock.patch.object(Connection, 'read_range') as read_range:
+            journal.read_days([date(2020, 1, 1), date(2020, 1, 2), date(2020, 1, 3)])
+        self.assertEqual(read.call_count, 3)
+        read_range.assert_not_called()
+        self.assertTrue(Connection(config.DEFAULT_CONFIG).can_read_range('alternate'))
+
+    def test_old_layout_reads_shapes_as_wkt(self):
+        old_config = old_layout_config()
+        connection = Connection(old_config)
+        connection.fetch_arraysize = None
+        columns = ['fr_stop_num', 'to_stop_num', 'ini_date', 'dist_ft', 'seg_path', 'seg_path_str']
+        cursor = connection.cursors['inputs', 'shapes'] = FakeCursor(
+            [(1, 2, date(2020, 1, 1), 100.0, b'', 'LINESTRING (0 0, 1 1)')], columns)
+        # The default shape_format is used
+        self.assertEqual(connection._read_shapes(), {(1, 2): (100.0, LineString([(0, 0), (1, 1)]))})
+        self.assertEqual(len(cursor.executed), 1)
+        self.assertIn('CAST(seg_path AS NVARCHAR(4000))', cursor.executed[0][0])
+
+    def test_relative_directories_follow_config_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'config.json')
+            absolute = os.path.join(directory, 'spill')
+            config.init_config({'settings': {'spill_dir': absolute}}, path)
+            settings = config.read_config(path)['settings']
+        self.assertEqual((settings['cache_dir'], settings['spill_dir']),
+                         (os.path.join(directory, '.journal_cache'), absolute))
+        self.assertEqual(config.DEFAULT_CONFIG['settings']['cache_dir'], '.journal_cache')
+
+
 class QueryBuilderTests(TestCase):
 
     def test_select_fields(self):
@@ -124,6 +263,580 @@ class QueryBuilderTests(TestCase):
         self.assertEqual(query1, expected_query, f'Query1 ({query1}) is not what was expected. ({expected_query})')
         self.assertEqual(query2, expected_query, f'Query2 ({query2}) is not what was expected. ({expected_query})')
 
+    def test_select_between(self):
+        expected_query = 'SELECT one, two, three FROM my_table WHERE one BETWEEN ? AND ? AND two=? ORDER BY one'
+        fields = ['one', 'two', 'three']
+        table = 'my_table'
+        filters = ['two']
+        order_by = ['one']
+        between = ['one']
+        query1 = build_query('select', fields, table, filters, order_by, between=between)
+        query2 = build_query(QueryTypes.SELECT, fields, table, filters, order_by, between=between)
+        self.assertEqual(query1, expected_query, f'Query1 ({query1}) is not what was expected. ({expected_query})')
+        self.assertEqual(query2, expected_query, f'Query2 ({query2}) is not what was expected. ({expected_query})')
+
+    def test_select_between_only(self):
+        expected_query = 'SELECT one, two, three FROM my_table WHERE one BETWEEN ? AND ?'
+        fields = ['one', 'two', 'three']
+        table = 'my_table'
+        between = ['one']
+        query1 = build_query('select', fields, table, between=between)
+        query2 = build_query(QueryTypes.SELECT, fields, table, between=between)
+        self.assertEqual(query1, expected_query, f'Query1 ({query1}) is not what was expected. ({expected_query})')
+        self.assertEqual(query2, expected_query, f'Query2 ({query2}) is not what was expected. ({expected_query})')
+
+    def test_fingerprint_group_by(self):
+        expected_query = 'SELECT day, COUNT(*) FROM my_table WHERE day BETWEEN ? AND ? AND one=? GROUP BY day'
+        query = build_fingerprint('my_table', filters=['one'], between=['day'], group_by='day')
+        self.assertEqual(query, expected_query, f'Query ({query}) is not what was expected. ({expected_query})')
+
+    def test_fingerprint_filters(self):
+        expected_query = 'SELECT COUNT(*) FROM my_table WHERE one=? AND two=?'
+        query = build_fingerprint('my_table', filters=['one', 'two'])
+        self.assertEqual(query, expected_query, f'Query ({query}) is not what was expected. ({expected_query})')
+
+    def test_fingerprint_checksum(self):
+        expected_query = 'SELECT COUNT(*), MAX(day), CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM my_table'
+        query = build_fingerprint('my_table', 'day', checksum=True)
+        self.assertEqual(query, expected_query, f'Query ({query}) is not what was expected. ({expected_query})')
+
+
+class ProjectionTests(TestCase):
+
+    def test_project_on_line_past_end(self):
+        line = LineString([(0, 0), (10, 0)])
+        for current_progress in (10.0, 12.0):
+            projection = project_on_line(Point(3, 1), line, current_progress, geodesy.PLANAR)
+            self.assertEqual((projection.progress, projection.point.x), (10.0, 10.0))
+
+    def test_project_points(self):
+        vertices = np.array([[0., 0.], [10., 0.], [10., 10.]])
+        vertex_progress = np.array([0., 10., 20.])
+        xs, ys = np.array([2., 12., 5., 9.]), np.array([1., 5., -1., 8.])
+        progress, snapped_xs, snapped_ys = project_points(xs, ys, vertices, vertex_progress)
+        # The third point is behind the second, so it is held where the second one was
+        np.testing.assert_allclose(progress, [2., 15., 15., 18.])
+        np.testing.assert_allclose(snapped_xs, [2., 10., 10., 10.])
+        np.testing.assert_allclose(snapped_ys, [0., 5., 5., 8.])
+
+    def test_project_points_current_progress(self):
+        vertices = np.array([[0., 0.], [10., 0.]])
+        progress, _, _ = project_points(np.array([1., 7.]), np.array([0., 0.]), vertices, np.array([0., 10.]), 4.)
+        np.testing.assert_allclose(progress, [4., 7.])
+
+    def test_trip_shape_near(self):
+        shapes = {(1, 2): (10., LineString([(0, 0), (10, 0)])), (2, 3): (10., LineString([(10, 0), (10, 10)]))}
+        trip_shape = build_trip_shape([1, 2, 3], shapes, geodesy.PLANAR)
+        near = trip_shape.near(np.array([5., 15., 50., 12.]), np.array([2., 5., 50., -2.]), 4.)
+        self.assertEqual(near.tolist(), [True, False, False, True])
+
+    def test_reduce_shapes(self):
+        xs = np.linspace(0., 1000., 200)
+        shapes = {(1, 2): (1000., LineString(np.column_stack([xs, np.sin(xs / 100)]))),
+                  (2, 3): (10., LineString([(1000., np.sin(10.)), (1000., 10.)]))}
+        reduced, reduction = reduce_shapes(shapes, tolerance=2., grid_size=.5)
+        self.assertEqual(reduction.vertices_before, 202)
+        self.assertLess(reduction.vertices_after, 20)
+        self.assertLessEqual(reduced[(1, 2)][1].hausdorff_distance(shapes[(1, 2)][1]), 2.5)
+        # Consecutive shapes still meet
+        self.assertEqual(reduced[(1, 2)][1].coords[-1], reduced[(2, 3)][1].coords[0])
+
+    def test_unbuildable_trip_shapes_are_skipped(self):
+        shapes = {(1, 2): (10., LineString([(0, 0), (10, 0)])), (2, 3): (10., LineString([(10, 0), (10, 10)])),
+                  (2, 4): (10., MultiLineString([[(10, 0), (15, 0)], [(16, 0), (20, 0)]])), (2, 5): (10., None)}
+        day_schedule = {7: {trip_number: {'stops': {stop_id: {'seen': 0, 'confidence_factors': [], 'trigger_time': None,
+                                                              'operator': None, 'boards': 0, 'alights': 0,
+                                                              'onboard': 0, 'bus': None} for stop_id in stops}}
+                            for trip_number, stops in ((1000, (1, 2, 3)), (1001, (1, 2, 4)), (1002, (1, 2, 5)))}}
+
+        def report(trip):
+            return AvlReport(0., 5., 'N', 'op', None, 1, 0, 3, 0, 'Stop', 7, intern_set(10), intern_tuple(trip))
+        times = [datetime(2020, 1, 1, 6, minute) for minute in range(3)]
+        journal = Journal(config={'settings': {'distance_mode': geodesy.PLANAR}},
+                          schedule={'2020-01-01': day_schedule}, shapes=shapes,
+                          avl_dict={'2020-01-01': {101: dict(zip(times, map(report, (1001, 1002, 1000))))}})
+        for batch in (True, False):
+            journal.config['settings']['batch_projection'] = batch
+            journal.trip_shapes = None
+            build_trip_shapes(journal)
+            self.assertEqual(len(journal.trip_shapes), 1)
+            # The day goes on without the reports on the trips that have no shape
+            process_take1(journal)
+            self.assertEqual(journal.distance_traveled['2020-01-01'][101], 5.)
+        self.assertEqual([stop['seen'] for stop in day_schedule[7][1001]['stops'].values()], [0, 0, 0])
+
+
+class GeodesyTests(TestCase):
+    # A wandering path around Ithaca with vertices a few dozen feet apart, like the segments of our shapes
+    rng = np.random.default_rng(42)
+    path = np.column_stack([-76.5 + np.cumsum(rng.normal(scale=3e-4, size=500)),
+                            42.44 + np.cumsum(rng.normal(scale=3e-4, size=500))])
+    expected = np.array([geo_distance(a[::-1], b[::-1]).feet for a, b in zip(path, path[1:])])
+
+    def test_lambert_matches_geopy(self):
+        np.testing.assert_allclose(geodesy.path_distances(self.path, geodesy.LAMBERT), self.expected, rtol=1e-5)
+
+    def test_haversine_matches_geopy(self):
+        np.testing.assert_allclose(geodesy.path_distances(self.path, geodesy.HAVERSINE), self.expected, rtol=5e-3)
+
+    def test_cumulative_distances(self):
+        cumulative = geodesy.cumulative_distances(self.path)
+        self.assertEqual(cumulative[0], 0.)
+        self.assertAlmostEqual(cumulative[-1], self.expected.sum(), delta=self.expected.sum() * 1e-5)
+
+    def test_planar_projection(self):
+        crs = CRS_PRESETS['ny_central']
+        x, y = crs.forward(crs.lon_0, crs.lat_0)
+        self.assertAlmostEqual(float(x), 250000 / 0.3048006096, places=3)
+        self.assertAlmostEqual(float(y), 0., places=6)
+        # Grid distances are within the zone's scale error (under 1:10,000) of the geodesic ones
+        xs, ys = crs.forward(self.path[:, 0], self.path[:, 1])
+        np.testing.assert_allclose(geodesy.path_distances(np.column_stack([xs, ys]), geodesy.PLANAR), self.expected,
+                                   rtol=1e-4)
+
+
+class SpatialIndexTests(TestCase):
+
+    def test_stop_grid_matches_brute_force(self):
+        rng = np.random.default_rng(7)
+        locations = {stop: tuple(location) for stop, location in enumerate(rng.uniform(0, 1000, size=(300, 2)))}
+        grid = StopGrid(locations)
+        for x, y in rng.uniform(-100, 1100, size=(50, 2)):
+            expected = min(locations, key=lambda stop: np.hypot(locations[stop][1] - x, locations[stop][0] - y))
+            self.assertEqual(grid.nearest(x, y)[0], expected)
+
+    def test_stop_grid_max_distance(self):
+        grid = StopGrid({1: (0., 0.), 2: (0., 10.), 3: (1000., 1000.)}, cell_size=5.)
+        self.assertEqual(grid.nearest(13., 0., max_distance=5.), (2, 3.))
+        self.assertEqual(grid.nearest(13., 0., max_distance=2.), None)
+        self.assertEqual(grid.nearest(500., 500., max_distance=100.), None)
+        self.assertEqual(grid.nearest(800., 800.)[0], 3)
+        self.assertEqual(grid.nearest_many([13., 500.], [0., 500.], max_distance=5.), [(2, 3.), None])
+
+    def test_segment_index(self):
+        shapes = {(1, 2): (100., LineString([(0, 0), (10, 0)])), (2, 3): (100., LineString([(10, 0), (10, 10)]))}
+        self.assertEqual(SegmentIndex(shapes).nearest([3., 12.], [1., 6.]), [(1, 2), (2, 3)])
+
+
+class RecordTests(TestCase):
+
+    def test_avl_report_mapping(self):
+        report = AvlReport(42.4, -76.5, 'N', 'op 5', None, 1, 0, 3, 200, 'Stop', 7, intern_set(10), intern_tuple(1000))
+        other = AvlReport(42.4, -76.5, 'N', 'op 5', None, 1, 0, 3, 200, 'Stop', 7, intern_set(10), intern_tuple(1000))
+        report['boards'] += 2
+        report.add_route(11)
+        report.add_trip_number(1000)
+        self.assertEqual((report['boards'], report['route'], report['trip_number']), (3, {10, 11}, (1000,)))
+        # The route other shares with report is not changed under it
+        self.assertEqual(other.route, {10})
+        self.assertEqual(dict(report)['stop_id'], 200)
+        self.assertIsNone(report.get('seq_tracker'))
+        with self.assertRaises(KeyError):
+            report['seq_tracker'] = 0
+        # Methods and other attributes are not keys
+        for key in ('get', 'keys', 'add_route', '__class__', '_fields', ['lat']):
+            with self.assertRaises(KeyError):
+                report[key]
+        self.assertIsNone(report.get('items'))
+        self.assertEqual(report.get('lat'), 42.4)
+
+
+class PackagerTests(TestCase):
+
+    def test_duplicate_trigger_time_merges(self):
+        columns = ['date', 'block_number', 'trip_number', 'bus', 'trigger_time', 'operator', 'actual_time', 'route',
+                   'direction', 'stop', 'name', 'boards', 'alights', 'onboard', 'latitude', 'longitude']
+        col = {attr: i for i, attr in enumerate(columns)}
+        time_ = datetime(2020, 1, 1, 6)
+        first = (date(2020, 1, 1), 7, 1000, 101, time_, 'op', time_, 10, 'N', 200, 'Stop', 2, 1, 5, 42.4, -76.5)
+        # The same report as the bus changes route and trip, seen again by the second trip
+        second = first[:2] + (1001,) + first[3:7] + (11,) + first[8:11] + (3, 4, 4) + first[14:]
+        acc = deflt_dict()
+        for row in (first, second, first[:7] + (11,) + first[8:11] + (0, 0, 0) + first[14:]):
+            _package_actuals_row(row, col, acc)
+        reports = acc['2020-01-01'][101]
+        self.assertEqual(list(reports), [time_])
+        report = reports[time_]
+        # As before: the first row's report is kept, routes are a set, trip numbers are appended in the order seen
+        # without repeats, boards and alights are summed and onboard is the highest seen.
+        self.assertEqual((report['route'], report['trip_number']), ({10, 11}, (1000, 1001)))
+        self.assertEqual((report['boards'], report['alights'], report['onboard']), (5, 5, 5))
+        self.assertEqual((report['stop_id'], report['operator'], report['lat']), (200, 'op', 42.4))
+
+    def test_ingest_matches_legacy(self):
+        legacy, packaged = deflt_dict(), deflt_dict()
+        for row in actuals_rows(60, buses=3, duplicate_every=20):
+            _legacy_package_actuals_row(row, ACTUALS_COL, legacy)
+            _package_actuals_row(row, ACTUALS_COL, packaged)
+        self.assertEqual([(bus, list(reports)) for bus, reports in packaged['2020-01-01'].items()],
+                         [(bus, list(reports)) for bus, reports in legacy['2020-01-01'].items()])
+        merged = 0
+        for bus, reports in legacy['2020-01-01'].items():
+            for time_, expected in reports.items():
+                report = packaged['2020-01-01'][bus][time_]
+                if len(report['route']) > 1:
+                    merged += 1
+                    # The legacy check never found duplicates, so the repeated row (on route 11) replaced the report
+                    # instead of merging into it
+                    expected = dict(expected, route={10, 11}, boards=2 * expected['boards'],
+                                    alights=2 * expected['alights'])
+                self.assertEqual(dict(report, route=set(report['route']), trip_number=list(report['trip_number'])),
+                                 expected)
+        # Every 20th report of each bus is repeated
+        self.assertEqual(merged, 9)
+
+    def test_streamed_chunks_match_one_at_a_time(self):
+        schedule_rows, _ = day_rows(blocks=2, trips=3, stops=5)
+        for packager, columns, rows in ((_package_schedule, SCHEDULE_COLUMNS, list(schedule_rows())),
+                                        (_package_actuals, ACTUALS_COLUMNS, actuals_rows(30, buses=2))):
+            sql_attr_map = {column: column for column in columns}
+            expected = process_cursor(FakeCursor(rows, columns).execute(''), sql_attr_map, packager)
+            row_packager = mock.Mock(wraps=ROW_PACKAGERS[packager])
+            chunks = []
+            cursor = FakeCursor(rows, columns).execute('')
+            with mock.patch.dict(ROW_PACKAGERS, {packager: row_packager}):
+                streamed = process_cursor(cursor, sql_attr_map, packager, arraysize=7,
+                                          on_rows=lambda chunk, col: chunks.append(len(chunk)))
+            self.assertEqual(streamed, expected)
+            # Every row went through the positional packager, 7 at a time
+            self.assertEqual(row_packager.call_count, len(rows))
+            self.assertEqual(cursor.fetched, [7] * (len(rows) // 7) + [len(rows) % 7, 0])
+            self.assertEqual(chunks, cursor.fetched[:-1])
+
+
+class DayIndexTests(TestCase):
+
+    def test_reorganize_views(self):
+        def report(block, trip):
+            return AvlReport(42.4, -76.5, 'N', 'op', None, 1, 0, 3, 0, 'Stop', block, intern_set(10),
+                             intern_tuple(trip))
+        day_actuals = {
+            101: {datetime(2020, 1, 1, 6, 5): report(7, 1000), datetime(2020, 1, 1, 7): report(8, 2000)},
+            102: {datetime(2020, 1, 1, 6): report(7, 1000)},
+        }
+        by_block = reorganize_map[DATE_BUS_TIME][DATE_BLOCK_TRIP]({'2020-01-01': day_actuals})
+        trip = by_block['2020-01-01'][7][1000]
+        self.assertEqual([(ref.bus, ref.time.hour) for ref in trip], [(102, 6), (101, 6)])
+        self.assertIs(trip[1].report, day_actuals[101][datetime(2020, 1, 1, 6, 5)])
+        self.assertIs(reorganize_map[DATE_BLOCK_TRIP][DATE_BUS_TIME](by_block)['2020-01-01'], day_actuals)
+
+    def test_empty_day(self):
+        index = DayIndex({})
+        self.assertEqual((len(index), index.offsets.tolist(), index.by_block()), (0, [0], {}))
+        self.assertEqual(reorganize_map[DATE_BUS_TIME][DATE_BLOCK_TRIP]({'2020-01-01': {}}), {'2020-01-01': {}})
+
+
+class DayStoreTests(TestCase):
+
+    def test_builder_matches_packaged(self):
+        rows = actuals_rows(120, buses=3, duplicate_every=20)
+        packaged, builder = deflt_dict(), DayStoreBuilder(_date_key)
+        for row in rows:
+            _package_actuals_row(row, ACTUALS_COL, packaged)
+        # Fetched in chunks, some of which split a bus's reports
+        for start in range(0, len(rows), 50):
+            builder.add_rows(rows[start:start + 50], ACTUALS_COL)
+        stores = builder.build()
+        self.assertEqual(list(stores), ['2020-01-01'])
+        store, day_actuals = stores['2020-01-01'], packaged['2020-01-01']
+        self.assertEqual(list(store), list(day_actuals))
+        for bus, reports in store.items():
+            self.assertTrue(np.shares_memory(reports, store.reports))
+            bus_data = day_actuals[bus]
+            self.assertEqual(reports['time'].tolist(), list(bus_data))
+            self.assertEqual([store.values['stop_id'][code] for code in reports['stop_id'].tolist()],
+                             [report['stop_id'] for report in bus_data.values()])
+            self.assertEqual([store.values['trip'][code] for code in reports['trip'].tolist()],
+                             [(report['block_number'], report['trip_number'][0]) for report in bus_data.values()])
+            # Duplicates are merged as the packaged reports merge them
+            self.assertEqual(reports['boards'].tolist(), [report['boards'] for report in bus_data.values()])
+            self.assertEqual(reports['lat'].tolist(), [report['lat'] for report in bus_data.values()])
+        np.testing.assert_array_equal(store.reports, DayStore.from_actuals(day_actuals).reports)
+
+    def test_projection_matches_dict(self):
+        shapes = {(1, 2): (10., LineString([(0, 0), (10, 0)])), (2, 3): (10., LineString([(10, 0), (10, 10)]))}
+        stops = {stop_id: None for stop_id in (1, 2, 3)}
+        day_schedule = {7: {1000: {'stops': stops}, 1001: {'stops': stops}}}
+
+        def report(x, y, trip, stop_id=0):
+            return AvlReport(y, x, 'N', 'op', None, 1, 0, 3, stop_id, 'Stop', 7, intern_set(10), intern_tuple(trip))
+        start = datetime(2020, 1, 1, 6)
+        positions = [(1, 1, 1000), (3, 0, 1000, 2), (5, 30, 1000), (7, -1, 1000), (9, 1, 9999), (10, 2, 1001),
+                     (11, 6, 1001), (0, 0, 1000)]
+        bus_data = {start.replace(minute=i): report(*position) for i, position in enumerate(positions)}
+        store = DayStore.from_actuals({101: bus_data})
+        trip_shapes = TripShapeCache(shapes, mode=geodesy.PLANAR)
+        expected = _project_bus_reports(bus_data, day_schedule, trip_shapes, 4.)
+        projections, rejected = _project_bus_reports(bus_data, day_schedule, trip_shapes, 4.,
+                                                     (store, store.bus(101)))
+        self.assertEqual(rejected, expected[1])
+        self.assertEqual(len(rejected), 1)
+        self.assertEqual({time_: (p.progress, p.point.x, p.point.y, p.cross_track) for time_, p in projections.items()},
+                         {time_: (p.progress, p.point.x, p.point.y, p.cross_track) for time_, p in expected[0].items()})
+        self.assertEqual(len(projections), 5)
+
+    def test_journal_keeps_read_stores(self):
+        journal = Journal(processors={})
+        day_actuals = {101: {datetime(2020, 1, 1, 6): AvlReport(42.4, -76.5, 'N', 'op', None, 1, 0, 3, 0, 'Stop', 7,
+                                                                 intern_set(10), intern_tuple(1000))}}
+        store = DayStore.from_actuals(day_actuals)
+        journal._update_read(({}, {'2020-01-01': day_actuals}), {'2020-01-01': store})
+        self.assertIs(journal.day_store('2020-01-01'), store)
+        # New actuals for the day replace its store
+        journal.update(avl_dict={'2020-01-01': {}})
+        self.assertEqual(len(journal.day_store('2020-01-01')), 0)
+
+
+class SpillTests(TestCase):
+
+    def test_spill_store(self):
+        pool = SpillPool(budget=2)
+        store = pool.store('schedule', len)
+        for day in range(4):
+            store[day] = {'stops': [day]}
+        # Only the two most recently used days fit
+        self.assertEqual([store.is_resident(day) for day in range(4)], [False, False, True, True])
+        store[0]['stops'].append('seen')
+        store[1]['stops'].append('seen')
+        self.assertEqual(store[0], {'stops': [0, 'seen']})
+        self.assertEqual(list(store.items())[3], (3, {'stops': [3]}))
+        self.assertEqual((pool.hits, pool.misses), (3, 4))
+        del store[2]
+        store.clear()
+        self.assertEqual((len(store), pool.size, os.listdir(pool.directory)), (0, 0, []))
+
+
+class SnapshotTests(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.connection = fake_connection(cache_dir=self.cache_dir, day_snapshots=True)
+        self.cursors = {view: FakeCursor([(date(2020, 1, 2), 3)]) for view in ('scheduled', 'actuals')}
+        self.connection.cursors = {('inputs', view): cursor for view, cursor in self.cursors.items()}
+        self.read = mock.Mock(return_value=({'2020-01-02': {7: 'schedule'}}, {'2020-01-02': {101: 'actuals'}}))
+        self.connection._read = self.read
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_snapshot_hit_miss_and_stale(self):
+        day = date(2020, 1, 2)
+        # Miss: read from the database and snapshot
+        schedule, actuals = self.connection.read(day)
+        self.assertEqual((self.read.call_count, actuals['2020-01-02']), (1, {101: 'actuals'}))
+        # Hit: loaded from the snapshot
+        schedule, actuals = self.connection.read(day)
+        self.assertEqual((self.read.call_count, schedule['2020-01-02']), (1, {7: 'schedule'}))
+        # A single grouped probe per view and read
+        self.assertEqual([len(cursor.executed) for cursor in self.cursors.values()], [2, 2])
+        self.assertIn('GROUP BY', self.cursors['actuals'].executed[0][0])
+        # Stale: the day's row count changed
+        self.cursors['actuals'].fetch_rows = [(date(2020, 1, 2), 4)]
+        self.connection.read(day)
+        self.assertEqual(self.read.call_count, 2)
+
+
+class CacheTests(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_round_trip_and_invalidation(self):
+        path = os.path.join(self.cache_dir, 'nested', 'shapes.cache')
+        self.assertIsNone(read_cache(path, (3,)))
+        write_cache(path, (3, date(2020, 1, 1)), {(1, 2): (10., b'wkb')})
+        self.assertEqual(read_cache(path, (3, date(2020, 1, 1))), {(1, 2): (10., b'wkb')})
+        # A different fingerprint, or a file of another version or not written by write_cache, is a miss
+        self.assertIsNone(read_cache(path, (4, date(2020, 1, 1))))
+        with mock.patch('service_journal.utilities.cache.CACHE_VERSION', CACHE_VERSION + 1):
+            self.assertIsNone(read_cache(path, (3, date(2020, 1, 1))))
+        with open(path, 'wb') as f:
+            f.write(b'not a cache')
+        self.assertIsNone(read_cache(path, (3, date(2020, 1, 1))))
+
+    def test_stop_locations_follow_checksum(self):
+        connection = fake_connection(cache_dir=self.cache_dir)
+        cursor = connection.cursors['inputs', 'stop_locations'] = FakeCursor([(2, 1234)])
+        load = mock.Mock(return_value={200: (42.4, -76.5), 201: (42.5, -76.6)})
+        for _ in range(2):
+            self.assertEqual(connection._load_cached('stop_locations', load, dict, dict), load.return_value)
+        self.assertEqual(load.call_count, 1)
+        self.assertIn('CHECKSUM_AGG', cursor.executed[0][0])
+        # A stop moved, so the row count is the same but the checksum is not
+        cursor.fetch_rows = [(2, 5678)]
+        connection._load_cached('stop_locations', load, dict, dict)
+        self.assertEqual(load.call_count, 2)
+
+
+class ConcurrentReadTests(TestCase):
+
+    def setUp(self):
+        self.connection = fake_connection(concurrent_reads=True, fetch_arraysize=10, day_snapshots=False)
+        schedule_rows, _ = day_rows(blocks=2, trips=2, stops=3)
+        rows = {'scheduled': list(schedule_rows()), 'actuals': actuals_rows(20, buses=2)}
+        # Each view waits for the other, so the read only gets through if both run at the same time
+        both_running = threading.Barrier(2, timeout=5)
+        self.cursors = {}
+        for view in ('scheduled', 'actuals'):
+            plan = self.connection._get_plan(view)
+            cursor = FakeCursor(rows[view], [plan.attr_sql_map[attr] for attr in plan.attrs])
+            cursor.execute = mock.Mock(side_effect=lambda *args, cursor=cursor: (
+                both_running.wait(), FakeCursor.execute(cursor, *args))[1])
+            self.cursors[view] = cursor
+        self.connection.cursors = {('inputs', view): cursor for view, cursor in self.cursors.items()}
+
+    def read_threads(self):
+        return [thread for thread in threading.enumerate() if thread.name.startswith('read')]
+
+    def test_views_read_at_once(self):
+        schedule, actuals = self.connection._read(['2020-01-01'], 'default')
+        self.assertEqual(list(schedule['2020-01-01']), [0, 1])
+        self.assertEqual(sum(len(reports) for reports in actuals['2020-01-01'].values()), 40)
+        self.assertEqual([cursor.fetched[-1] for cursor in self.cursors.values()], [0, 0])
+        self.assertEqual(self.read_threads(), [])
+
+    def test_failing_view_raises(self):
+        self.cursors['actuals'].fetchmany = mock.Mock(side_effect=RuntimeError('Connection lost'))
+        with self.assertRaisesRegex(RuntimeError, 'Connection lost'):
+            self.connection._read(['2020-01-01'], 'default')
+        self.assertEqual(self.read_threads(), [])
+
+
+class WriteManyTests(TestCase):
+
+    def setUp(self):
+        self.connection = fake_connection(write_chunk_size=2)
+        self.cursor = FakeCursor()
+        self.database = mock.Mock()
+        self.database.cursor.return_value = self.cursor
+        self.connection.connections = {'outputs': {'segments': self.database}}
+        self.records = [{'bus': bus, 'date': '2020-01-01'} for bus in range(5)]
+
+    def test_chunks(self):
+        self.assertEqual(self.connection.write_many(self.records), 5)
+        self.assertEqual([len(rows) for _, rows, _ in self.cursor.executed_many], [2, 2, 1])
+        self.assertEqual(self.database.commit.call_count, 3)
+        attrs = self.connection.plans['outputs', 'segments', 'default'].attrs
+        self.assertEqual(self.cursor.executed_many[2][1][0], tuple(self.records[4].get(attr) for attr in attrs))
+        # An explicit chunk size wins over the setting, and nothing is committed without autocommit
+        self.connection.write_many(self.records, autocommit=False, chunk_size=4)
+        self.assertEqual([len(rows) for _, rows, _ in self.cursor.executed_many[3:]], [4, 1])
+        self.assertEqual(self.database.commit.call_count, 3)
+
+    def test_fast_executemany(self):
+        self.connection.write_many(self.records[:1])
+        self.assertTrue(self.cursor.executed_many[0][2])
+        connection = fake_connection(fast_executemany=False)
+        connection.connections = self.connection.connections
+        connection.write_many(self.records[:1])
+        self.assertFalse(self.cursor.executed_many[1][2])
+
+    def test_plan_reuse(self):
+        plan = self.connection.plans['outputs', 'segments', 'default']
+        with mock.patch.object(self.connection, '_build_statement') as build_statement:
+            self.connection.write_many(self.records)
+            self.connection.write(self.records[0])
+        build_statement.assert_not_called()
+        self.assertTrue(all(query is plan.query for query, _, _ in self.cursor.executed_many))
+        # The output's cursor is opened once and reused
+        self.assertEqual(self.database.cursor.call_count, 1)
+
+
+class PipelineTests(TestCase):
+
+    def setUp(self):
+        schedule_rows, report_rows = day_rows(blocks=2, trips=2, stops=3)
+        self.rows = {'scheduled': list(schedule_rows()), 'actuals': list(report_rows())}
+        # Errors to raise when reading a view for a date, by (view, date)
+        self.read_errors = {}
+        patcher = mock.patch.object(Journal, 'read_day_independent')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def execute(self, cursor, view, query, *params):
+        error = self.read_errors.get((view, params[0]))
+        if error is not None:
+            raise error
+        # Every date has the same rows
+        cursor.fetch_rows = [(date.fromisoformat(params[0]),) + row[1:] for row in self.rows[view]]
+        return FakeCursor.execute(cursor, query, *params)
+
+    def journal(self, **settings) -> Tuple[Journal, FakeCursor]:
+        connection = fake_connection(day_snapshots=False, concurrent_reads=False, **settings)
+        connection.is_open = True
+        for view in ('scheduled', 'actuals'):
+            plan = connection._get_plan(view)
+            cursor = FakeCursor(columns=[plan.attr_sql_map[attr] for attr in plan.attrs])
+            cursor.execute = mock.Mock(side_effect=partial(self.execute, cursor, view))
+            connection.cursors['inputs', view] = cursor
+        written = FakeCursor()
+        database = mock.Mock()
+        database.cursor.return_value = written
+        connection.connections = {'outputs': {'segments': database}}
+        journal = Journal(processors={}, connection=connection)
+        journal.install_processor_preset(MAIN_PRESET)
+        return journal, written
+
+    def written_dates(self, journal: Journal, written: FakeCursor) -> List[str]:
+        date_index = journal.connection.plans['outputs', 'segments', 'default'].attrs.index('date')
+        return sorted({row[date_index] for _, rows, _ in written.executed_many for row in rows})
+
+    def assertNoPipelineThreads(self):
+        self.assertEqual([thread.name for thread in threading.enumerate()
+                          if thread.name.startswith(('journal-read', 'journal-write'))], [])
+
+    def test_matches_one_day_at_a_time(self):
+        journal, written = self.journal(pipeline_days=2)
+        journal.process_dates_batch(date(2020, 1, 1), date(2020, 1, 4))
+        self.assertNoPipelineThreads()
+        sequential, sequential_written = self.journal(pipeline_days=0)
+        sequential.process_dates_batch(date(2020, 1, 1), date(2020, 1, 4))
+        self.assertEqual(self.written_dates(journal, written), ['2020-01-01', '2020-01-02', '2020-01-03'])
+        rows = [row for _, chunk, _ in written.executed_many for row in chunk]
+        self.assertEqual(rows, [row for _, chunk, _ in sequential_written.executed_many for row in chunk])
+        # Every scheduled stop was seen by its bus
+        seen_index = journal.connection.plans['outputs', 'segments', 'default'].attrs.index('seen')
+        self.assertEqual((len(rows), {row[seen_index] for row in rows}), (3 * 2 * 2 * 3, {1}))
+
+    def test_read_failure(self):
+        self.read_errors['actuals', '2020-01-02'] = RuntimeError('Read failed')
+        journal, written = self.journal(pipeline_days=2)
+        with self.assertRaisesRegex(RuntimeError, 'Read failed'):
+            journal.process_dates_batch(date(2020, 1, 1), date(2020, 1, 4))
+        self.assertNoPipelineThreads()
+        # The day read before the failure is still written
+        self.assertEqual(self.written_dates(journal, written), ['2020-01-01'])
+
+    def test_write_failure(self):
+        journal, written = self.journal(pipeline_days=2)
+        written.executemany = mock.Mock(side_effect=RuntimeError('Write failed'))
+        with self.assertRaisesRegex(RuntimeError, 'Write failed'):
+            journal.process_dates_batch(date(2020, 1, 1), date(2020, 1, 4))
+        self.assertNoPipelineThreads()
+        # No day is written after the first failed
+        self.assertEqual(written.executemany.call_count, 1)
+
+
+class BatchTests(TestCase):
+
+    def setUp(self):
+        batch_config = copy.deepcopy(config.DEFAULT_CONFIG)
+        batch_config['settings']['batch_workers'] = 2
+        self.journal = Journal(batch_config, processors={})
+
+    def test_parallel_batch_returns_reports(self):
+        reports = [DayReport(from_date, True), DayReport(to_date, True)]
+        with mock.patch.object(Journal, 'process_dates_parallel', return_value=reports):
+            self.assertEqual(self.journal.process_dates_batch(from_date, to_date), reports)
+
+    def test_parallel_batch_raises_on_failure(self):
+        reports = [DayReport(from_date, True), DayReport(to_date, False, error='Traceback')]
+        with mock.patch.object(Journal, 'process_dates_parallel', return_value=reports):
+            with self.assertRaisesRegex(BatchFailed, '1 of 2 days failed: 2020-01-31'):
+                self.journal.process_dates_batch(from_date, to_date)
 
 #
 # class JournalProcessTest(TestCase):